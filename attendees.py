@@ -0,0 +1,248 @@
+# encoding: utf-8
+#
+# A set of person ids, as a bitmap.
+# Copyright © 2010, Will Thompson <will@willthompson.co.uk>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import sys
+from array import array
+
+# Person ids are small and dense (they're allocated sequentially), so a
+# bitmap is both the smallest and the quickest thing to test and compare.
+_TYPECODE = 'L'
+_BITS = array(_TYPECODE).itemsize * 8
+
+class AttendeeSet(object):
+    __slots__ = ('words', 'count')
+
+    def __init__(self, ids=()):
+        self.words = array(_TYPECODE)
+        self.count = 0
+        self.update(ids)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, i):
+        w = i // _BITS
+        return w < len(self.words) and bool(self.words[w] & (1 << (i % _BITS)))
+
+    def __iter__(self):
+        ids = []
+        for w, word in enumerate(self.words):
+            if word:
+                _bits_of(word, w * _BITS, ids)
+        return iter(ids)
+
+    def __eq__(self, other):
+        if not isinstance(other, AttendeeSet):
+            return NotImplemented
+        return self.count == other.count and \
+            self._trimmed() == other._trimmed()
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __repr__(self):
+        return 'AttendeeSet(%r)' % list(self)
+
+    def _trimmed(self):
+        n = len(self.words)
+        while n and not self.words[n - 1]:
+            n -= 1
+        return self.words[:n]
+
+    def _grow(self, w):
+        if w >= len(self.words):
+            self.words.extend([0] * (w + 1 - len(self.words)))
+
+    def add(self, i):
+        w = i // _BITS
+        bit = 1 << (i % _BITS)
+        self._grow(w)
+
+        if not self.words[w] & bit:
+            self.words[w] |= bit
+            self.count += 1
+
+    def discard(self, i):
+        w = i // _BITS
+        bit = 1 << (i % _BITS)
+
+        if w < len(self.words) and self.words[w] & bit:
+            self.words[w] &= ~bit
+            self.count -= 1
+
+    def update(self, ids):
+        for i in ids:
+            self.add(i)
+
+    def difference_update(self, ids):
+        for i in ids:
+            self.discard(i)
+
+    def copy(self):
+        other = AttendeeSet()
+        other.words = array(_TYPECODE, self.words)
+        other.count = self.count
+        return other
+
+    def snapshot(self, base=None):
+        """Returns a Snapshot of who's here now, sharing whatever it can
+        with base, an earlier one."""
+        return Snapshot(self, base)
+
+    def diff(self, newer):
+        """Returns (added, removed): the ids in newer but not in self, and
+        vice versa. Words which are the same in both cost one comparison."""
+        added = []
+        removed = []
+        a = self.words
+        b = newer.words
+
+        for w in xrange(max(len(a), len(b))):
+            x = w < len(a) and a[w] or 0
+            y = w < len(b) and b[w] or 0
+
+            if x != y:
+                base = w * _BITS
+                _bits_of(y & ~x, base, added)
+                _bits_of(x & ~y, base, removed)
+
+        return added, removed
+
+    # Serialized as the little-endian bitmap, trailing zeros trimmed: one
+    # bit per person on the roster, whoever is coming.
+    def tostring(self):
+        words = self._trimmed()
+        if sys.byteorder != 'little':
+            words.byteswap()
+        return words.tostring().rstrip('\0')
+
+    def fromstring(cls, s):
+        s += '\0' * (-len(s) % (_BITS // 8))
+        self = cls()
+        self.words.fromstring(s)
+        if sys.byteorder != 'little':
+            self.words.byteswap()
+        self.count = sum(_popcount(word) for word in self.words)
+        return self
+    fromstring = classmethod(fromstring)
+
+# Snapshots are made of chunks of this many words, shared between snapshots
+# which have them in common.
+_CHUNK = 64
+
+class Snapshot(object):
+    # An AttendeeSet as it was at some point, which can't be changed. A
+    # snapshot made from another keeps any chunk of the bitmap that's the
+    # same in both, rather than a copy of it; so a run of snapshots, each a
+    # few taps on from the last, costs a chunk per change, and diffing two
+    # of them can skip whatever they share without looking at it.
+    __slots__ = ('chunks', 'count')
+
+    def __init__(self, attending, base=None):
+        words = attending.words
+        n = len(words)
+        while n and not words[n - 1]:
+            n -= 1
+
+        old = base is not None and base.chunks or ()
+        chunks = []
+        for c, w in enumerate(xrange(0, n, _CHUNK)):
+            chunk = words[w:min(w + _CHUNK, n)]
+            if c < len(old) and old[c] == chunk:
+                chunk = old[c]
+            chunks.append(chunk)
+
+        self.chunks = tuple(chunks)
+        self.count = attending.count
+
+    def __len__(self):
+        return self.count
+
+    def __eq__(self, other):
+        if not isinstance(other, Snapshot):
+            return NotImplemented
+        return self.count == other.count and self.chunks == other.chunks
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def attendees(self):
+        attending = AttendeeSet()
+        for chunk in self.chunks:
+            attending.words.extend(chunk)
+        attending.count = self.count
+        return attending
+
+    def diff(self, newer):
+        """Like AttendeeSet.diff, but only looking at chunks which the
+        two snapshots don't share."""
+        added = []
+        removed = []
+        a = self.chunks
+        b = newer.chunks
+        empty = ()
+
+        for c in xrange(max(len(a), len(b))):
+            x = c < len(a) and a[c] or empty
+            y = c < len(b) and b[c] or empty
+            if x is y:
+                continue
+
+            base = c * _CHUNK
+            for w in xrange(max(len(x), len(y))):
+                u = w < len(x) and x[w] or 0
+                v = w < len(y) and y[w] or 0
+
+                if u != v:
+                    _bits_of(v & ~u, (base + w) * _BITS, added)
+                    _bits_of(u & ~v, (base + w) * _BITS, removed)
+
+        return added, removed
+
+def _lowest_bit(low):
+    # low has exactly one bit set; which?
+    n = 0
+    while low > 0xff:
+        low >>= 8
+        n += 8
+    while low > 1:
+        low >>= 1
+        n += 1
+    return n
+
+def _bits_of(word, base, into):
+    while word:
+        low = word & -word
+        into.append(base + _lowest_bit(low))
+        word ^= low
+
+def _popcount(word):
+    n = 0
+    while word:
+        word &= word - 1
+        n += 1
+    return n
+
+# vim: sts=4 sw=4
@@ -0,0 +1,417 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Benchmarks for the bits of Bovine Buffet that run on every tap.
+# Copyright © 2010, Will Thompson <will@willthompson.co.uk>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Usage:
+#   ./bench.py --output results.json
+#   ./bench.py --save-baseline bench-baseline.json
+#   ./bench.py --baseline bench-baseline.json   # exits 1 on a regression
+#
+# Runs against fakegtk unless --real-gtk is given, so no display is needed
+# and the numbers are about our code rather than GTK's. Each result is the
+# best of several runs, in seconds, keyed by "benchmark@roster size".
+
+from __future__ import with_statement
+
+import os
+import sys
+import time
+import random
+import shutil
+import platform
+import tempfile
+from optparse import OptionParser
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+DRINKS = ['Coke', 'Diet Coke', 'orange juice', 'water', 'sparkling water',
+          'pomegranate juice', 'tea', 'lemonade']
+
+def synthetic_people(n, seed=42):
+    r = random.Random(seed)
+    for i in xrange(n):
+        yield ('Person %06u' % r.randrange(10 ** 6), r.choice(DRINKS),
+               r.random() < 0.15)
+
+def synthetic_pizzas(n, seed=42):
+    from pizzas import DEFAULT_MENU
+
+    menu = sorted(DEFAULT_MENU)
+    r = random.Random(seed)
+    for name, drink, vegetarian in synthetic_people(n, seed):
+        yield (name, drink, vegetarian, r.choice(menu))
+
+def best_of(repeat, f, setup=None):
+    times = []
+    for _ in xrange(repeat):
+        if setup is not None:
+            setup()
+        start = time.time()
+        f()
+        times.append(time.time() - start)
+    return min(times)
+
+def run_size(n, repeat):
+    import fakegtk
+    import gobject
+    import moo
+    from roster import Roster, default_path
+    from attendees import AttendeeSet
+    from rosters import RosterIndex, OpenRosters, DEFAULT
+    from summary import SummaryAggregator
+
+    results = {}
+
+    def record(name, seconds):
+        results['%s@%u' % (name, n)] = seconds
+
+    # A roster of n people, with about half of them coming.
+    roster = Roster(default_path())
+    roster.import_people(synthetic_people(n))
+    roster.set_attending(AttendeeSet(xrange(0, n, 2)))
+    roster.save()
+
+    record('load', best_of(repeat,
+        lambda: moo.PeopleStore(Roster(default_path()))))
+
+    store = moo.PeopleStore(Roster(default_path()))
+    record('save', best_of(repeat, store.roster.save))
+
+    def tap():
+        attending = store.roster.attending.copy()
+        if 1 in attending:
+            attending.discard(1)
+        else:
+            attending.add(1)
+        store.set_attending(attending)
+
+    def tap_and_flush():
+        tap()
+        store.flush()
+    record('flush_one_tap', best_of(repeat, tap_and_flush))
+
+    def markup_all():
+        for person_id in xrange(len(store.roster)):
+            store._markup(person_id)
+    record('markup_all', best_of(repeat, markup_all,
+        setup=store.markup_cache.clear))
+
+    record('add_person', best_of(repeat,
+        lambda: store.add_person('Newcomer', 'Coke', False)))
+    store.flush()
+
+    mv = moo.MainView()
+    mv.set_store(store)
+
+    # The summary is redrawn when the main loop goes idle; flushing does
+    # that straight away.
+    def reset_summary():
+        mv.aggregator = SummaryAggregator(store.roster)
+        mv.summary_markup = None
+    def summary_full():
+        mv.update_summary(store.roster.attending)
+        mv.repaint.flush()
+    record('update_summary_full', best_of(repeat, summary_full,
+        setup=reset_summary))
+
+    def summary_tap():
+        tap()
+        mv.update_summary(store.roster.attending)
+        mv.repaint.flush()
+    record('update_summary_tap', best_of(repeat, summary_tap))
+
+    # A flurry of taps, as when selecting lots of people quickly, between
+    # two goes round the main loop.
+    def summary_burst():
+        for _ in xrange(20):
+            tap()
+            mv.update_summary(store.roster.attending)
+        mv.repaint.flush()
+    record('update_summary_burst', best_of(repeat, summary_burst))
+
+    pw = mv.get_people_window()
+    positions = store.get_current_attendees()
+    record('select', best_of(repeat,
+        lambda: pw.selector.set_selected_indices(positions)))
+
+    selection = pw.selector.get_selection()
+    def toggle_row():
+        if (1, ) in selection.selected:
+            selection.unselect_path((1, ))
+        else:
+            selection.select_path((1, ))
+    record('selector_changed', best_of(repeat, toggle_row))
+
+    # Taking a tap back again, with the people window open.
+    def undo():
+        mv.undo()
+        mv.repaint.flush()
+    record('undo_tap', best_of(repeat, undo, setup=toggle_row))
+    store.flush()
+
+    # Someone else joins, and is taken in when we next write. The view has
+    # to be shown everyone again: if it wasn't, it won't have a row for
+    # them, so they can't be selected, and they drop out.
+    other = Roster(default_path())
+    other.load()
+    def join():
+        other.add_person('Zz Latecomer', 'Coke', False)
+        other.attending.add(len(other) - 1)
+        other.flush()
+    def take_in():
+        tap()
+        store.flush()
+    record('take_in_merge', best_of(repeat, take_in, setup=join))
+    if len(store.roster) - 1 not in store.roster.attending:
+        raise AssertionError("the people window missed a merge")
+
+    # Round every sort order and back, each already built. Every row moves,
+    # so the view has to be shown the store again each time.
+    pw.next_sort_order()
+    pw.next_sort_order()
+    pw.next_sort_order()
+    def resort():
+        for _ in moo.SORT_ORDERS:
+            pw.next_sort_order()
+    record('sort_orders', best_of(repeat, resort))
+    if pw.get_selected_ids() != store.roster.attending:
+        raise AssertionError("the people window lost track of who's coming")
+
+    # Over to a small roster and back, both already open.
+    index = RosterIndex()
+    index.add('other')
+    rosters = OpenRosters(index,
+        lambda name, path: moo.PeopleStore(Roster(path)))
+    for name in (DEFAULT, 'other'):
+        rosters.get(name)
+
+    def switch():
+        mv.set_store(rosters.get('other'))
+        mv.repaint.flush()
+        mv.set_store(rosters.get(DEFAULT))
+        mv.repaint.flush()
+    record('switch_roster', best_of(repeat, switch))
+
+    # Ordering for everyone in a group of up to a few hundred, all with
+    # usual pizzas, from scratch and after one of them drops out.
+    from pizzas import PizzaOptimiser
+    group = Roster()
+    for person in synthetic_pizzas(min(n, 500)):
+        group.append(*person)
+    everyone = AttendeeSet(xrange(len(group)))
+    optimiser = PizzaOptimiser(group)
+
+    def pizzas_full():
+        optimiser.refresh()
+        optimiser.plan()
+    record('pizzas_full', best_of(repeat, pizzas_full,
+        setup=lambda: optimiser.update(everyone)))
+
+    def pizzas_tap():
+        attending = optimiser.selected.copy()
+        if 0 in attending:
+            attending.discard(0)
+        else:
+            attending.add(0)
+        optimiser.update(attending)
+        optimiser.plan()
+    record('pizzas_tap', best_of(repeat, pizzas_tap))
+
+    # A few dozen taps later, it should be just as if we'd started there.
+    r = random.Random(n)
+    attending = optimiser.selected.copy()
+    for i in r.sample(xrange(len(group)), min(len(group), 30)):
+        if i in attending:
+            attending.discard(i)
+        else:
+            attending.add(i)
+        optimiser.update(attending)
+        optimiser.plan()
+    fresh = PizzaOptimiser(group)
+    fresh.update(attending)
+    if (fresh.plan().price, fresh.plan().saving) != \
+            (optimiser.plan().price, optimiser.plan().saving):
+        raise AssertionError("the pizza order drifted from the taps")
+    check_pizzas()
+
+    gobject.run_pending()
+    return results
+
+def _most_saved(people):
+    # By trying every way of pairing people up: (price, vegetarian, veg
+    # pizza) for each.
+    if len(people) < 2:
+        return 0
+
+    (price, vegetarian, veg_pizza), rest = people[0], people[1:]
+    best = _most_saved(rest)
+    for k, (other, other_vegetarian, other_veg_pizza) in enumerate(rest):
+        if (vegetarian or other_vegetarian) and \
+                not (veg_pizza and other_veg_pizza):
+            continue
+        saving = min(price, other) + _most_saved(rest[:k] + rest[k + 1:])
+        best = max(best, saving)
+    return best
+
+def check_pizzas(groups=200):
+    """Checks the optimiser against brute force on small random groups,
+    some with no pizza or one not on the menu."""
+    from roster import Roster
+    from attendees import AttendeeSet
+    from pizzas import PizzaOptimiser, DEFAULT_MENU
+
+    r = random.Random(42)
+    pizzas = sorted(DEFAULT_MENU) + ['', 'Calzone']
+    for _ in xrange(groups):
+        group = Roster()
+        for k in xrange(r.randrange(10)):
+            group.append('Person %u' % k, 'tea', r.random() < 0.3,
+                         r.choice(pizzas))
+
+        optimiser = PizzaOptimiser(group)
+        optimiser.update(AttendeeSet(xrange(len(group))))
+        people = []
+        for i in xrange(len(group)):
+            if group.pizza(i):
+                price, veg_pizza = optimiser.menu[group.pizza(i)]
+                people.append((price, group.is_vegetarian(i), veg_pizza))
+
+        if optimiser.plan().saving != _most_saved(people):
+            raise AssertionError("the pizza order isn't the cheapest: %r" %
+                list(group))
+
+def run_rotation(repeat):
+    import portrait
+    from fakemaemo import FakePlatform
+
+    # A thousand readings from someone holding the phone at about 45
+    # degrees, on a fake bus.
+    r = random.Random(42)
+    readings = []
+    for _ in xrange(1000):
+        tilt = r.uniform(-200, 200)
+        readings.append((tilt > 0 and 'portrait' or 'landscape',
+                         -707 - tilt, -707 + tilt, r.choice((20, 50, 100))))
+
+    def jitter():
+        platform = FakePlatform()
+        portrait.FremantleRotation('bovine-bench', 'window', platform=platform)
+        for orientation, x, y, ms in readings:
+            platform.orientation(orientation, x, y)
+            platform.advance(ms)
+
+    return { 'rotation_jitter': best_of(repeat, jitter) }
+
+def run(sizes, repeat):
+    results = run_rotation(repeat)
+
+    for n in sizes:
+        home = tempfile.mkdtemp(prefix='bovine-bench-')
+        old_home = os.environ.get('HOME')
+        os.environ['HOME'] = home
+        try:
+            results.update(run_size(n, repeat))
+        finally:
+            if old_home is not None:
+                os.environ['HOME'] = old_home
+            shutil.rmtree(home, True)
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'when': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+def compare(current, baseline, tolerance, floor):
+    """Returns a list of (key, baseline seconds, current seconds) for each
+    benchmark which got more than tolerance times slower, ignoring anything
+    where the difference is under floor seconds."""
+    regressions = []
+
+    for key, then in sorted(baseline['results'].iteritems()):
+        now = current['results'].get(key)
+        if now is None:
+            continue
+
+        if now > then * tolerance and now - then > floor:
+            regressions.append((key, then, now))
+
+    return regressions
+
+def main(argv):
+    parser = OptionParser()
+    parser.add_option('--sizes', default='10,1000,100000',
+        help='comma-separated roster sizes [%default]')
+    parser.add_option('--repeat', type='int', default=5,
+        help='runs of each benchmark to take the best of [%default]')
+    parser.add_option('--output', help='write results here as JSON')
+    parser.add_option('--save-baseline', metavar='FILE',
+        help='write results to FILE, for later --baseline runs')
+    parser.add_option('--baseline', metavar='FILE',
+        help='compare against FILE, and fail if anything regressed')
+    parser.add_option('--tolerance', type='float', default=1.5,
+        help='slowdown factor counted as a regression [%default]')
+    parser.add_option('--floor', type='float', default=0.001,
+        help='ignore slowdowns smaller than this many seconds [%default]')
+    parser.add_option('--real-gtk', action='store_true',
+        help='use the real gtk rather than fakegtk')
+    options, args = parser.parse_args(argv[1:])
+
+    if not options.real_gtk:
+        import fakegtk
+        fakegtk.install()
+
+    sizes = [int(n) for n in options.sizes.split(',')]
+    current = run(sizes, options.repeat)
+
+    for path in (options.output, options.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(current, f, indent=2, sort_keys=True)
+
+    if not options.output:
+        for key, seconds in sorted(current['results'].iteritems()):
+            print '%-28s %10.3f ms' % (key, seconds * 1000)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = compare(current, baseline, options.tolerance,
+                              options.floor)
+        for key, then, now in regressions:
+            print >>sys.stderr, '%s regressed: %.3f ms -> %.3f ms' % (
+                key, then * 1000, now * 1000)
+
+        if regressions:
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
+
+# vim: sts=4 sw=4
@@ -0,0 +1,85 @@
+# encoding: utf-8
+#
+# A catalogue of the drinks people ask for, each under one name.
+# Copyright © 2010, Will Thompson <will@willthompson.co.uk>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+def normalize(drink):
+    """The key drinks are merged on: 'cOKe ' and 'coke' are the same."""
+    return ' '.join(drink.lower().split())
+
+def _display_name(drink):
+    drink = ' '.join(drink.split())
+
+    # Keep 'Coke' and 'Diet Coke', but not 'oRANge juice'.
+    if drink in (drink.lower(), drink.capitalize(), drink.title()):
+        return drink
+    return drink.lower()
+
+class DrinkCatalogue(object):
+    # Typos like 'pomegranite' for 'pomegranate' are folded into the drink
+    # they're this similar to (by difflib's reckoning), if there is one.
+    FUZZ_CUTOFF = 0.9
+
+    def __init__(self):
+        self.names = []
+        self._ids = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, drink_id):
+        return self.names[drink_id]
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def restore(self, names):
+        """Replaces the catalogue with names, as previously found in
+        self.names, keeping their ids."""
+        self.names = list(names)
+        self._ids = dict((normalize(name), drink_id)
+                         for drink_id, name in enumerate(self.names))
+
+    def lookup(self, drink):
+        """Returns the id drink would be interned as, or None if it's new."""
+        key = normalize(drink)
+        drink_id = self._ids.get(key)
+
+        if drink_id is None and key:
+            # Only needed for new drinks, so don't pay for it at startup.
+            import difflib
+
+            close = difflib.get_close_matches(key, self._ids.keys(), 1,
+                                              self.FUZZ_CUTOFF)
+            if close:
+                drink_id = self._ids[close[0]]
+                # Remember the misspelling, so we only go fishing once.
+                self._ids[key] = drink_id
+
+        return drink_id
+
+    def intern(self, drink):
+        drink_id = self.lookup(drink)
+
+        if drink_id is None:
+            drink_id = len(self.names)
+            self.names.append(_display_name(drink))
+            self._ids[normalize(drink)] = drink_id
+
+        return drink_id
+
+# vim: sts=4 sw=4
@@ -0,0 +1,424 @@
+# encoding: utf-8
+#
+# Just enough of pygtk to drive Bovine Buffet without a display.
+# Copyright © 2010, Will Thompson <will@willthompson.co.uk>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+#  ___________________________
+# ( it's not even gtk, really )
+#  ---------------------------
+#
+# install() puts stand-ins for the gtk and gobject modules into sys.modules,
+# so that importing malvern and moo gets these rather than the real thing
+# (and hildon is left to fail to import, as on the desktop). Nothing is
+# drawn; signals are delivered, main loop sources are kept until someone
+# calls run_pending(), and tree selections behave like the real ones,
+# including emitting "changed" once per row.
+
+import sys
+import types
+from xml.sax.saxutils import escape
+
+# gobject
+
+SIGNAL_RUN_FIRST = 1
+TYPE_NONE = None
+
+def type_register(cls):
+    pass
+
+def threads_init():
+    pass
+
+def markup_escape_text(text):
+    return escape(text, { '"': '&quot;', "'": '&apos;' })
+
+_sources = {}
+_next_source = [1]
+
+def _add_source(callback, args):
+    source_id = _next_source[0]
+    _next_source[0] += 1
+    _sources[source_id] = (callback, args)
+    return source_id
+
+def timeout_add(interval, callback, *args):
+    return _add_source(callback, args)
+
+def idle_add(callback, *args):
+    return _add_source(callback, args)
+
+def source_remove(source_id):
+    return _sources.pop(source_id, None) is not None
+
+def run_pending():
+    """Dispatches every source added so far, as if the main loop had gone
+    round; sources which return True stay for next time."""
+    for source_id in sorted(_sources):
+        if source_id not in _sources:
+            continue
+
+        callback, args = _sources[source_id]
+        if not callback(*args):
+            _sources.pop(source_id, None)
+
+class GObject(object):
+    def __init__(self, *args, **kwargs):
+        self._handlers = {}
+        self._next_handler = 1
+        self._stopped = []
+
+    def connect(self, signal, callback, *data):
+        handler_id = self._next_handler
+        self._next_handler += 1
+        self._handlers.setdefault(signal.replace('_', '-'), []).append(
+            (handler_id, callback, data))
+        return handler_id
+
+    connect_after = connect
+
+    def disconnect(self, handler_id):
+        for handlers in self._handlers.values():
+            handlers[:] = [h for h in handlers if h[0] != handler_id]
+
+    def emit(self, signal, *args):
+        signal = signal.replace('_', '-')
+        self._stopped.append(False)
+        try:
+            for _, callback, data in list(self._handlers.get(signal, ())):
+                callback(self, *(args + data))
+                if self._stopped[-1]:
+                    break
+        finally:
+            self._stopped.pop()
+
+    def stop_emission(self, signal):
+        self._stopped[-1] = True
+
+    def set_properties(self, **kwargs):
+        for key, value in kwargs.iteritems():
+            setattr(self, '_prop_' + key, value)
+
+# gtk
+
+POLICY_NEVER, POLICY_AUTOMATIC = range(2)
+SELECTION_MULTIPLE = 3
+TREE_VIEW_COLUMN_FIXED = 2
+TREE_MODEL_LIST_ONLY = 2
+ICON_SIZE_BUTTON = 4
+SORT_ASCENDING = 0
+FILL = 4
+FILE_CHOOSER_ACTION_OPEN = 0
+RESPONSE_APPLY, RESPONSE_OK, RESPONSE_CANCEL = -10, -5, -6
+STOCK_SAVE, STOCK_OPEN, STOCK_CANCEL = 'gtk-save', 'gtk-open', 'gtk-cancel'
+STOCK_NEW = 'gtk-new'
+DIALOG_MODAL = 1
+MESSAGE_ERROR = 3
+BUTTONS_OK = 1
+
+def main():
+    pass
+
+def main_quit(*args):
+    pass
+
+class Widget(GObject):
+    def __init__(self, *args, **kwargs):
+        GObject.__init__(self)
+        self.children = []
+        self.visible = False
+        self.sensitive = True
+
+    def hide_on_delete(self, *args):
+        self.visible = False
+        return True
+
+    def show(self):
+        self.visible = True
+
+    def show_all(self):
+        self.visible = True
+        for child in self.children:
+            child.show_all()
+
+    def hide(self):
+        self.visible = False
+
+    def destroy(self):
+        pass
+
+    def set_sensitive(self, sensitive):
+        self.sensitive = sensitive
+
+    def set_size_request(self, width, height):
+        pass
+
+    def add(self, child):
+        self.children.append(child)
+
+    def pack_start(self, child, expand=True, fill=True, padding=0):
+        self.children.append(child)
+
+    def attach(self, child, *args, **kwargs):
+        self.children.append(child)
+
+class Window(Widget):
+    def set_title(self, title):
+        self.title = title
+
+class Dialog(Window):
+    def __init__(self, *args, **kwargs):
+        Window.__init__(self)
+        self.vbox = Widget()
+
+    def run(self):
+        return RESPONSE_CANCEL
+
+class MessageDialog(Dialog):
+    # Everything ever shown, for whoever's driving us to look at.
+    shown = []
+
+    def __init__(self, parent=None, flags=0, type=0, buttons=0,
+                 message_format=None):
+        Dialog.__init__(self)
+        self.text = message_format
+
+    def run(self):
+        MessageDialog.shown.append(self.text)
+        return RESPONSE_OK
+
+class FileChooserDialog(Dialog):
+    def add_filter(self, f):
+        pass
+
+class FileFilter(object):
+    def set_name(self, name):
+        pass
+
+    def add_pattern(self, pattern):
+        pass
+
+class VBox(Widget):
+    pass
+
+class HBox(Widget):
+    pass
+
+class Table(Widget):
+    def set_col_spacing(self, column, spacing):
+        pass
+
+class ScrolledWindow(Widget):
+    def set_policy(self, h, v):
+        pass
+
+    def add_with_viewport(self, child):
+        self.add(child)
+
+class Label(Widget):
+    def __init__(self, label=''):
+        Widget.__init__(self)
+        self.markup = label
+
+    def set_markup(self, markup):
+        self.markup = markup
+
+    def set_alignment(self, x, y):
+        pass
+
+class Image(Widget):
+    def set_from_icon_name(self, name, size):
+        pass
+
+class Button(Widget):
+    def __init__(self, label=None):
+        Widget.__init__(self)
+        self.label = label
+
+    def set_image(self, image):
+        pass
+
+    def set_label(self, label):
+        self.label = label
+
+class CheckButton(Button):
+    def get_active(self):
+        return False
+
+class Entry(Widget):
+    def __init__(self):
+        Widget.__init__(self)
+        self.text = ''
+
+    def get_text(self):
+        return self.text
+
+    def set_text(self, text):
+        self.text = text
+        self.emit('changed')
+
+class CellRendererText(GObject):
+    pass
+
+class TreeViewColumn(GObject):
+    def __init__(self, title=None):
+        GObject.__init__(self)
+
+    def pack_start(self, cell, expand=True):
+        pass
+
+    def add_attribute(self, cell, attribute, column):
+        pass
+
+    def set_sizing(self, sizing):
+        pass
+
+class TreeSelection(GObject):
+    def __init__(self, view):
+        GObject.__init__(self)
+        self.view = view
+        self.selected = set()
+
+    def set_mode(self, mode):
+        pass
+
+    def select_path(self, path):
+        # Rows the view hasn't been told about can't be selected.
+        if path[0] >= self.view.n_rows:
+            return
+        if path not in self.selected:
+            self.selected.add(path)
+            self.emit('changed')
+
+    def unselect_path(self, path):
+        if path in self.selected:
+            self.selected.remove(path)
+            self.emit('changed')
+
+    def unselect_all(self):
+        if self.selected:
+            self.selected.clear()
+            self.emit('changed')
+
+    def get_selected_rows(self):
+        return self.view.model, sorted(self.selected)
+
+class TreeView(Widget):
+    # As in GTK, the view counts the model's rows when it's given it, and
+    # after that only knows what the model's signals tell it; and being
+    # given the model it already has does nothing at all.
+    def __init__(self, model=None):
+        Widget.__init__(self)
+        self.model = None
+        self.n_rows = 0
+        self._inserted_id = None
+        self.selection = TreeSelection(self)
+        self.set_model(model)
+
+    def get_selection(self):
+        return self.selection
+
+    def set_model(self, model):
+        if model is self.model:
+            return
+
+        if self.model is not None:
+            self.model.disconnect(self._inserted_id)
+        self.model = model
+        self.selection.selected.clear()
+
+        if model is not None:
+            self.n_rows = model.on_iter_n_children(None)
+            self._inserted_id = model.connect('row-inserted',
+                self._row_inserted)
+        else:
+            self.n_rows = 0
+
+    def _row_inserted(self, model, path, it):
+        # Selected rows after it move down one.
+        self.n_rows += 1
+        self.selection.selected = set(
+            p[0] >= path[0] and (p[0] + 1, ) or p
+            for p in self.selection.selected)
+
+    def get_model(self):
+        return self.model
+
+    def set_headers_visible(self, visible):
+        pass
+
+    def append_column(self, column):
+        pass
+
+    def set_fixed_height_mode(self, fixed):
+        pass
+
+class TreeIter(object):
+    __slots__ = ('rowref', )
+
+    def __init__(self, rowref):
+        self.rowref = rowref
+
+class GenericTreeModel(GObject):
+    def get_iter(self, path):
+        rowref = self.on_get_iter(path)
+        if rowref is None:
+            raise ValueError("invalid tree path %r" % (path, ))
+        return TreeIter(rowref)
+
+    def get_path(self, it):
+        return self.on_get_path(it.rowref)
+
+    def get_value(self, it, column):
+        return self.on_get_value(it.rowref, column)
+
+    def get_n_columns(self):
+        return self.on_get_n_columns()
+
+    def get_column_type(self, column):
+        return self.on_get_column_type(column)
+
+    def row_inserted(self, path, it):
+        self.emit('row-inserted', path, it)
+
+class ListStore(GObject):
+    def __init__(self, *types):
+        GObject.__init__(self)
+        self.rows = []
+
+_GOBJECT = ('SIGNAL_RUN_FIRST', 'TYPE_NONE', 'type_register',
+            'threads_init', 'markup_escape_text', 'timeout_add', 'idle_add', 'source_remove',
+            'run_pending', 'GObject')
+
+def install():
+    """Makes 'import gtk' and 'import gobject' get us. Call it before
+    importing anything that imports them."""
+    this = sys.modules[__name__]
+
+    gobject = types.ModuleType('gobject')
+    for name in _GOBJECT:
+        setattr(gobject, name, getattr(this, name))
+
+    gtk = types.ModuleType('gtk')
+    for name, value in vars(this).items():
+        if not name.startswith('_') and name not in ('sys', 'types',
+                'escape', 'install'):
+            setattr(gtk, name, value)
+
+    sys.modules['gobject'] = gobject
+    sys.modules['gtk'] = gtk
+
+# vim: sts=4 sw=4
@@ -0,0 +1,113 @@
+# encoding: utf-8
+#
+# Just enough of a Maemo device to drive portrait.FremantleRotation.
+# Copyright © 2010, Will Thompson <will@willthompson.co.uk>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Pass a FakePlatform to FremantleRotation, and signals sent on its bus go
+# straight to it; time only passes when you call advance(). Every relayout
+# and MCE request is written down for you to look at afterwards.
+
+class FakeBus(object):
+    def __init__(self):
+        self.receivers = {}
+
+    def add_signal_receiver(self, handler, signal_name, **kwargs):
+        self.receivers.setdefault(signal_name, []).append(handler)
+
+    def emit(self, signal_name, *args):
+        for handler in self.receivers.get(signal_name, ()):
+            handler(*args)
+
+class FakeProgram(object):
+    def connect(self, signal, callback):
+        pass
+
+class FakePlatform(object):
+    PORTRAIT_MODE_SUPPORT = 1 << 0
+    PORTRAIT_MODE_REQUEST = 1 << 1
+
+    def __init__(self, keyboard='closed'):
+        self.system_bus = FakeBus()
+        self.program = FakeProgram()
+        self.keyboard = keyboard
+        self.keyboard_reads = 0
+
+        self.now = 0
+        self._timeouts = {}
+        self._next_timeout = 1
+
+        # (window, flags) for every relayout, and every MCE request
+        self.relayouts = []
+        self.requests = []
+
+    def timeout_add(self, interval, callback, *args):
+        timeout_id = self._next_timeout
+        self._next_timeout += 1
+        self._timeouts[timeout_id] = (self.now + interval, interval, callback,
+                                    args)
+        return timeout_id
+
+    def source_remove(self, timeout_id):
+        return self._timeouts.pop(timeout_id, None) is not None
+
+    def advance(self, ms):
+        """Lets ms milliseconds pass, firing whatever falls due."""
+        until = self.now + ms
+
+        while True:
+            due = [(when, timeout_id)
+                   for timeout_id, (when, _, _, _)
+                   in self._timeouts.iteritems()
+                   if when <= until]
+            if not due:
+                break
+
+            when, timeout_id = min(due)
+            self.now = when
+            _, interval, callback, args = self._timeouts[timeout_id]
+            if not callback(*args):
+                self._timeouts.pop(timeout_id, None)
+            elif timeout_id in self._timeouts:
+                self._timeouts[timeout_id] = (when + interval, interval,
+                                              callback, args)
+
+        self.now = until
+
+    def rpc_run(self, service, path, interface, method):
+        self.requests.append(method)
+
+    def get_windows(self):
+        return ['main window']
+
+    def set_portrait_flags(self, window, flags):
+        self.relayouts.append((window, flags))
+
+    def read_keyboard_state(self, closed):
+        self.keyboard_reads += 1
+        return self.keyboard
+
+    def orientation(self, orientation, x, y, z=0):
+        """Sends an MCE orientation reading."""
+        self.system_bus.emit('sig_device_orientation_ind', orientation,
+            'off_stand', 'face_up', x, y, z)
+
+    def slide(self, keyboard):
+        """Opens or closes the keyboard."""
+        self.keyboard = keyboard
+        self.system_bus.emit('Condition', 'ButtonPressed', 'cover')
+
+# vim: sts=4 sw=4
@@ -0,0 +1,135 @@
+# encoding: utf-8
+#
+# Guessing who'll come to lunch, from who came before.
+# Copyright © 2010, Will Thompson <will@willthompson.co.uk>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+from array import array
+
+from attendees import AttendeeSet
+
+# NumPy does this a whole matrix at a time; without it we muddle through
+# one attendance at a time, which is fine for a few hundred people.
+try:
+    import numpy
+    have_numpy = True
+except ImportError:
+    have_numpy = False
+
+def _weights(sessions, half_life):
+    # A session half_life sessions ago counts half as much as the last one.
+    if have_numpy:
+        age = numpy.arange(sessions - 1, -1, -1, dtype=numpy.float64)
+        return 0.5 ** (age / half_life)
+    else:
+        return [0.5 ** (float(sessions - 1 - s) / half_life)
+                for s in xrange(sessions)]
+
+def _as_numpy(a):
+    if not len(a):
+        return numpy.zeros(0, dtype=a.typecode)
+    return numpy.frombuffer(a, dtype=a.typecode)
+
+def attendance_matrix(people, sessions, session_ix, person_ids):
+    """Returns a people × sessions matrix with a 1 wherever someone came.
+    Needs NumPy."""
+    m = numpy.zeros((people, sessions), dtype=numpy.float32)
+
+    session_ix = _as_numpy(session_ix)
+    person_ids = _as_numpy(person_ids)
+    # Anyone the history knows of who isn't on this roster is ignored.
+    known = person_ids < people
+    m[person_ids[known], session_ix[known]] = 1
+
+    return m
+
+def probabilities(people, sessions, session_ix, person_ids, half_life=4.0):
+    """Returns the chance of each of people coming next time: a weighted
+    mean over sessions of whether they came, with recent ones weighted more
+    heavily. The other arguments are as returned by History.attendance()."""
+    if not sessions:
+        if have_numpy:
+            return numpy.zeros(people)
+        return array('d', [0.0]) * people
+
+    w = _weights(sessions, float(half_life))
+
+    if have_numpy:
+        m = attendance_matrix(people, sessions, session_ix, person_ids)
+        return m.dot(w) / w.sum()
+
+    total = sum(w)
+    p = array('d', [0.0]) * people
+    for s, person_id in zip(session_ix, person_ids):
+        if person_id < people:
+            p[person_id] += w[s] / total
+    return p
+
+class Forecast(object):
+    def __init__(self, roster, p):
+        self.roster = roster
+        self.p = p
+
+        if have_numpy and len(roster):
+            veg = _as_numpy(roster.vegetarians)
+            drink_ids = _as_numpy(roster.drink_ids)
+
+            self.headcount = float(p.sum())
+            self.vegetarians = float(p.dot(veg))
+            self.drinks = numpy.bincount(drink_ids, weights=p,
+                minlength=len(roster.drinks)).tolist()
+        else:
+            self.headcount = sum(p)
+            self.vegetarians = sum(x for x, v in zip(p, roster.vegetarians)
+                                   if v)
+            self.drinks = [0.0] * len(roster.drinks)
+            for x, drink_id in zip(p, roster.drink_ids):
+                self.drinks[drink_id] += x
+
+    def likely(self, threshold=0.5):
+        """Returns an AttendeeSet of everyone at least this likely to come."""
+        if have_numpy:
+            return AttendeeSet(numpy.flatnonzero(self.p >= threshold).tolist())
+        return AttendeeSet(i for i, x in enumerate(self.p) if x >= threshold)
+
+    def drink_counts(self):
+        """Returns [(drink name, expected orders)], most popular first,
+        leaving out anything we expect less than half an order of."""
+        names = self.roster.drinks
+        counts = [(names[drink_id], n) for drink_id, n in enumerate(self.drinks)
+                  if n >= 0.5]
+        counts.sort(key=(lambda pair: pair[1]), reverse=True)
+        return counts
+
+    def markup(self):
+        summary = """<b>Forecast:</b>
+    ~%.0f people
+    ~%.0f vegetarians
+""" % (self.headcount, self.vegetarians)
+
+        for drink, n in self.drink_counts():
+            summary += "    ~%.0f %s\n" % (n, drink)
+
+        return summary.strip()
+
+def forecast(roster, history, weeks=12, weekday=None, today=None,
+             half_life=4.0):
+    sessions, session_ix, person_ids = history.attendance(weeks=weeks,
+        weekday=weekday, today=today)
+    return Forecast(roster, probabilities(len(roster), sessions, session_ix,
+                                          person_ids, half_life))
+
+# vim: sts=4 sw=4
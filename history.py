@@ -0,0 +1,297 @@
+# encoding: utf-8
+#
+# Who came to which lunch, and what they had, kept in SQLite.
+# Copyright © 2010, Will Thompson <will@willthompson.co.uk>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import errno
+import sqlite3
+import datetime
+from array import array
+
+import journal
+from roster import Roster, config_dir
+from attendees import AttendeeSet
+
+def default_path():
+    return config_dir() + '/history.sqlite'
+
+# A session is one lunch, on one day. Each attendance row records what that
+# person had at that session, since their usual drink can change.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS people (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    date TEXT NOT NULL UNIQUE,
+    weekday INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_by_weekday ON sessions (weekday, date);
+CREATE TABLE IF NOT EXISTS attendance (
+    session_id INTEGER NOT NULL REFERENCES sessions (id),
+    person_id INTEGER NOT NULL REFERENCES people (id),
+    drink TEXT NOT NULL,
+    vegetarian INTEGER NOT NULL,
+    PRIMARY KEY (session_id, person_id)
+);
+CREATE INDEX IF NOT EXISTS attendance_by_person
+    ON attendance (person_id, session_id);
+"""
+
+class History(object):
+    def __init__(self, path):
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        self.db = sqlite3.connect(path)
+        # Names and drinks are UTF-8 byte strings throughout.
+        self.db.text_factory = str
+        self.db.executescript(_SCHEMA)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def _transaction(self, f, *args):
+        try:
+            result = f(self.db.cursor(), *args)
+        except:
+            self.db.rollback()
+            raise
+        else:
+            self.db.commit()
+            return result
+
+    def _record_people(self, cursor, roster):
+        # People never change once added, so only newcomers need writing.
+        cursor.execute("SELECT COALESCE(MAX(id), -1) FROM people")
+        known = cursor.fetchone()[0] + 1
+        cursor.executemany("INSERT INTO people (id, name) VALUES (?, ?)",
+            ((i, roster.name(i)) for i in xrange(known, len(roster))))
+
+    def _record_session(self, cursor, day, roster):
+        self._record_people(cursor, roster)
+
+        date = day.isoformat()
+        cursor.execute(
+            "INSERT OR IGNORE INTO sessions (date, weekday) VALUES (?, ?)",
+            (date, day.weekday()))
+        cursor.execute("SELECT id FROM sessions WHERE date = ?", (date, ))
+        session_id = cursor.fetchone()[0]
+
+        # Recording the same day again replaces what we had.
+        cursor.execute("DELETE FROM attendance WHERE session_id = ?",
+            (session_id, ))
+        cursor.executemany("""
+            INSERT INTO attendance (session_id, person_id, drink, vegetarian)
+            VALUES (?, ?, ?, ?)""",
+            ((session_id, i, roster.drink(i), roster.vegetarians[i])
+             for i in roster.attending))
+
+        return session_id
+
+    def record_session(self, day, roster):
+        """Records roster's current attendees as having come to lunch on day
+        (a datetime.date), in a single transaction."""
+        return self._transaction(self._record_session, day, roster)
+
+    def record_sessions(self, sessions):
+        """Like record_session, for an iterable of (day, roster) pairs, all in
+        one transaction."""
+        def record(cursor):
+            for day, roster in sessions:
+                self._record_session(cursor, day, roster)
+
+        self._transaction(record)
+
+    def _get_meta(self, key):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?",
+            (key, )).fetchone()
+        return row and row[0]
+
+    def _set_meta(self, cursor, key, value):
+        cursor.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            (key, value))
+
+    def migrate(self, roster_path):
+        """Brings in a roster from before we kept history, as a single
+        session on the day it was last written. Only the old pickled
+        snapshot counts, wherever it's been set aside to; so do this before
+        anything else opens the roster. Only happens once."""
+        if self._get_meta('migrated') is not None:
+            return False
+
+        roster = Roster()
+        try:
+            day = journal.load_legacy(roster_path, roster)
+        except (TypeError, ValueError):
+            # Too broken to bring in; the roster itself will complain.
+            day = None
+
+        def migrate(cursor):
+            if day is not None and roster.attending:
+                self._record_session(cursor, day, roster)
+            self._set_meta(cursor, 'migrated', roster_path)
+
+        self._transaction(migrate)
+        return day is not None
+
+    def _since(self, weeks, today):
+        if today is None:
+            today = datetime.date.today()
+        return (today - datetime.timedelta(weeks=weeks)).isoformat()
+
+    def attendance_rates(self, weeks=12, today=None):
+        """Returns {person id: fraction of sessions attended} over the last
+        so many weeks, for everyone who came at all."""
+        since = self._since(weeks, today)
+
+        (sessions, ) = self.db.execute(
+            "SELECT COUNT(*) FROM sessions WHERE date > ?", (since, )
+        ).fetchone()
+        if not sessions:
+            return {}
+
+        rows = self.db.execute("""
+            SELECT a.person_id, COUNT(*) FROM attendance AS a
+            JOIN sessions AS s ON s.id = a.session_id
+            WHERE s.date > ?
+            GROUP BY a.person_id""", (since, ))
+        return dict((person_id, float(n) / sessions) for person_id, n in rows)
+
+    def attendance_rate(self, person_id, weeks=12, today=None):
+        since = self._since(weeks, today)
+
+        (sessions, ) = self.db.execute(
+            "SELECT COUNT(*) FROM sessions WHERE date > ?", (since, )
+        ).fetchone()
+        if not sessions:
+            return 0.0
+
+        (n, ) = self.db.execute("""
+            SELECT COUNT(*) FROM attendance AS a
+            JOIN sessions AS s ON s.id = a.session_id
+            WHERE a.person_id = ? AND s.date > ?""", (person_id, since)
+        ).fetchone()
+        return float(n) / sessions
+
+    def common_drinks(self, weekday=None, weeks=None, today=None, limit=None):
+        """Returns [(drink, times ordered)], most common first, optionally
+        only on one day of the week (Monday is 0, as for datetime) and only
+        over the last so many weeks."""
+        clauses = []
+        args = []
+
+        if weekday is not None:
+            clauses.append("s.weekday = ?")
+            args.append(weekday)
+
+        if weeks is not None:
+            clauses.append("s.date > ?")
+            args.append(self._since(weeks, today))
+
+        query = """
+            SELECT a.drink, COUNT(*) AS n FROM sessions AS s
+            JOIN attendance AS a ON a.session_id = s.id"""
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " GROUP BY a.drink ORDER BY n DESC, a.drink"
+        if limit is not None:
+            query += " LIMIT %d" % limit
+
+        return self.db.execute(query, args).fetchall()
+
+    def attendance(self, weeks=None, weekday=None, today=None):
+        """Returns (sessions, session_ix, person_ids): the number of
+        sessions in the last so many weeks (optionally only on one weekday),
+        and two parallel arrays with an entry for each time someone came:
+        which of those sessions it was, oldest first from 0, and who."""
+        clauses = []
+        args = []
+
+        if weekday is not None:
+            clauses.append("weekday = ?")
+            args.append(weekday)
+
+        if weeks is not None:
+            clauses.append("date > ?")
+            args.append(self._since(weeks, today))
+
+        query = "SELECT id FROM sessions"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY date"
+
+        index = dict((session_id, i) for i, (session_id, )
+                     in enumerate(self.db.execute(query, args)))
+        session_ix = array('I')
+        person_ids = array('I')
+        if not index:
+            return 0, session_ix, person_ids
+
+        # Sessions are usually recorded in date order, so the recent ones
+        # have the highest ids and this is a short range scan.
+        rows = self.db.execute(
+            "SELECT session_id, person_id FROM attendance "
+            "WHERE session_id >= ?", (min(index), ))
+        for s, p in rows:
+            s = index.get(s)
+            if s is not None:
+                session_ix.append(s)
+                person_ids.append(p)
+
+        return len(index), session_ix, person_ids
+
+    def last_session(self, weekday, today=None):
+        """Returns (day, AttendeeSet) for the most recent session on that
+        day of the week before today, or None if there hasn't been one."""
+        if today is None:
+            today = datetime.date.today()
+
+        row = self.db.execute(
+            "SELECT id, date FROM sessions WHERE weekday = ? AND date < ? "
+            "ORDER BY date DESC LIMIT 1", (weekday, today.isoformat())
+        ).fetchone()
+        if row is None:
+            return None
+
+        session_id, date = row
+        rows = self.db.execute(
+            "SELECT person_id FROM attendance WHERE session_id = ?",
+            (session_id, ))
+        day = datetime.datetime.strptime(date, '%Y-%m-%d').date()
+        return day, AttendeeSet(person_id for (person_id, ) in rows)
+
+    def session_dates(self, weeks=None, today=None):
+        if weeks is None:
+            rows = self.db.execute("SELECT date FROM sessions ORDER BY date")
+        else:
+            rows = self.db.execute(
+                "SELECT date FROM sessions WHERE date > ? ORDER BY date",
+                (self._since(weeks, today), ))
+        return [date for (date, ) in rows]
+
+# vim: sts=4 sw=4
@@ -0,0 +1,159 @@
+# encoding: utf-8
+#
+# Opt-in timing of the hot paths, exported as a Chrome trace.
+# Copyright © 2010, Will Thompson <will@willthompson.co.uk>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Run with BOVINE_BUFFET_TRACE=/some/file.json and every @traced function
+# records how long each call took into a ring buffer, which is written out
+# on exit or on SIGUSR1 in Chrome's trace event format (load it in
+# chrome://tracing). Without it, @traced hands back the function untouched,
+# so there's nothing to pay.
+
+from __future__ import with_statement
+
+import os
+import time
+import atexit
+import signal
+import thread
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+TRACE_FILE = os.environ.get('BOVINE_BUFFET_TRACE')
+enabled = bool(TRACE_FILE)
+
+class RingBuffer(object):
+    # Keeps the last size things appended.
+    def __init__(self, size):
+        self.items = [None] * size
+        self.next = 0
+        self.full = False
+
+    def append(self, item):
+        self.items[self.next] = item
+        self.next += 1
+        if self.next == len(self.items):
+            self.next = 0
+            self.full = True
+
+    def __iter__(self):
+        if self.full:
+            for item in self.items[self.next:]:
+                yield item
+        for item in self.items[:self.next]:
+            yield item
+
+class Tracer(object):
+    BUFFER_SIZE = 65536
+
+    def __init__(self):
+        self.started = time.time()
+        self.events = RingBuffer(self.BUFFER_SIZE)
+        # name -> [calls, total seconds]; unlike the events, these are never
+        # thrown away.
+        self.counts = {}
+
+    def record(self, name, start, duration):
+        self.events.append((name, start, duration, thread.get_ident()))
+
+        count = self.counts.get(name)
+        if count is None:
+            count = self.counts[name] = [0, 0.0]
+        count[0] += 1
+        count[1] += duration
+
+    def trace_events(self):
+        pid = os.getpid()
+        for name, start, duration, tid in self.events:
+            yield {
+                'name': name,
+                'ph': 'X',
+                'ts': int((start - self.started) * 1e6),
+                'dur': int(duration * 1e6),
+                'pid': pid,
+                'tid': tid,
+            }
+
+    def dump(self, path):
+        counts = dict((name, { 'calls': calls, 'total_ms': total * 1000 })
+                      for name, (calls, total) in self.counts.iteritems())
+
+        with open(path, 'w') as f:
+            json.dump({
+                'traceEvents': list(self.trace_events()),
+                'displayTimeUnit': 'ms',
+                'otherData': { 'counts': counts },
+            }, f)
+
+tracer = None
+
+def traced(name):
+    """Decorator: time every call to the function as name."""
+    def decorate(f):
+        if not enabled:
+            return f
+
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                tracer.record(name, start, time.time() - start)
+
+        wrapper.__name__ = f.__name__
+        wrapper.__doc__ = f.__doc__
+        return wrapper
+
+    return decorate
+
+def dump():
+    if enabled:
+        tracer.dump(TRACE_FILE)
+
+def watch_main_loop(interval_ms=50, threshold_ms=10):
+    """Records 'main loop stall' whenever a timeout that should fire every
+    interval_ms is more than threshold_ms late: that's how long the loop
+    was too busy to go round."""
+    if not enabled:
+        return
+
+    import gobject
+
+    state = { 'expected': time.time() + interval_ms / 1000.0 }
+
+    def tick():
+        now = time.time()
+        late = now - state['expected']
+        if late * 1000 > threshold_ms:
+            tracer.record('main loop stall', state['expected'], late)
+        state['expected'] = now + interval_ms / 1000.0
+        return True
+
+    gobject.timeout_add(interval_ms, tick)
+
+def _dump_on_signal(signum, frame):
+    dump()
+
+if enabled:
+    tracer = Tracer()
+    atexit.register(dump)
+    signal.signal(signal.SIGUSR1, _dump_on_signal)
+
+# vim: sts=4 sw=4
@@ -0,0 +1,408 @@
+# encoding: utf-8
+#
+# Append-only persistence for Bovine Buffet rosters.
+# Copyright © 2010, Will Thompson <will@willthompson.co.uk>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+from __future__ import with_statement
+
+import os
+import errno
+import shutil
+import datetime
+from contextlib import contextmanager
+
+import cPickle
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import rosterfile
+
+# The snapshot is a roster file (see rosterfile.py); rosters from before
+# that are a pickled list of (name, drink, vegetarian, attending) tuples,
+# which still load, and are replaced by a roster file the first time they
+# are compacted. A person's id is their position in the snapshot.
+# Everything that happened since the last snapshot lives in a sidecar
+# journal as a stream of small pickled records:
+#
+#   (BASE, n, generation)  -- always first: the journal follows snapshot
+#                             number generation, of n people
+#   (ADD, name, drink, vegetarian[, pizza])  -- the next id is theirs
+#   (ATTEND, added_ids, removed_ids)
+#   (DRINK, id, drink)  -- they've switched to drink
+#   (PIZZA, id, pizza)  -- their usual pizza is now pizza
+#
+# so one tap costs one tiny append rather than rewriting the whole roster.
+# (Journals from before generations start with (BASE, n), and follow
+# generation 0.)
+#
+# More than one process can have the same roster open. Each takes an flock
+# on ROSTER.lock to write, and first catches up with whatever the others
+# have written since it last looked: more records at the end of the
+# journal, or, if someone has compacted it, a snapshot of a newer
+# generation. Writes are whole records at the end of the journal, or a new
+# snapshot written aside and renamed into place, so nobody ever sees half
+# of one. Appends are fsynced after letting go of the lock, so that
+# processes committing at the same time share one trip to the disk rather
+# than queueing for it.
+
+BASE = 'base'
+ADD = 'add'
+ATTEND = 'attend'
+DRINK = 'drink'
+PIZZA = 'pizza'
+
+def legacy_path(path):
+    return path + '.pickle'
+
+def _read_pickle(f, roster):
+    try:
+        snapshot = cPickle.load(f)
+    except (EOFError, cPickle.UnpicklingError), e:
+        raise rosterfile.CorruptRosterError("unreadable pickle: %s" % e)
+
+    for i, person in enumerate(snapshot):
+        roster.append(*person[0:3])
+        if person[3]:
+            roster.attending.add(i)
+
+def load_legacy(path, roster):
+    """Fills in roster, which should be empty, from the old pickled
+    snapshot at path, or set aside from there, ignoring any journal.
+    Returns the day it was last written, or None if there isn't one."""
+    for candidate in (legacy_path(path), path):
+        try:
+            f = open(candidate, 'rb')
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            continue
+
+        with f:
+            if rosterfile.is_roster_file(f):
+                continue
+            day = datetime.date.fromtimestamp(os.fstat(f.fileno()).st_mtime)
+            f.seek(0)
+            _read_pickle(f, roster)
+            return day
+
+    return None
+
+class Journal(object):
+    # Fold the journal back into the snapshot once it gets this long.
+    COMPACT_AFTER = 256
+
+    def __init__(self, path):
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.lock_path = path + '.lock'
+        # Where an old pickled snapshot is kept once it's been converted.
+        self.legacy_path = legacy_path(path)
+        # How many people the snapshot on disk holds, its generation, and
+        # how many records (and bytes) of the journal on top of it we've
+        # read or written; anything past that is someone else's.
+        self.base = 0
+        self.generation = 0
+        self.records = 0
+        self.offset = 0
+        # Whether the snapshot on disk is an old pickled one.
+        self.legacy = False
+
+        self._lock_file = None
+        self._lock_depth = 0
+        # Whether we've caught up since taking the lock, and appended since
+        # the last sync.
+        self._caught_up = False
+        self._unsynced = False
+
+    def _ensure_dir(self):
+        try:
+            os.makedirs(os.path.dirname(self.path))
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    @contextmanager
+    def locked(self, shared=False):
+        """Holds the roster's lock: shared, to read it, or exclusively, to
+        write it. Nests, as long as nothing nested asks for more than the
+        outermost; whatever's appended meanwhile is synced once, after the
+        outermost lets go."""
+        if self._lock_depth == 0 and fcntl is not None:
+            self._ensure_dir()
+            self._lock_file = open(self.lock_path, 'a')
+            fcntl.flock(self._lock_file.fileno(),
+                        shared and fcntl.LOCK_SH or fcntl.LOCK_EX)
+
+        self._lock_depth += 1
+        try:
+            yield
+        finally:
+            self._lock_depth -= 1
+            if self._lock_depth == 0:
+                if self._lock_file is not None:
+                    # Closing it lets go.
+                    self._lock_file.close()
+                    self._lock_file = None
+                self._caught_up = False
+
+                if self._unsynced:
+                    self.sync()
+
+    def load(self, roster):
+        """Fills in roster, which should be empty, from the snapshot and
+        journal. Returns False if there's nothing on disk. Hold the lock,
+        shared will do."""
+        found = False
+        self.legacy = False
+        self.generation = 0
+
+        try:
+            with open(self.path, 'rb') as f:
+                found = True
+
+                if rosterfile.is_roster_file(f):
+                    self.generation = rosterfile.read(f, roster)
+                else:
+                    self.legacy = True
+                    _read_pickle(f, roster)
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+
+        self.base = len(roster)
+        self.records = 0
+        self.offset = 0
+
+        records = self._read_new()
+        if records is not None:
+            found = True
+            for record in records:
+                self.replay(record, roster)
+
+        return found
+
+    def set_aside_legacy(self):
+        """Keeps the old pickled snapshot, as it was and as old as it was,
+        at legacy_path, before it's replaced by a roster file."""
+        try:
+            os.link(self.path, self.legacy_path)
+        except OSError, e:
+            if e.errno == errno.EEXIST:
+                return
+            # No hard links here: copy it, and when it was written.
+            shutil.copy2(self.path, self.legacy_path)
+
+    def set_aside_corrupt(self):
+        """Copies the snapshot and journal, which couldn't be read, to the
+        side before they're written over; returns where the snapshot went."""
+        for path in (self.path, self.journal_path):
+            try:
+                shutil.copy2(path, path + '.corrupt')
+            except IOError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+        return self.path + '.corrupt'
+
+    def _follows(self, record):
+        """Whether record is the BASE our snapshot needs."""
+        if record == (BASE, self.base, self.generation):
+            return True
+        return self.generation == 0 and record == (BASE, self.base)
+
+    def _read_new(self):
+        """Returns the journal's records past self.offset, and moves it on
+        past them; or None if there's no journal."""
+        try:
+            f = open(self.journal_path, 'rb')
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+
+        records = []
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            f.seek(self.offset)
+
+            while True:
+                good = f.tell()
+                if good >= size:
+                    break
+
+                try:
+                    record = cPickle.load(f)
+                except (EOFError, cPickle.UnpicklingError, ValueError,
+                        IndexError):
+                    # A torn write at the tail (someone crashed
+                    # mid-append). Everything before it is still good; chop
+                    # the rest off so that later appends don't land behind
+                    # it.
+                    print "ignoring truncated journal record"
+                    with open(self.journal_path, 'r+b') as g:
+                        g.truncate(good)
+                    break
+
+                if self.records == 0 and not self._follows(record):
+                    # Someone crashed between writing a new snapshot and
+                    # removing the journal it subsumes. The next append
+                    # replaces it.
+                    break
+
+                records.append(record)
+                self.records += 1
+
+            self.offset = good
+
+        return records
+
+    def _snapshot_generation(self):
+        try:
+            with open(self.path, 'rb') as f:
+                if not rosterfile.is_roster_file(f):
+                    return 0
+                return rosterfile.generation(f)
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return 0
+        except rosterfile.CorruptRosterError:
+            # There's nothing in it to keep; whoever's asking is about to
+            # write over it.
+            return self.generation
+
+    def catch_up(self):
+        """Returns the records anyone else has written since we last
+        looked, having moved past them; or None if they've written a new
+        snapshot, which means loading everything again. Hold the lock."""
+        # Nobody else can have written anything since we last looked.
+        if self._caught_up:
+            return []
+        self._caught_up = True
+
+        if self._snapshot_generation() != self.generation:
+            return None
+        return self._read_new() or []
+
+    def skip(self):
+        """Treats everything on disk as read, for when it couldn't be, and
+        is about to be written over."""
+        self.generation = self._snapshot_generation()
+        try:
+            self.offset = os.path.getsize(self.journal_path)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+        self.records = 0
+
+    def replay(self, record, roster):
+        if record[0] == BASE:
+            pass
+        elif record[0] == ADD:
+            roster.append(*record[1:5])
+        elif record[0] == ATTEND:
+            _, added, removed = record
+            roster.attending.update(added)
+            roster.attending.difference_update(removed)
+        elif record[0] == DRINK:
+            _, person_id, drink = record
+            roster.drink_ids[person_id] = roster.drinks.intern(drink)
+        elif record[0] == PIZZA:
+            _, person_id, pizza = record
+            roster.pizza_ids[person_id] = roster.pizzas.intern(pizza)
+        else:
+            raise TypeError("unknown journal record %r" % (record,))
+
+    def append(self, records):
+        """Adds records to the journal. Hold the lock, having caught up."""
+        if not records:
+            return
+
+        self._ensure_dir()
+
+        # Nothing there is ours: either there's no journal, or it's stale.
+        if self.records == 0:
+            records = [(BASE, self.base, self.generation)] + list(records)
+            mode = 'wb'
+            self.offset = 0
+        else:
+            mode = 'ab'
+
+        # In one write, so that nobody can see some of them but not others.
+        data = ''.join([cPickle.dumps(record, cPickle.HIGHEST_PROTOCOL)
+                        for record in records])
+        with open(self.journal_path, mode) as f:
+            f.write(data)
+
+        self.offset += len(data)
+        self.records += len(records)
+        self._unsynced = True
+
+    def sync(self):
+        """Waits for what's been appended to reach the disk."""
+        self._unsynced = False
+
+        try:
+            fd = os.open(self.journal_path, os.O_RDONLY)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            # Compacted in the meantime; the snapshot was synced.
+            return
+
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def needs_compaction(self, more=0):
+        """Whether it's time to compact: now, or once more records have
+        been appended."""
+        return self.records + more >= self.COMPACT_AFTER
+
+    def compact(self, roster, order):
+        """Writes a fresh snapshot of roster, whose ids in name order are
+        order, and throws away the journal, which it now subsumes. Hold the
+        lock, having caught up."""
+        self._ensure_dir()
+        generation = self.generation + 1
+
+        # Write aside and rename, so a crash leaves either the old snapshot
+        # plus its journal, or the new snapshot.
+        tmp = self.path + '.new'
+        with open(tmp, 'wb') as f:
+            rosterfile.write(f, roster, order, generation)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, self.path)
+
+        try:
+            os.unlink(self.journal_path)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+
+        self.base = len(roster)
+        self.generation = generation
+        self.records = 0
+        self.offset = 0
+        self.legacy = False
+        self._unsynced = False
+
+# vim: sts=4 sw=4
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Lots of people saying they're in, all at once, to a server.py.
+# Copyright © 2010, Will Thompson <will@willthompson.co.uk>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Usage:
+#   ./loadtest.py                      # against a server of its own
+#   ./loadtest.py --url http://host:8080/
+#
+# Without --url, a server is started on a spare localhost port, with a
+# synthetic roster in a scratch $HOME. Each client thread keeps one
+# connection open and picks one of: in or out (most of the time), a new
+# drink, or a look at the summary. At the end the summary has to agree with
+# the list of who's in; and, if the server was our own, so does the roster
+# on disk once it's been shut down.
+
+from __future__ import with_statement
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import threading
+from optparse import OptionParser
+
+from bench import DRINKS
+from remote import Client, ServerError
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+class Worker(threading.Thread):
+    def __init__(self, url, requests, people, seed):
+        threading.Thread.__init__(self)
+        self.client = Client(url)
+        self.requests = requests
+        self.people = people
+        self.random = random.Random(seed)
+        self.latencies = []
+        self.errors = []
+
+    def one(self):
+        r = self.random
+        person_id = r.randrange(self.people)
+        roll = r.random()
+
+        if roll < 0.7:
+            self.client.request('PUT', '/people/%u' % person_id,
+                { 'attending': r.random() < 0.5 })
+        elif roll < 0.8:
+            self.client.request('PUT', '/people/%u' % person_id,
+                { 'drink': r.choice(DRINKS) })
+        else:
+            self.client.request('GET', '/summary')
+
+    def run(self):
+        for _ in xrange(self.requests):
+            start = time.time()
+            try:
+                self.one()
+            except (ServerError, IOError), e:
+                self.errors.append(e)
+            self.latencies.append(time.time() - start)
+        self.client.close()
+
+def check(client):
+    """Returns a list of the ways the server disagrees with itself."""
+    problems = []
+    summary = client.request('GET', '/summary')
+    ids = client.request('GET', '/attending')['ids']
+
+    if summary['people'] != len(ids):
+        problems.append("summary says %u people, but %u are in" %
+                        (summary['people'], len(ids)))
+
+    drinks = sum(n for _, n in summary['drinks'])
+    if drinks != len(ids):
+        problems.append("summary has %u drinks for %u people" %
+                        (drinks, len(ids)))
+
+    return problems, ids
+
+def run(url, clients, requests, people):
+    workers = [Worker(url, requests, people, seed)
+               for seed in xrange(clients)]
+
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - start
+
+    latencies = sorted(l for w in workers for l in w.latencies)
+    errors = [e for w in workers for e in w.errors]
+
+    print "%u clients x %u requests in %.2f s: %.0f requests/s" % (
+        clients, requests, elapsed, len(latencies) / elapsed)
+    print "latency: median %.1f ms, 95%% %.1f ms, 99%% %.1f ms, max %.1f ms" % \
+        tuple(1000 * percentile(latencies, f) for f in (0.5, 0.95, 0.99, 1))
+    print "%u errors" % len(errors)
+    for e in errors[:10]:
+        print "  %s" % e
+
+    return not errors
+
+def main(argv):
+    parser = OptionParser()
+    parser.add_option('--url',
+        help='server to hammer, rather than starting one')
+    parser.add_option('--clients', type='int', default=50,
+        help='simultaneous clients [%default]')
+    parser.add_option('--requests', type='int', default=200,
+        help='requests made by each client [%default]')
+    parser.add_option('--people', type='int', default=1000,
+        help='size of the roster, if we start our own server [%default]')
+    options, args = parser.parse_args(argv[1:])
+
+    ok = True
+    home = None
+    server = None
+
+    if options.url:
+        url = options.url
+        people = len(Client(url).request('GET', '/people')['people'])
+    else:
+        home = tempfile.mkdtemp(prefix='bovine-loadtest-')
+        os.environ['HOME'] = home
+
+        import bench
+        import server as server_module
+        from roster import Roster, default_path
+
+        roster = Roster(default_path())
+        roster.import_people(bench.synthetic_people(options.people))
+
+        server = server_module.serve(default_path(), port=0)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+
+        url = 'http://%s:%u/' % server.server_address
+        people = options.people
+
+    try:
+        ok = run(url, options.clients, options.requests, people)
+
+        problems, ids = check(Client(url))
+
+        if server is not None:
+            server.shutdown()
+            server.service.close()
+
+            roster = Roster(default_path())
+            roster.load()
+            if sorted(roster.attending) != sorted(ids):
+                problems.append("the roster on disk has %u people in, not %u"
+                                % (len(roster.attending), len(ids)))
+
+        for problem in problems:
+            print problem
+        ok = ok and not problems
+    finally:
+        if home is not None:
+            shutil.rmtree(home, True)
+
+    return not ok and 1 or 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
+
+# vim: sts=4 sw=4
@@ -0,0 +1,103 @@
+# encoding: utf-8
+#
+# A small least-recently-used cache.
+# Copyright © 2010, Will Thompson <will@willthompson.co.uk>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Links are [prev, next, key, value] lists, in a ring around self.root;
+# root's next is the least recently used entry.
+_PREV, _NEXT, _KEY, _VALUE = range(4)
+
+class LRUCache(object):
+    def __init__(self, capacity, evicted_cb=None):
+        self.capacity = capacity
+        # Called with (key, value) for everything pushed out of the cache.
+        self.evicted_cb = evicted_cb
+        self.links = {}
+        self.root = root = []
+        root[:] = [root, root, None, None]
+
+    def __len__(self):
+        return len(self.links)
+
+    def __contains__(self, key):
+        return key in self.links
+
+    def __iter__(self):
+        # Least recently used first; doesn't count as a use.
+        link = self.root[_NEXT]
+        while link is not self.root:
+            yield link[_KEY]
+            link = link[_NEXT]
+
+    def _unlink(self, link):
+        link[_PREV][_NEXT] = link[_NEXT]
+        link[_NEXT][_PREV] = link[_PREV]
+
+    def _link_last(self, link):
+        last = self.root[_PREV]
+        link[_PREV] = last
+        link[_NEXT] = self.root
+        last[_NEXT] = link
+        self.root[_PREV] = link
+
+    def get(self, key, default=None):
+        link = self.links.get(key)
+        if link is None:
+            return default
+
+        self._unlink(link)
+        self._link_last(link)
+        return link[_VALUE]
+
+    def __getitem__(self, key):
+        link = self.links[key]
+        self._unlink(link)
+        self._link_last(link)
+        return link[_VALUE]
+
+    def __setitem__(self, key, value):
+        link = self.links.get(key)
+        if link is not None:
+            self._unlink(link)
+            link[_VALUE] = value
+        else:
+            link = [None, None, key, value]
+            self.links[key] = link
+        self._link_last(link)
+
+        while len(self.links) > self.capacity:
+            oldest = self.root[_NEXT]
+            self._unlink(oldest)
+            del self.links[oldest[_KEY]]
+            if self.evicted_cb is not None:
+                self.evicted_cb(oldest[_KEY], oldest[_VALUE])
+
+    def pop(self, key, *default):
+        link = self.links.pop(key, None)
+        if link is None:
+            if default:
+                return default[0]
+            raise KeyError(key)
+
+        self._unlink(link)
+        return link[_VALUE]
+
+    def clear(self):
+        self.links.clear()
+        self.root[:] = [self.root, self.root, None, None]
+
+# vim: sts=4 sw=4
@@ -26,6 +26,41 @@ import gobject
 def esc(x):
     return gobject.markup_escape_text(x)
 
+class CoalescingTimeout(object):
+    # Calls callback once, delay_ms after the first of any number of
+    # schedule() calls; or as soon as the main loop is idle if delay_ms is 0.
+    def __init__(self, callback, delay_ms=0):
+        self.callback = callback
+        self.delay_ms = delay_ms
+        self.source_id = None
+
+    def pending(self):
+        return self.source_id is not None
+
+    def schedule(self):
+        if self.source_id is not None:
+            return
+
+        if self.delay_ms:
+            self.source_id = gobject.timeout_add(self.delay_ms, self._fire)
+        else:
+            self.source_id = gobject.idle_add(self._fire)
+
+    def cancel(self):
+        if self.source_id is not None:
+            gobject.source_remove(self.source_id)
+            self.source_id = None
+
+    def flush(self):
+        if self.source_id is not None:
+            self.cancel()
+            self.callback()
+
+    def _fire(self):
+        self.source_id = None
+        self.callback()
+        return False
+
 #  _______________________
 # ( it's just gtk, right? )
 #  -----------------------
@@ -35,13 +70,26 @@ def esc(x):
 #               ||--|| *
 #
 
+# portrait drags in dbus and osso, so it's left to the application to import
+# once it's got a window on the screen.
 try:
     import hildon
-    import portrait
     have_hildon = True
 except ImportError:
     have_hildon = False
 
+def show_message(parent, text):
+    """Tells the user something went wrong, without getting in their way
+    any longer than it has to."""
+    if have_hildon:
+        hildon.hildon_banner_show_information(parent, '', text)
+        return
+
+    dialog = gtk.MessageDialog(parent, gtk.DIALOG_MODAL, gtk.MESSAGE_ERROR,
+        gtk.BUTTONS_OK, text)
+    dialog.run()
+    dialog.destroy()
+
 class MaybeStackableWindow(hildon.StackableWindow if have_hildon
                            else gtk.Window):
     def __init__(self, title):
@@ -86,8 +134,12 @@ class MaybeTouchSelector(hildon.TouchSelector if have_hildon else gtk.TreeView):
             self.set_headers_visible(False)
             self.get_selection().set_mode(gtk.SELECTION_MULTIPLE)
 
+            # Every row is the same height, so the view needn't ask the
+            # model for every row up front just to measure it.
             name_col = gtk.TreeViewColumn('Name')
+            name_col.set_sizing(gtk.TREE_VIEW_COLUMN_FIXED)
             self.append_column(name_col)
+            self.set_fixed_height_mode(True)
 
             cell = gtk.CellRendererText()
             name_col.pack_start(cell, True)
@@ -95,22 +147,105 @@ class MaybeTouchSelector(hildon.TouchSelector if have_hildon else gtk.TreeView):
 
             self.get_selection().connect('changed', self.selection_changed)
 
+        # While frozen, "changed" is swallowed before anyone else sees it,
+        # and emitted once when thawed if anything was swallowed. This is
+        # connected before anyone else can connect, so it runs first.
+        self._freeze_count = 0
+        self._changed_while_frozen = False
+        self.connect('changed', self._gate_changed)
+
         self.store = store
-        self._select(store.get_current_attendees())
+        self.set_selected_indices(store.get_current_attendees())
 
     def selection_changed(self, _):
         assert not have_hildon
         self.emit("changed", 0)
 
-    def _select(self, indices):
+    # For bulk changes to the model: the selector stops listening to the
+    # store until it's reattached.
+    def detach_store(self):
+        if have_hildon:
+            # TouchSelector insists on having some model or other.
+            types = [self.store.get_column_type(i)
+                     for i in range(self.store.get_n_columns())]
+            self.set_model(0, gtk.ListStore(*types))
+        else:
+            self.set_model(None)
+
+    def attach_store(self, store):
+        self.store = store
+
         if have_hildon:
-            self.unselect_all(0)
-            for index in indices:
-                self.select_iter(0, self.store.get_iter((index,)), False)
+            self.set_model(0, store)
         else:
-            s = self.get_selection()
-            for index in indices:
-                s.select_path((index,))
+            self.set_model(store)
+
+    def _gate_changed(self, _, column):
+        if self._freeze_count:
+            self._changed_while_frozen = True
+            self.stop_emission('changed')
+
+    def freeze_changed(self):
+        self._freeze_count += 1
+
+    def thaw_changed(self, quietly=False):
+        # quietly is for callers who've already dealt with whatever they
+        # changed: nobody hears about it.
+        assert self._freeze_count > 0
+        self._freeze_count -= 1
+
+        if not self._freeze_count and self._changed_while_frozen:
+            self._changed_while_frozen = False
+            if not quietly:
+                self.emit("changed", 0)
+
+    def get_selected_indices(self):
+        if have_hildon:
+            paths = self.get_selected_rows(0)
+        else:
+            _, paths = self.get_selection().get_selected_rows()
+
+        return [index for (index, ) in paths]
+
+    # These apply the whole lot and then emit "changed" at most once, rather
+    # than once per row.
+    def select_indices(self, indices):
+        self.freeze_changed()
+        try:
+            if have_hildon:
+                for index in indices:
+                    self.select_iter(0, self.store.get_iter((index,)), False)
+            else:
+                s = self.get_selection()
+                for index in indices:
+                    s.select_path((index,))
+        finally:
+            self.thaw_changed()
+
+    def unselect_indices(self, indices):
+        self.freeze_changed()
+        try:
+            if have_hildon:
+                for index in indices:
+                    self.unselect_iter(0, self.store.get_iter((index,)), False)
+            else:
+                s = self.get_selection()
+                for index in indices:
+                    s.unselect_path((index,))
+        finally:
+            self.thaw_changed()
+
+    def set_selected_indices(self, indices):
+        self.freeze_changed()
+        try:
+            if have_hildon:
+                self.unselect_all(0)
+            else:
+                self.get_selection().unselect_all()
+
+            self.select_indices(indices)
+        finally:
+            self.thaw_changed()
 
 
 gobject.type_register(MaybeTouchSelector)
@@ -126,10 +261,19 @@ class MagicButton(hildon.Button if have_hildon else gtk.Button):
         else:
             super(MagicButton, self).__init__(label=label)
 
+        self.title = label
+
         image = gtk.Image()
         image.set_from_icon_name(icon_name, gtk.ICON_SIZE_BUTTON)
         self.set_image(image)
 
+    def set_value(self, value):
+        # Under the title on Maemo; after it, elsewhere.
+        if have_hildon:
+            super(MagicButton, self).set_value(value)
+        else:
+            self.set_label("%s: %s" % (self.title, value))
+
 class MagicEntry(hildon.Entry if have_hildon else gtk.Entry):
     def __init__(self):
         if have_hildon:
@@ -22,14 +22,24 @@
 from __future__ import with_statement
 
 import os
-import errno
+import sys
+import time
+import datetime
 
-import cPickle
+# Before we import anything heavy.
+started = time.time()
+
+from array import array
 
 import gtk
 import gobject
 
 from malvern import *
+from rosters import RosterIndex, OpenRosters, DEFAULT
+from attendees import AttendeeSet
+from lru import LRUCache
+import instrument
+from instrument import traced
 
 # And now, the application
 
@@ -47,11 +57,48 @@ class PeopleWindow(MaybeStackableWindow):
         new_person = MagicButton(label="New person", icon_name='general_add')
         new_person.connect('clicked', lambda _: self.show_new_person_dialog())
 
-        self.selector = MaybeTouchSelector(store, PeopleStore.COL_MARKUP)
+        import_people = MagicButton(label="Import people",
+            icon_name='general_add')
+        import_people.connect('clicked',
+            lambda _: self.show_import_people_dialog())
+
+        self.forecast = None
+        self.guess = MagicButton(label="Guess who's coming",
+            icon_name='general_contacts_button')
+        self.guess.connect('clicked',
+            lambda _: self.select_ids(self.forecast.likely()))
+        self.guess.set_sensitive(False)
+
+        # Shown once we know when the last session on this day of the week
+        # was, and who came.
+        self.last_session = None
+        self.same_again = MagicButton(label="Same as last week",
+            icon_name='general_refresh')
+        self.same_again.connect('clicked',
+            lambda _: self.restore(self.last_session[1]))
+        self.same_again.set_sensitive(False)
+
+        self.sort_order = MagicButton(label="Sort by",
+            icon_name='general_sort')
+        self.sort_order.set_value(SORT_LABELS[store.order])
+        self.sort_order.connect('clicked', lambda _: self.next_sort_order())
+
+        self.search_entry = MagicEntry()
+        self.search_entry.connect('changed', lambda _: self.refilter())
+
+        # Either the store itself, or a PeopleFilter of it if we're
+        # searching.
+        self.model = store
+        self.selector = MaybeTouchSelector(store, PeopleModel.COL_MARKUP)
         self.selector.connect('changed', self.selector_changed)
 
         vbox = gtk.VBox()
         vbox.pack_start(new_person, expand=False)
+        vbox.pack_start(import_people, expand=False)
+        vbox.pack_start(self.guess, expand=False)
+        vbox.pack_start(self.same_again, expand=False)
+        vbox.pack_start(self.sort_order, expand=False)
+        vbox.pack_start(self.search_entry, expand=False)
         vbox.pack_start(self.selector)
 
         if have_hildon:
@@ -63,32 +110,97 @@ class PeopleWindow(MaybeStackableWindow):
             pannable.add_with_viewport(vbox)
             self.add(pannable)
 
-    def get_selected_indices(self):
-        if have_hildon:
-            paths = self.selector.get_selected_rows(0)
+    def get_selected_ids(self):
+        # People hidden by the search stay as they were.
+        return self.model.merge_selection(self.store.roster.attending,
+            self.selector.get_selected_indices())
+
+    def set_forecast(self, forecast):
+        self.forecast = forecast
+        self.guess.set_sensitive(True)
+
+        if self.store.order == SORT_LIKELY:
+            self.refilter()
+
+    def set_last_session(self, last_session):
+        self.last_session = last_session
+        day, _ = last_session
+        self.same_again.set_value(day.strftime("%A %d %B"))
+        self.same_again.set_sensitive(True)
+
+    def next_sort_order(self):
+        i = SORT_ORDERS.index(self.store.order)
+        order = SORT_ORDERS[(i + 1) % len(SORT_ORDERS)]
+        self.store.set_sort_order(order)
+        self.sort_order.set_value(SORT_LABELS[order])
+        self.refilter()
+
+    def select_ids(self, attending):
+        # Selects exactly attending, as if they'd been tapped on one by one.
+        self.store.set_attending(attending)
+        self._show_model(self.model)
+
+    def restore(self, attending):
+        # Unlike select_ids, only the people whose rows change are touched.
+        added, removed = self.store.restore(attending)
+        self.show_changes(added, removed)
+        self.update_selection_cb(self.store.roster.attending)
+
+    def show_changes(self, added, removed):
+        """Brings the selector into line with the store, which has already
+        had added and removed applied to it."""
+        self.selector.freeze_changed()
+        try:
+            self.selector.select_indices(
+                self.model.positions_of(AttendeeSet(added)))
+            self.selector.unselect_indices(
+                self.model.positions_of(AttendeeSet(removed)))
+        finally:
+            self.selector.thaw_changed(quietly=True)
+
+    def refilter(self):
+        query = self.search_entry.get_text().strip()
+        if query:
+            model = self.store.search(query)
         else:
-            _, paths = self.selector.get_selection().get_selected_rows()
+            model = self.store
 
-        return [index for (index, ) in paths]
+        self._show_model(model)
 
+    def _show_model(self, model):
+        self.selector.freeze_changed()
+        try:
+            self.model = model
+            # Views ignore being given the model they already have, however
+            # much it's changed underneath them; so take it away first.
+            self.selector.detach_store()
+            self.selector.attach_store(model)
+            self.selector.set_selected_indices(model.get_current_attendees())
+        finally:
+            self.selector.thaw_changed()
+
+    @traced('PeopleWindow.selector_changed')
     def selector_changed(self, selector, _):
-        ixes = self.get_selected_indices()
-        self.store.set_current_attendees(ixes)
-        self.update_selection_cb(ixes)
+        attending = self.get_selected_ids()
+        self.store.set_attending(attending)
+        self.update_selection_cb(attending)
 
     def show_new_person_dialog(self):
         dialog = gtk.Dialog(title="New person", parent=self,
             buttons=(gtk.STOCK_SAVE, gtk.RESPONSE_APPLY))
-        table = gtk.Table(rows=3, columns=2)
+        table = gtk.Table(rows=4, columns=2)
         table.set_col_spacing(0, 16)
 
         name_label = gtk.Label("Name")
         name_label.set_alignment(0, 0.5)
         drink_label = gtk.Label("Drink")
         drink_label.set_alignment(0, 0.5)
+        pizza_label = gtk.Label("Usual pizza")
+        pizza_label.set_alignment(0, 0.5)
 
         name_entry = MagicEntry()
         drink_entry = MagicEntry()
+        pizza_entry = MagicEntry()
         veg_tickybox = MagicCheckButton("Vegetarian")
 
         table.attach(name_label, 0, 1, 0, 1, xoptions=gtk.FILL)
@@ -97,7 +209,10 @@ class PeopleWindow(MaybeStackableWindow):
         table.attach(drink_label, 0, 1, 1, 2, xoptions=gtk.FILL)
         table.attach(drink_entry, 1, 2, 1, 2)
 
-        table.attach(veg_tickybox, 0, 2, 2, 3)
+        table.attach(pizza_label, 0, 1, 2, 3, xoptions=gtk.FILL)
+        table.attach(pizza_entry, 1, 2, 2, 3)
+
+        table.attach(veg_tickybox, 0, 2, 3, 4)
 
         table.show_all()
 
@@ -105,141 +220,615 @@ class PeopleWindow(MaybeStackableWindow):
 
         if dialog.run() == gtk.RESPONSE_APPLY:
             self.store.add_person(name_entry.get_text(), drink_entry.get_text(),
-                veg_tickybox.get_active())
-            self.store.save()
+                veg_tickybox.get_active(), pizza_entry.get_text().strip())
+
+            if self.model is not self.store:
+                self.refilter()
+
+        dialog.destroy()
+
+    def show_import_people_dialog(self):
+        dialog = gtk.FileChooserDialog(title="Import people", parent=self,
+            action=gtk.FILE_CHOOSER_ACTION_OPEN,
+            buttons=(gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL,
+                     gtk.STOCK_OPEN, gtk.RESPONSE_OK))
+
+        for name, pattern in (("CSV", "*.csv"), ("JSON", "*.json")):
+            f = gtk.FileFilter()
+            f.set_name(name)
+            f.add_pattern(pattern)
+            dialog.add_filter(f)
+
+        if dialog.run() == gtk.RESPONSE_OK:
+            self.import_people(dialog.get_filename())
 
         dialog.destroy()
 
+    def import_people(self, path):
+        # Take the model away from the selector while it's being filled, so
+        # it doesn't hear about every row; and then show it the result once.
+        self.selector.freeze_changed()
+        self.selector.detach_store()
+
+        import csv
+        import rosterio
+
+        # Everyone up to a bad row is kept, so say how far we got.
+        n = len(self.store.roster)
+        try:
+            with open(path, 'rb') as f:
+                self.store.import_people(rosterio.read_people(f, path))
+        except (ValueError, csv.Error), e:
+            kept = len(self.store.roster) - n
+            show_message(self, "Couldn't read person %u in %s (%s); "
+                "kept the %u before them" % (kept + 1,
+                os.path.basename(path), e, kept))
+        finally:
+            self.refilter()
+            self.selector.thaw_changed()
+
 class MainView(MaybeStackableWindow):
-    def __init__(self, store):
+    # To get something on the screen as soon as possible, this starts out
+    # showing whatever summary we had last time, and can't do anything else
+    # until it's given a store.
+    def __init__(self, cached_summary=None):
         super(MainView, self).__init__("Bovine Buffet")
 
-        self.store = store
-        self.pw = PeopleWindow(self.store, self.update_summary)
+        self.store = None
+        self.aggregator = None
+        self.optimiser = None
+        self.pw = None
 
-        select_people = MagicButton(label="Select people",
+        # However many times the selection changes in one go round the main
+        # loop, the summary is only redrawn once, and then only if it reads
+        # differently: setting a wrapped label's markup means relaying it
+        # out.
+        self.repaint = CoalescingTimeout(self._repaint)
+        self.attending = None
+        self.summary_markup = cached_summary
+
+        # Set by set_rosters().
+        self.index = None
+        self.switch_roster_cb = None
+
+        self.select_people = MagicButton(label="Select people",
             icon_name='general_contacts_button')
-        select_people.connect('clicked', lambda button: self.pw.show_all())
+        self.select_people.connect('clicked',
+            lambda button: self.get_people_window().show_all())
+        self.select_people.set_sensitive(False)
+
+        self.switch_roster = MagicButton(label="Switch roster",
+            icon_name='general_folder')
+        self.switch_roster.connect('clicked',
+            lambda button: self.show_switch_roster_dialog())
+        self.switch_roster.set_sensitive(False)
+
+        self.undo_button = MagicButton(label="Undo", icon_name='general_back')
+        self.undo_button.connect('clicked', lambda button: self.undo())
+        self.undo_button.set_sensitive(False)
+        self.redo_button = MagicButton(label="Redo",
+            icon_name='general_forward')
+        self.redo_button.connect('clicked', lambda button: self.redo())
+        self.redo_button.set_sensitive(False)
+
+        # From the last session on this day of the week: (day, attending).
+        self.last_session = None
 
         self.summary = gtk.Label()
         self.summary.set_properties(wrap=True)
-        self.update_summary(self.pw.get_selected_indices())
+        if cached_summary:
+            self.summary.set_markup(cached_summary)
+
+        # Shown once we've worked out a forecast.
+        self.forecast = None
+        self.forecast_label = gtk.Label()
+        self.forecast_label.set_properties(wrap=True, no_show_all=True)
+
+        summaries = gtk.HBox(homogeneous=True)
+        summaries.pack_start(self.summary)
+        summaries.pack_start(self.forecast_label)
 
         vbox = gtk.VBox()
-        vbox.pack_start(select_people, expand=False)
-        vbox.pack_start(self.summary)
+        vbox.pack_start(self.select_people, expand=False)
+        vbox.pack_start(self.switch_roster, expand=False)
+        undo_redo = gtk.HBox(homogeneous=True)
+        undo_redo.pack_start(self.undo_button)
+        undo_redo.pack_start(self.redo_button)
+        vbox.pack_start(undo_redo, expand=False)
+        vbox.pack_start(summaries)
 
         pannable = MaybePannableArea()
         pannable.add_with_viewport(vbox)
         self.add(pannable)
 
-    def update_summary(self, indices):
-        people = len(indices)
-        vegetarians = 0
-        drinks = {}
-
-        for i in indices:
-            x = self.store[i]
+    def set_store(self, store):
+        if self.pw is not None:
+            # It belongs to the old roster; a new one is made on demand.
+            self.pw.destroy()
+            self.pw = None
 
-            if x[PeopleStore.COL_VEGETARIAN]:
-                vegetarians += 1
+        self.forecast = None
+        self.forecast_label.hide()
+        self.last_session = None
 
-            drink = x[PeopleStore.COL_DRINK].lower()
-            drinks[drink] = drinks.get(drink, 0) + 1
+        # Kept with the store, so that coming back to a roster only has to
+        # catch up with what changed.
+        if store.aggregator is None:
+            from summary import SummaryAggregator
+            from pizzas import PizzaOptimiser, Menu
 
-        food_summary = """
-<b>Food:</b>
-    %u people
-    %u vegetarians
-""" % (people, vegetarians)
+            store.aggregator = SummaryAggregator(store.roster)
+            store.optimiser = PizzaOptimiser(store.roster, Menu.load())
 
-        drink_summary = "<b>Drinks:</b>\n"
+        if self.store is not None:
+            self.store.merged_cb = None
+        store.merged_cb = self.roster_merged
 
-        for drink, n in sorted(drinks.iteritems(), key=(lambda pair: pair[1]),
-                               reverse=True):
-            drink_summary += "    %u %s\n" % (n, drink)
+        self.store = store
+        self.aggregator = store.aggregator
+        self.optimiser = store.optimiser
+        self.update_summary(store.roster.attending)
+        self.select_people.set_sensitive(True)
+
+    def roster_merged(self):
+        # Another process changed the roster: show whoever's coming now.
+        self.aggregator = self.store.aggregator
+        attending = self.store.roster.attending
+        if self.pw is not None:
+            self.pw.select_ids(attending)
+        self.update_summary(attending)
+
+    def set_rosters(self, index, switch_roster_cb):
+        self.index = index
+        self.switch_roster_cb = switch_roster_cb
+        self.set_title("Bovine Buffet: %s" % index.current)
+        self.switch_roster.set_sensitive(True)
+
+    def show_switch_roster_dialog(self):
+        names = self.index.names()
+
+        # One button per roster, whose response is its position in names.
+        buttons = []
+        for i, name in enumerate(names):
+            buttons += [name, i]
+        buttons += [gtk.STOCK_NEW, gtk.RESPONSE_APPLY]
+
+        dialog = gtk.Dialog(title="Switch roster", parent=self,
+            buttons=tuple(buttons))
+        new_name = MagicEntry()
+        new_name.show()
+        dialog.vbox.pack_start(new_name)
+
+        response = dialog.run()
+        name = None
+        if 0 <= response < len(names):
+            name = names[response]
+        elif response == gtk.RESPONSE_APPLY:
+            name = new_name.get_text().strip() or None
 
-        self.summary.set_markup((food_summary + "\n" + drink_summary).strip())
+        dialog.destroy()
 
-class PeopleStore(gtk.ListStore):
+        if name is not None:
+            self.switch_roster_cb(name)
+            self.set_title("Bovine Buffet: %s" % name)
+
+    def get_people_window(self):
+        # Nobody needs this until they ask for it.
+        if self.pw is None:
+            self.pw = PeopleWindow(self.store, self.update_summary)
+            if self.forecast is not None:
+                self.pw.set_forecast(self.forecast)
+            if self.last_session is not None:
+                self.pw.set_last_session(self.last_session)
+
+        return self.pw
+
+    def set_forecast(self, forecast):
+        self.forecast = forecast
+        self.forecast_label.set_markup(forecast.markup())
+        self.forecast_label.show()
+        self.store.set_likelihood(forecast.p)
+
+        if self.pw is not None:
+            self.pw.set_forecast(forecast)
+
+        # If nobody's said they're coming yet, start with the likely lot;
+        # but nobody has said so yet, either.
+        if not self.store.roster.attending:
+            likely = forecast.likely()
+            changed_on = self.store.changed_on
+            if self.pw is not None:
+                self.pw.select_ids(likely)
+            else:
+                self.store.set_attending(likely)
+                self.update_summary(likely)
+            self.store.changed_on = changed_on
+
+    def set_last_session(self, last_session):
+        self.last_session = last_session
+        if self.pw is not None:
+            self.pw.set_last_session(last_session)
+
+    def undo(self):
+        self._changed(self.store.undo())
+
+    def redo(self):
+        self._changed(self.store.redo())
+
+    def _changed(self, changes):
+        if changes is None:
+            return
+
+        if self.pw is not None:
+            self.pw.show_changes(*changes)
+        self.update_summary(self.store.roster.attending)
+
+    def update_summary(self, attending):
+        self.attending = attending
+        self.repaint.schedule()
+
+        self.undo_button.set_sensitive(self.store.undo_history.can_undo())
+        self.redo_button.set_sensitive(self.store.undo_history.can_redo())
+
+    @traced('MainView.repaint')
+    def _repaint(self):
+        self.aggregator.update(self.attending)
+        self.optimiser.update(self.attending)
+
+        markup = self.aggregator.markup()
+        pizzas = self.optimiser.markup()
+        if pizzas:
+            markup = "\n".join([markup, ""] + pizzas)
+
+        if markup != self.summary_markup:
+            self.summary_markup = markup
+            self.summary.set_markup(markup)
+
+class PeopleModel(gtk.GenericTreeModel):
     COL_NAME = 0
-    COL_DRINK = 1
-    COL_VEGETARIAN = 2
-    COL_MARKUP = 3
+    COL_MARKUP = 1
+    COL_ID = 2
 
-    def __init__(self):
-        super(PeopleStore, self).__init__(str, str, bool, str)
-        self.current_attendees = []
+    _COLUMN_TYPES = (str, str, int)
 
-        if not self.load():
-            # Pre-seed with Collaborans
-            for person in sorted(standard_people):
-                self.add_person(*person)
+    # Rather than copying the roster into a ListStore up front, rows are
+    # produced on demand: a row's reference is its position, and self.rows
+    # maps positions to person ids. Subclasses provide self.rows, self.roster
+    # and _markup().
+    def __len__(self):
+        return len(self.rows)
 
-            for i in range(len(self)):
-                if self[i][PeopleStore.COL_NAME] in regulars:
-                    self.current_attendees.append(i)
-            self.save()
+    def on_get_flags(self):
+        return gtk.TREE_MODEL_LIST_ONLY
 
-        self.set_sort_column_id(0, gtk.SORT_ASCENDING)
+    def on_get_n_columns(self):
+        return len(PeopleModel._COLUMN_TYPES)
 
-    def add_person(self, name, drink, vegetarian):
-        vegetarian_markup = ", vegetarian" if vegetarian else ""
-        markup = """%s
-<span size=\"small\" color=\"gray\">%s%s</span>""" % (
-            esc(name), esc(drink), vegetarian_markup)
+    def on_get_column_type(self, column):
+        return PeopleModel._COLUMN_TYPES[column]
 
-        self.append((name, drink, vegetarian, markup))
+    def on_get_iter(self, path):
+        if len(path) == 1 and path[0] < len(self.rows):
+            return path[0]
+        return None
 
-    def get_current_attendees(self):
-        return self.current_attendees
+    def on_get_path(self, rowref):
+        return (rowref, )
 
-    def set_current_attendees(self, attendees):
-        self.current_attendees = attendees
-        self.save()
+    def on_get_value(self, rowref, column):
+        person_id = self.rows[rowref]
 
-    def _config_dir(self):
-        return os.environ['HOME'] + '/.config/bovine-buffet'
+        if column == PeopleModel.COL_MARKUP:
+            return self._markup(person_id)
+        elif column == PeopleModel.COL_NAME:
+            return self.roster.name(person_id)
+        else:
+            return person_id
 
-    def _config_file(self):
-        return self._config_dir() + '/default'
+    def on_iter_next(self, rowref):
+        if rowref + 1 < len(self.rows):
+            return rowref + 1
+        return None
 
-    def load(self):
-        try:
-            with open(self._config_file(), 'r') as f:
-                people = cPickle.load(f)
-
-                for i, person in zip(range(len(people)), sorted(people)):
-                    self.add_person(*person[0:3])
-                    if person[3]:
-                        self.current_attendees.append(i)
-
-            return True
-        except IOError, e:
-            if e.errno == errno.ENOENT:
-                return False
-
-            raise
-        except TypeError, e:
-            print "database corrupted! :'("
-            return False
+    def on_iter_children(self, rowref):
+        if rowref is None and self.rows:
+            return 0
+        return None
 
-    def save(self):
-        try:
-            os.makedirs(self._config_dir())
-        except OSError, e:
-            if e.errno != errno.EEXIST:
-                raise
+    def on_iter_has_child(self, rowref):
+        return False
 
-        with open(self._config_file(), 'w') as f:
-            data = []
+    def on_iter_n_children(self, rowref):
+        if rowref is None:
+            return len(self.rows)
+        return 0
 
-            for (row, i) in zip(self, range(len(self))):
-                data.append((row[PeopleStore.COL_NAME],
-                    row[PeopleStore.COL_DRINK], row[PeopleStore.COL_VEGETARIAN],
-                    i in self.current_attendees))
+    def on_iter_nth_child(self, rowref, n):
+        if rowref is None and n < len(self.rows):
+            return n
+        return None
 
-            cPickle.dump(data, f)
+    def on_iter_parent(self, child):
+        return None
+
+    def get_current_attendees(self):
+        return self.positions_of(self.roster.attending)
+
+    def positions_of(self, ids):
+        return [i for i, person_id in enumerate(self.rows) if person_id in ids]
+
+    def ids_at(self, indices):
+        return AttendeeSet(self.rows[i] for i in indices)
+
+    def merge_selection(self, attending, indices):
+        """Returns attending, with whoever is shown here replaced by just
+        those at indices."""
+        merged = attending.copy()
+        merged.difference_update(self.rows)
+        merged.update(self.rows[i] for i in indices)
+        return merged
+
+SORT_NAME = 'name'
+SORT_DRINK = 'drink'
+SORT_LIKELY = 'likely'
+
+SORT_ORDERS = [SORT_NAME, SORT_DRINK, SORT_LIKELY]
+SORT_LABELS = {
+    SORT_NAME: "name",
+    SORT_DRINK: "drink",
+    SORT_LIKELY: "likely to come",
+}
+
+class PeopleStore(PeopleModel):
+    # Taps arriving within this long of each other are written out together.
+    SAVE_DELAY_MS = 1000
+
+    # How often a roster on a server asks what everyone else has changed.
+    POLL_MS = 5000
+
+    # Rendered markup for this many rows is kept around; a screenful is a
+    # dozen or so.
+    MARKUP_CACHE_SIZE = 256
+
+    # Everyone on the roster, in name order, or by drink, or most likely to
+    # come first. Each order is a SortedIndex, made the first time it's
+    # wanted and kept up to date as people arrive; whichever is showing is
+    # self.rows. A roster which doesn't exist yet starts out with the
+    # Collaborans if seed is set, and empty if not.
+    def __init__(self, roster, seed=False):
+        from search import SearchIndex
+        from undo import UndoHistory
+
+        super(PeopleStore, self).__init__()
+        self.roster = roster
+        self.saver = CoalescingTimeout(self.flush, PeopleStore.SAVE_DELAY_MS)
+        self.markup_cache = LRUCache(PeopleStore.MARKUP_CACHE_SIZE)
+        self.search_index = SearchIndex(roster)
+        # The main view's running totals, and pizza order, for this roster.
+        self.aggregator = None
+        self.optimiser = None
+        # Called when changes made by another process have been taken in.
+        self.merged_cb = None
+
+        # The day whoever's coming was last changed here, if it has been.
+        self.changed_on = None
+
+        self.order = SORT_NAME
+        # How likely each person is to come, by id, once there's a forecast.
+        self.likelihood = ()
+
+        if not self.roster.load():
+            if seed:
+                for person in standard_people:
+                    self.roster.append(*person)
+
+                self.roster.set_attending(AttendeeSet(i
+                    for i, name in enumerate(self.roster.names)
+                    if name in regulars))
+            self.roster.save()
+
+        self._sort()
+        self.merges = self.roster.merges
+        self.undo_history = UndoHistory(self.roster.attending)
+
+    def _sort(self):
+        from sortindex import SortedIndex
+
+        # Name order comes ready-made from the roster file. The others wait
+        # until they're asked for.
+        self.indices = {
+            SORT_NAME: SortedIndex(self.sort_key(SORT_NAME),
+                                   self.roster.name_order()),
+        }
+        self.rows = self._index(self.order)
+
+    def sort_key(self, order=None):
+        roster = self.roster
+        names = roster.names
+        order = order or self.order
+
+        if order == SORT_DRINK:
+            drinks, drink_ids = roster.drinks, roster.drink_ids
+            return lambda i: (drinks[drink_ids[i]].lower(), names[i])
+        elif order == SORT_LIKELY:
+            p = self.likelihood
+            return lambda i: (-(i < len(p) and p[i] or 0), names[i])
+        return names.__getitem__
+
+    def _index(self, order):
+        index = self.indices.get(order)
+        if index is None:
+            from sortindex import SortedIndex
+
+            index = self.indices[order] = SortedIndex.sorted(
+                self.sort_key(order), xrange(len(self.roster)))
+        return index
+
+    def set_sort_order(self, order):
+        # Views need to be shown the store again afterwards.
+        self.order = order
+        self.rows = self._index(order)
+
+    def set_likelihood(self, p):
+        self.likelihood = p
+        self.indices.pop(SORT_LIKELY, None)
+        self.rows = self._index(self.order)
+
+    def positions_of(self, ids):
+        # Finding a few people is quicker than looking at everyone.
+        if len(ids) * 16 < len(self.rows):
+            return sorted([self.rows.index(i) for i in ids])
+        return super(PeopleStore, self).positions_of(ids)
+
+    def _insert_rows(self, n):
+        # For everyone from id n on, who we've not shown yet.
+        for person_id in xrange(n, len(self.roster)):
+            for index in self.indices.itervalues():
+                position = index.insert(person_id)
+                if index is self.rows:
+                    self.row_inserted((position, ),
+                                      self.get_iter((position, )))
+
+    def _merged(self):
+        """Call after writing to the roster. If that meant taking in
+        changes from another process, starts again and returns True."""
+        if self.roster.merges == self.merges:
+            return False
+        self.merges = self.roster.merges
+
+        from search import SearchIndex
+        from summary import SummaryAggregator
+
+        # Anyone's drink might have changed, so look at everyone again.
+        self._sort()
+        self.markup_cache.clear()
+        self.search_index = SearchIndex(self.roster)
+        # Undoing would undo their changes too.
+        self.undo_history.reset(self.roster.attending)
+        if self.aggregator is not None:
+            self.aggregator = SummaryAggregator(self.roster)
+            self.optimiser.refresh()
+
+        if self.merged_cb is not None:
+            self.merged_cb()
+        return True
+
+    def _markup(self, person_id):
+        markup = self.markup_cache.get(person_id)
+
+        if markup is None:
+            name, drink, vegetarian, pizza = self.roster[person_id]
+            pizza_markup = ", " + esc(pizza) if pizza else ""
+            vegetarian_markup = ", vegetarian" if vegetarian else ""
+            markup = """%s
+<span size=\"small\" color=\"gray\">%s%s%s</span>""" % (
+                esc(name), esc(drink), pizza_markup, vegetarian_markup)
+            self.markup_cache[person_id] = markup
+
+        return markup
+
+    def add_person(self, name, drink, vegetarian, pizza=''):
+        # Usually just them; but a RemoteRoster may have found others who
+        # joined elsewhere in the meantime.
+        n = len(self.roster)
+        self.roster.add_person(name, drink, vegetarian, pizza)
+        if not self._merged():
+            self._insert_rows(n)
+
+        self.saver.schedule()
+
+    def import_people(self, people):
+        # No row-inserted per person: callers should detach us from any
+        # views first. Rather than bisecting each newcomer into place, sort
+        # everyone once at the end; and the roster writes itself out once.
+        self.saver.cancel()
+
+        try:
+            return self.roster.import_people(people)
+        finally:
+            if not self._merged():
+                self._sort()
+
+    def search(self, query):
+        return PeopleFilter(self, self.search_index.search(query))
+
+    def ids_at(self, indices):
+        return AttendeeSet(self.rows.take(sorted(indices)))
+
+    def merge_selection(self, attending, indices):
+        # We show everyone, so there's nothing to merge.
+        return self.ids_at(indices)
+
+    def set_attending(self, attending):
+        if attending != self.roster.attending:
+            self.changed_on = datetime.date.today()
+        self.roster.set_attending(attending)
+        self.undo_history.record(attending)
+        self.saver.schedule()
+
+    # These return (added, removed), the people whose rows need updating,
+    # having changed only them.
+    def restore(self, attending):
+        """Sets attending back to how it was at some other time."""
+        # History can outlive the roster, if it was ever lost and started
+        # again; anyone it remembers who isn't here any more is left out.
+        people = len(self.roster)
+        attending = AttendeeSet(i for i in attending if i < people)
+        changes = self.roster.attending.diff(attending)
+        self._apply(*changes)
+        self.undo_history.record(self.roster.attending)
+        return changes
+
+    def undo(self):
+        changes = self.undo_history.undo()
+        if changes is not None:
+            self._apply(*changes)
+        return changes
+
+    def redo(self):
+        changes = self.undo_history.redo()
+        if changes is not None:
+            self._apply(*changes)
+        return changes
+
+    def _apply(self, added, removed):
+        if added or removed:
+            self.changed_on = datetime.date.today()
+        self.roster.attending.update(added)
+        self.roster.attending.difference_update(removed)
+        self.saver.schedule()
+
+    def poll(self):
+        # For a RemoteRoster; returns True so as to be a timeout.
+        n = len(self.roster)
+        self.roster.poll()
+        if not self._merged():
+            self._insert_rows(n)
+        # Anything that didn't reach the server goes again.
+        if self.roster.dirty():
+            self.saver.schedule()
+        return True
+
+    def flush(self):
+        self.saver.cancel()
+        if self.roster.dirty():
+            # Whatever anyone else has written is taken in first.
+            n = len(self.roster)
+            self.roster.flush()
+            if not self._merged():
+                self._insert_rows(n)
+
+class PeopleFilter(PeopleModel):
+    # Some of the people in a PeopleStore, in the store's order. This is a
+    # snapshot: make a new one if the store changes.
+    def __init__(self, store, ids):
+        super(PeopleFilter, self).__init__()
+        self.store = store
+        self.roster = store.roster
+        self.rows = array('I', sorted(ids, key=store.sort_key()))
+
+    def _markup(self, person_id):
+        return self.store._markup(person_id)
 
 regulars = [ 'Alban', 'Christian', 'Cosimo', 'Daniel', 'David', 'Elliot',
              'Jonny', 'Marco', 'Philip', 'Rob', 'Simon', 'Sjoerd', 'Will',
@@ -270,20 +859,195 @@ standard_people = [
     ('Will', 'orange juice', True),
 ]
 
+class StartupTimer(object):
+    # Set BOVINE_BUFFET_STARTUP_TIMING in the environment to find out how
+    # long each stage of getting going took.
+    def __init__(self, started):
+        self.started = started
+        self.marks = []
+        self.enabled = 'BOVINE_BUFFET_STARTUP_TIMING' in os.environ
+
+    def mark(self, what):
+        if self.enabled:
+            self.marks.append((what, time.time()))
+
+    def report(self):
+        if not self.enabled:
+            return
+
+        for what, when in self.marks:
+            print >>sys.stderr, "%8.1f ms  %s" % (
+                (when - self.started) * 1000, what)
+
+# Set BOVINE_BUFFET_SERVER to the address of a server.py to have taps go
+# there, rather than to a roster on this device.
+SERVER_URL = os.environ.get('BOVINE_BUFFET_SERVER')
+
 class App(object):
+    # The first frame shows last time's summary; the roster itself, the
+    # people window and the rotation manager all wait until it's up, as do
+    # the modules they need.
     def __init__(self):
-        self.store = PeopleStore()
-
-        self.mv = MainView(self.store)
+        self.timer = StartupTimer(started)
+        self.timer.mark("imports")
+
+        if SERVER_URL:
+            # A RemoteRoster talks to the server from a thread of its own.
+            gobject.threads_init()
+
+        # Only the index is read now: each roster is loaded when it's first
+        # switched to, and a handful are kept open after that.
+        self.index = RosterIndex()
+        self.index.load()
+        self.rosters = OpenRosters(self.index, self._open_store)
+        self.name = None
+        self.store = None
+
+        self.mv = MainView(self.load_cached_summary(self.index.current))
         self.mv.connect("delete_event", gtk.main_quit, None)
+        self._first_expose_id = self.mv.connect_after('expose-event',
+            self._first_expose)
+        self.timer.mark("main window built")
+
+    def _open_store(self, name, path):
+        from roster import Roster
+
+        return PeopleStore(Roster(path), seed=(name == DEFAULT))
+
+    def _summary_cache_file(self, name):
+        return self.index.path_for(name) + '.summary'
+
+    def load_cached_summary(self, name):
+        try:
+            with open(self._summary_cache_file(name), 'r') as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def save_cached_summary(self):
+        if self.mv.aggregator is None:
+            return
+
+        self.mv.repaint.flush()
+        with open(self._summary_cache_file(self.name), 'w') as f:
+            f.write(self.mv.summary_markup)
+
+    def _first_expose(self, window, event):
+        window.disconnect(self._first_expose_id)
+        self.timer.mark("first frame")
+        gobject.idle_add(self._finish_startup)
+        return False
+
+    def _finish_startup(self):
+        if SERVER_URL:
+            # Just the one roster, and it's the server's.
+            import remote
+
+            self.name = self.index.current
+            self.store = PeopleStore(remote.RemoteRoster(SERVER_URL))
+            self.mv.set_store(self.store)
+            gobject.timeout_add(PeopleStore.POLL_MS, self.store.poll)
+            if not self.store.roster.reached:
+                show_message(self.mv, "Couldn't reach %s; will keep trying"
+                    % SERVER_URL)
+        else:
+            self.switch_roster(self.index.current)
+            self.mv.set_rosters(self.index, self.switch_roster)
+        self.timer.mark("roster loaded")
 
         if have_hildon:
+            import portrait
             portrait.FremantleRotation("bovine-buffet", self.mv, version='0.1')
+            self.timer.mark("rotation manager started")
+
+        self.timer.report()
+        return False
+
+    def switch_roster(self, name):
+        if name == self.name:
+            return
+
+        if self.store is not None:
+            self.leave_roster()
+
+        if name not in self.index:
+            self.index.add(name)
+        self.index.set_current(name)
+
+        self.name = name
+        if name not in self.rosters:
+            self.migrate_history()
+        self.store = self.rosters.get(name)
+        self.mv.set_store(self.store)
+        gobject.idle_add(self._load_forecast, self.store)
+
+    def leave_roster(self):
+        self.store.flush()
+        self.save_cached_summary()
+        self.record_history()
+
+    def _load_forecast(self, store):
+        if store is not self.store:
+            # They've already moved on to another roster.
+            return False
+
+        import forecast
+        import history
+
+        h = history.History(self.index.history_path_for(self.name))
+        try:
+            f = forecast.forecast(self.store.roster, h)
+            last = h.last_session(datetime.date.today().weekday())
+        finally:
+            h.close()
+
+        if f.headcount:
+            self.mv.set_forecast(f)
+        if last is not None:
+            self.mv.set_last_session(last)
+
+        return False
 
     def run(self):
         self.mv.show_all()
+        instrument.watch_main_loop()
         gtk.main()
 
+        if SERVER_URL:
+            if self.store is not None:
+                self.store.flush()
+                self.store.roster.close()
+        elif self.store is not None:
+            self.leave_roster()
+            self.rosters.flush()
+
+    def migrate_history(self):
+        # The first time round, bring in whatever we had before, before
+        # opening the roster converts it.
+        import history
+
+        h = history.History(self.index.history_path_for(self.name))
+        try:
+            h.migrate(self.index.path_for(self.name))
+        finally:
+            h.close()
+
+    def record_history(self):
+        # Only if someone said who's coming: just opening the app isn't
+        # lunch.
+        day = self.store.changed_on
+        if day is None or not self.store.roster.attending:
+            return
+
+        import history
+
+        h = history.History(self.index.history_path_for(self.name))
+        try:
+            h.record_session(day, self.store.roster)
+        finally:
+            h.close()
+        self.store.changed_on = None
+
 if __name__ == "__main__":
     App().run()
 
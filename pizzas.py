@@ -0,0 +1,302 @@
+# encoding: utf-8
+#
+# Ordering pizzas two-for-one, for as little as possible.
+# Copyright © 2010, Will Thompson <will@willthompson.co.uk>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Two people who go halves on a two-for-one each get half of their own
+# usual pizza and half of the other's, and pay for the dearer of the two.
+# So a pair has to suit both of them: if either is vegetarian, both pizzas
+# must be. That leaves four kinds of people:
+#
+#   MEAT    not vegetarian, and neither is their pizza: pairs with MEAT/EITHER
+#   EITHER  not vegetarian, but their pizza is: pairs with anyone but ALONE
+#   VEG     vegetarian, with a vegetarian pizza: pairs with VEG/EITHER
+#   ALONE   vegetarian with a meaty pizza: can't share it with anyone
+#
+# Among people who can all pair with each other, the most is saved by
+# sorting them dearest first and pairing them off in twos: each pair saves
+# the price of its cheaper pizza, the second of the two. So the only real
+# choice is which EITHERs join the meat-eaters and which the vegetarians.
+# Going dearest first, with the parity of each side as state, that's a
+# dynamic programme over four states: linear time, and exact.
+#
+# The optimiser keeps everyone selected in that order, and the programme's
+# state after each of them. A change to the selection only reruns it from
+# the first position that moved.
+
+from __future__ import with_statement
+
+import bisect
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from attendees import AttendeeSet
+from drinks import DrinkCatalogue
+
+# name: (price in pence, vegetarian)
+DEFAULT_MENU = {
+    'Margherita': (750, True),
+    'Funghi': (850, True),
+    'Fiorentina': (925, True),
+    'Quattro Formaggi': (950, True),
+    'Hawaiian': (875, False),
+    'Pepperoni': (900, False),
+    'Diavola': (975, False),
+    'Meat Feast': (1050, False),
+}
+
+def menu_path():
+    from roster import config_dir
+    return config_dir() + '/menu.json'
+
+class Menu(object):
+    # Names are matched as drinks are, typos and all. Pizzas nobody's heard
+    # of are assumed to cost as much as the dearest one we know of, and to
+    # have meat in.
+    def __init__(self, items=DEFAULT_MENU):
+        self.names = DrinkCatalogue()
+        self.items = []
+        for name, (price, vegetarian) in sorted(items.iteritems()):
+            self.names.intern(name)
+            self.items.append((price, bool(vegetarian)))
+
+        self.unknown = (max([price for price, _ in self.items] or [0]), False)
+
+    @classmethod
+    def load(cls, path=None):
+        """Reads {"name": [pence, vegetarian], ...} from path, if it's
+        there; otherwise, the default menu."""
+        try:
+            with open(path or menu_path(), 'rb') as f:
+                items = json.load(f)
+        except IOError:
+            return cls()
+
+        return cls(dict((name.encode('utf-8'), tuple(item))
+                        for name, item in items.iteritems()))
+
+    def __getitem__(self, pizza):
+        pizza_id = self.names.lookup(pizza)
+        if pizza_id is None:
+            return self.unknown
+        return self.items[pizza_id]
+
+MEAT, EITHER, VEG, ALONE = range(4)
+
+# State: (meat-eaters left unpaired, vegetarians left unpaired), as 0 or 1,
+# packed into 2 bits.
+_MEAT_ODD = 1
+_VEG_ODD = 2
+
+_NOWHERE = -1
+
+def _sides(kind):
+    if kind == MEAT:
+        return (_MEAT_ODD, )
+    elif kind == VEG:
+        return (_VEG_ODD, )
+    return (_MEAT_ODD, _VEG_ODD)
+
+class Plan(object):
+    def __init__(self, pairs, singles, price, saving):
+        # pairs: [(id, id)], dearer first; singles: [id]; prices in pence.
+        self.pairs = pairs
+        self.singles = singles
+        self.price = price
+        self.saving = saving
+
+    def cost(self):
+        return self.price - self.saving
+
+def pence(p):
+    return "£%u.%02u" % divmod(p, 100)
+
+class PizzaOptimiser(object):
+    def __init__(self, roster, menu=None):
+        self.roster = roster
+        self.menu = menu or Menu()
+        self.selected = AttendeeSet()
+
+        # Everyone selected with a usual pizza, as (-price, id): dearest
+        # first, ties broken by id. entries has each of them by id, as they
+        # were queued.
+        self.queue = []
+        self.entries = {}
+        # best[k][s] is the most that can be saved on the first k of queue,
+        # ending in state s; how[k][s] is the side queue[k - 1] joined to
+        # get there, and the state before.
+        self.best = [(0, None, None, None)]
+        self.how = [None]
+        # best and how are good for queue[:valid].
+        self.valid = 0
+        self._plan = None
+
+        # (pizza id, vegetarian) -> (price, kind), as of the menu
+        self._kinds = {}
+
+    def _kind(self, person_id):
+        pizza_id = self.roster.pizza_ids[person_id]
+        vegetarian = self.roster.vegetarians[person_id]
+        key = (pizza_id, vegetarian)
+
+        kind = self._kinds.get(key)
+        if kind is None:
+            price, veg_pizza = self.menu[self.roster.pizzas[pizza_id]]
+            if vegetarian:
+                kind = (price, veg_pizza and VEG or ALONE)
+            else:
+                kind = (price, veg_pizza and EITHER or MEAT)
+            self._kinds[key] = kind
+        return kind
+
+    def update(self, selected):
+        self.apply(*self.selected.diff(selected))
+
+    def apply(self, added, removed):
+        pizza_ids = self.roster.pizza_ids
+        moved = None
+
+        for i in added:
+            if i not in self.selected:
+                self.selected.add(i)
+                if pizza_ids[i]:
+                    entry = self.entries[i] = (-self._kind(i)[0], i)
+                    k = bisect.bisect_left(self.queue, entry)
+                    self.queue.insert(k, entry)
+                    if moved is None or k < moved:
+                        moved = k
+
+        for i in removed:
+            if i in self.selected:
+                self.selected.discard(i)
+                entry = self.entries.pop(i, None)
+                if entry is not None:
+                    k = bisect.bisect_left(self.queue, entry)
+                    del self.queue[k]
+                    if moved is None or k < moved:
+                        moved = k
+
+        # Nobody with a pizza came or went: the order stands.
+        if moved is not None:
+            self.valid = min(moved, self.valid)
+            self._plan = None
+
+    def refresh(self):
+        """Starts again from scratch, for when the menu or people's pizzas
+        have changed."""
+        self._kinds = {}
+        selected, self.selected = self.selected, AttendeeSet()
+        self.queue = []
+        self.entries = {}
+        self.valid = 0
+        self._plan = None
+        self.update(selected)
+
+    def _run(self):
+        queue = self.queue
+        best, how = self.best, self.how
+        del best[self.valid + 1:]
+        del how[self.valid + 1:]
+
+        for k in xrange(self.valid, len(queue)):
+            price, kind = self._kind(queue[k][1])
+            here = best[k]
+
+            if kind == ALONE:
+                best.append(here)
+                how.append([(_NOWHERE, s) for s in xrange(4)])
+                continue
+
+            # Everyone else joins a side: hanging back never saves more.
+            there = [None] * 4
+            steps = [None] * 4
+            for side in _sides(kind):
+                for s in xrange(4):
+                    if here[s] is None:
+                        continue
+                    # Joining a side with someone waiting pairs them up, and
+                    # this pizza, the cheaper, comes free.
+                    saving = here[s] + (s & side and price or 0)
+                    t = s ^ side
+                    if there[t] is None or saving > there[t]:
+                        there[t] = saving
+                        steps[t] = (side, s)
+
+            best.append(tuple(there))
+            how.append(steps)
+
+        self.valid = len(queue)
+
+    def plan(self):
+        if self._plan is not None:
+            return self._plan
+
+        self._run()
+        queue, best, how = self.queue, self.best, self.how
+
+        # Walk back from the best ending to find everyone's side...
+        final = best[len(queue)]
+        s = max([t for t in xrange(4) if final[t] is not None],
+                key=final.__getitem__)
+        saving = final[s]
+        sides = [None] * len(queue)
+        for k in xrange(len(queue), 0, -1):
+            sides[k - 1], s = how[k][s]
+
+        # ... then pair each side off, dearest first.
+        pairs = []
+        singles = []
+        waiting = {}
+        for k, (_, person_id) in enumerate(queue):
+            side = sides[k]
+            if side == _NOWHERE:
+                singles.append(person_id)
+            elif side in waiting:
+                pairs.append((waiting.pop(side), person_id))
+            else:
+                waiting[side] = person_id
+        singles.extend(waiting.values())
+
+        price = -sum(p for p, _ in queue)
+        self._plan = Plan(pairs, singles, price, saving)
+        return self._plan
+
+    def markup(self):
+        """Returns the order as lines of markup, or [] if nobody selected
+        has a usual pizza."""
+        if not self.queue:
+            return []
+
+        from malvern import esc
+
+        roster = self.roster
+        plan = self.plan()
+        lines = ["<b>Pizzas:</b> %s (saving %s)" % (pence(plan.cost()),
+                                                     pence(plan.saving))]
+        for a, b in plan.pairs:
+            lines.append("    %s + %s: %s, %s" % (esc(roster.pizza(a)),
+                esc(roster.pizza(b)), esc(roster.name(a)),
+                esc(roster.name(b))))
+        for a in plan.singles:
+            lines.append("    %s: %s" % (esc(roster.pizza(a)),
+                                        esc(roster.name(a))))
+        return lines
+
+# vim: sts=4 sw=4
@@ -17,16 +17,61 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-import dbus
-import dbus.glib
-
-import hildon
-import osso
+from instrument import traced
 
 # Replace this with your own gettext() functionality
 def _(x): return x
 
 
+class MaemoPlatform(object):
+    """Everything FremantleRotation needs from the device
+
+    This is the real thing, talking to MCE and HAL over the system bus. To
+    run FremantleRotation anywhere else, pass it something with the same
+    methods (see fakemaemo.py).
+    """
+
+    # sysfs device name for the keyboard slider switch
+    KBD_SLIDER = '/sys/devices/platform/gpio-switch/slide/state'
+
+    def __init__(self, app_id, version):
+        import dbus
+        import dbus.glib
+
+        import gobject
+        import hildon
+        import osso
+
+        self.hildon = hildon
+        self.osso = osso
+        self.PORTRAIT_MODE_SUPPORT = hildon.PORTRAIT_MODE_SUPPORT
+        self.PORTRAIT_MODE_REQUEST = hildon.PORTRAIT_MODE_REQUEST
+        self.timeout_add = gobject.timeout_add
+        self.source_remove = gobject.source_remove
+
+        self._osso_context = osso.Context(app_id, version, False)
+        self._stack = hildon.WindowStack.get_default()
+        self.system_bus = dbus.Bus.get_system()
+        self.program = hildon.Program.get_instance()
+
+    def rpc_run(self, service, path, interface, method):
+        rpc = self.osso.Rpc(self._osso_context)
+        rpc.rpc_run(service, path, interface, method, use_system_bus=True)
+
+    def get_windows(self):
+        return self._stack.get_windows()
+
+    def set_portrait_flags(self, window, flags):
+        self.hildon.hildon_gtk_window_set_portrait_flags(window, flags)
+
+    def read_keyboard_state(self, closed):
+        # For sbox, if the device does not exist assume that it's closed
+        try:
+            return open(self.KBD_SLIDER).read().strip()
+        except IOError:
+            return closed
+
+
 class FremantleRotation(object):
     """thp's screen rotation for Maemo 5
 
@@ -38,6 +83,10 @@ class FremantleRotation(object):
 
     You can set the mode for rotation to AUTOMATIC (default), NEVER or
     ALWAYS with the set_mode() method.
+
+    Accelerometer readings near the flip point are ignored, and the
+    orientation has to settle before the window is relaid out, so holding
+    the device at 45 degrees doesn't make it flap back and forth.
     """
     AUTOMATIC, NEVER, ALWAYS = range(3)
 
@@ -54,30 +103,43 @@ class FremantleRotation(object):
     _MCE_REQUEST_PATH = '/com/nokia/mce/request'
     _MCE_REQUEST_IF = 'com.nokia.mce.request'
 
-    # sysfs device name for the keyboard slider switch
-    KBD_SLIDER = '/sys/devices/platform/gpio-switch/slide/state'
     _KBD_OPEN = 'open'
     _KBD_CLOSED = 'closed'
 
-    def __init__(self, app_name, main_window=None, version='1.0', mode=0):
+    # Readings within this many mG of the flip point (where |x| == |y|) are
+    # too close to call, and don't change anything
+    HYSTERESIS = 150
+
+    # How long (in ms) a new orientation has to hold before we relayout
+    SETTLE_MS = 300
+
+    def __init__(self, app_name, main_window=None, version='1.0', mode=0,
+                 platform=None):
         """Create a new rotation manager
 
         app_name    ... The name of your application (for osso.Context)
         main_window ... The root window (optional, hildon.StackableWindow)
         version     ... The version of your application (optional, string)
         mode        ... Initial mode for this manager (default: AUTOMATIC)
+        platform    ... D-Bus, osso and hildon (optional, MaemoPlatform)
         """
+        app_id = '-'.join((app_name, self.__class__.__name__))
+        if platform is None:
+            platform = MaemoPlatform(app_id, version)
+        self._platform = platform
+
         self._orientation = None
         self._main_window = main_window
-        self._stack = hildon.WindowStack.get_default()
         self._mode = -1
         self._last_dbus_orientation = None
+        # The orientation waiting to settle, and its timeout
+        self._settling = None
+        self._settle_id = None
+        # Only re-read when the cover signal says it's changed
         self._keyboard_state = self._get_keyboard_state()
-        app_id = '-'.join((app_name, self.__class__.__name__))
-        self._osso_context = osso.Context(app_id, version, False)
-        program = hildon.Program.get_instance()
-        program.connect('notify::is-topmost', self._on_topmost_changed)
-        system_bus = dbus.Bus.get_system()
+        platform.program.connect('notify::is-topmost',
+                self._on_topmost_changed)
+        system_bus = platform.system_bus
         system_bus.add_signal_receiver(self._on_orientation_signal, \
                 signal_name='sig_device_orientation_ind', \
                 dbus_interface='com.nokia.mce.signal', \
@@ -125,12 +187,10 @@ class FremantleRotation(object):
             self._mode = new_mode
 
     def _send_mce_request(self, request):
-        rpc = osso.Rpc(self._osso_context)
-        rpc.rpc_run(self._MCE_SERVICE, \
-                    self._MCE_REQUEST_PATH, \
-                    self._MCE_REQUEST_IF, \
-                    request, \
-                    use_system_bus=True)
+        self._platform.rpc_run(self._MCE_SERVICE, \
+                               self._MCE_REQUEST_PATH, \
+                               self._MCE_REQUEST_IF, \
+                               request)
 
     def _on_topmost_changed(self, program, property_spec):
         # XXX: This seems to never get called on Fremantle(?)
@@ -149,12 +209,13 @@ class FremantleRotation(object):
             # The main window is at the "bottom" of the window stack, and as
             # the list we get with get_windows() is sorted "topmost first", we
             # simply take the last item of the list to get our main window
-            windows = self._stack.get_windows()
+            windows = self._platform.get_windows()
             if windows:
                 return windows[-1]
             else:
                 return None
 
+    @traced('FremantleRotation._orientation_changed')
     def _orientation_changed(self, orientation):
         if self._orientation == orientation:
             # Ignore repeated requests
@@ -163,24 +224,21 @@ class FremantleRotation(object):
         flags = 0
 
         if orientation != self._LANDSCAPE:
-            flags |= hildon.PORTRAIT_MODE_SUPPORT
+            flags |= self._platform.PORTRAIT_MODE_SUPPORT
 
         if orientation == self._PORTRAIT:
-            flags |= hildon.PORTRAIT_MODE_REQUEST
+            flags |= self._platform.PORTRAIT_MODE_REQUEST
 
         window = self._get_main_window()
         if window is not None:
-            hildon.hildon_gtk_window_set_portrait_flags(window, flags)
+            self._platform.set_portrait_flags(window, flags)
 
         self._orientation = orientation
 
     def _get_keyboard_state(self):
-        # For sbox, if the device does not exist assume that it's closed
-        try:
-            return open(self.KBD_SLIDER).read().strip()
-        except IOError:
-            return self._KBD_CLOSED
+        return self._platform.read_keyboard_state(self._KBD_CLOSED)
 
+    @traced('FremantleRotation._keyboard_state_changed')
     def _keyboard_state_changed(self):
         state = self._get_keyboard_state()
 
@@ -194,17 +252,54 @@ class FremantleRotation(object):
 
         self._keyboard_state = state
 
+    @traced('FremantleRotation._on_keyboard_signal')
     def _on_keyboard_signal(self, condition, button_name):
         if condition == 'ButtonPressed' and button_name == 'cover':
             self._keyboard_state_changed()
 
+    @traced('FremantleRotation._on_orientation_signal')
     def _on_orientation_signal(self, orientation, stand, face, x, y, z):
-        if orientation in (self._PORTRAIT, self._LANDSCAPE):
-            if self._mode == self.AUTOMATIC and \
-                    self._keyboard_state != self._KBD_OPEN:
-                # Automatically set the rotation based on hardware orientation
-                self._orientation_changed(orientation)
+        if orientation not in (self._PORTRAIT, self._LANDSCAPE):
+            return
+
+        if self._last_dbus_orientation is None:
+            # Nothing to flap between yet, so don't keep them waiting
+            self._orientation_settled(orientation)
+            return
+
+        if abs(abs(x) - abs(y)) < self.HYSTERESIS:
+            # Somewhere near 45 degrees: leave things as they are
+            return
+
+        if orientation == self._settling:
+            # Already waiting for this one; carry on waiting
+            return
 
-            # Save the current orientation for "automatic" mode later on
-            self._last_dbus_orientation = orientation
+        self._cancel_settling()
+        if orientation != self._last_dbus_orientation:
+            self._settling = orientation
+            self._settle_id = self._platform.timeout_add(self.SETTLE_MS, \
+                    self._on_settled)
+
+    def _cancel_settling(self):
+        if self._settle_id is not None:
+            self._platform.source_remove(self._settle_id)
+        self._settle_id = None
+        self._settling = None
+
+    def _on_settled(self):
+        orientation = self._settling
+        self._settle_id = None
+        self._settling = None
+        self._orientation_settled(orientation)
+        return False
+
+    def _orientation_settled(self, orientation):
+        if self._mode == self.AUTOMATIC and \
+                self._keyboard_state != self._KBD_OPEN:
+            # Automatically set the rotation based on hardware orientation
+            self._orientation_changed(orientation)
+
+        # Save the current orientation for "automatic" mode later on
+        self._last_dbus_orientation = orientation
 
@@ -0,0 +1,326 @@
+# encoding: utf-8
+#
+# A roster that lives on someone else's server.py.
+# Copyright © 2010, Will Thompson <will@willthompson.co.uk>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import sys
+import Queue
+import socket
+import httplib
+import urlparse
+import threading
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import journal
+from roster import Roster
+
+class ServerError(Exception):
+    pass
+
+class Client(object):
+    # Talks JSON to a server.py over one kept-alive connection.
+    def __init__(self, url):
+        url = urlparse.urlsplit(url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.prefix = url.path.rstrip('/')
+        self.connection = None
+
+    def request(self, method, path, body=None):
+        headers = { 'Content-Type': 'application/json' }
+        if body is not None:
+            body = json.dumps(body)
+
+        # A kept-alive connection the server has since dropped only shows up
+        # as a failure when we use it, so try once more with a fresh one.
+        for attempt in (0, 1):
+            if self.connection is None:
+                self.connection = httplib.HTTPConnection(self.host, self.port)
+                self.connection.connect()
+                # Requests are small, and we wait for each answer.
+                self.connection.sock.setsockopt(socket.IPPROTO_TCP,
+                                                socket.TCP_NODELAY, 1)
+
+            try:
+                self.connection.request(method, self.prefix + path, body,
+                                        headers)
+                response = self.connection.getresponse()
+                data = response.read()
+                break
+            except (httplib.HTTPException, IOError):
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+
+        result = json.loads(data)
+        if response.status >= 400:
+            raise ServerError("%s %s: %s" % (method, path,
+                result.get('error', response.status)))
+        return result
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+def _utf8(s):
+    if isinstance(s, unicode):
+        return s.encode('utf-8')
+    return s
+
+class RemoteRoster(Roster):
+    # A Roster whose changes go to a server rather than a journal. Ids are
+    # the server's: they're handed out in order and never reused, so we can
+    # always catch up by asking for everyone after the last one we know.
+    #
+    # Talking to the server is left to a thread of its own, which makes one
+    # request at a time in the order they were asked for, so that nothing
+    # waits on the network but adding people (who need their id). poll()
+    # asks what everyone else has changed, and the next poll() takes it in,
+    # as Roster takes in what other processes wrote. Writes that don't get
+    # through are put back by poll(), to go again with the next flush().
+    __slots__ = ('client', 'requests', 'arrived', 'failed', 'polling',
+                 'sent', 'version', 'epoch', 'reached')
+
+    def __init__(self, url):
+        super(RemoteRoster, self).__init__()
+        self.client = Client(url)
+
+        # (function, args, reply) for the thread to call, replying on reply
+        # if it's not None.
+        self.requests = Queue.Queue()
+        # (sent, changes) from polls: what the server said, and how many of
+        # our writes had been sent when we asked.
+        self.arrived = Queue.Queue()
+        # (records, added, removed) from writes which didn't get through.
+        self.failed = Queue.Queue()
+        self.polling = False
+        self.sent = 0
+        # The server's version we're up to, as of its epoch.
+        self.version = 0
+        self.epoch = None
+        # Whether we've heard from the server at all.
+        self.reached = False
+
+        worker = threading.Thread(target=self._work)
+        worker.setDaemon(True)
+        worker.start()
+
+    def _work(self):
+        while True:
+            f, args, reply = self.requests.get()
+            try:
+                result = f(*args)
+            except Exception, e:
+                if reply is None:
+                    print >>sys.stderr, "couldn't reach the server: %s" % e
+                result = e
+
+            if reply is not None:
+                reply.put(result)
+
+    def _call(self, f, *args):
+        # Waits for everything asked for so far, and then f.
+        reply = Queue.Queue()
+        self.requests.put((f, args, reply))
+        result = reply.get()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _send(self, f, *args):
+        self.sent += 1
+        self.requests.put((f, args, None))
+
+    def _changes(self, version, epoch):
+        return self.client.request('GET', '/changes?since=%u&epoch=%s' % (
+            version, epoch or ''))
+
+    def _poll(self, version, epoch, sent):
+        changes = None
+        try:
+            changes = self._changes(version, epoch)
+        finally:
+            self.arrived.put((sent, changes))
+
+    def _take_in(self, changes, ours=None):
+        """Takes in everyone the server says has changed, keeping whatever
+        we've changed and not yet sent on top. Anything but ours, whom we
+        just added, counts as a merge."""
+        self.version = changes['version']
+        self.epoch = changes['epoch']
+        self.reached = True
+
+        drinks = set(record[1] for record in self.pending
+                     if record[0] == journal.DRINK)
+        pizzas = set(record[1] for record in self.pending
+                     if record[0] == journal.PIZZA)
+        merged = False
+
+        for person in changes['people']:
+            i = person['id']
+            if i == len(self):
+                self.append(_utf8(person['name']), _utf8(person['drink']),
+                            person['vegetarian'],
+                            _utf8(person.get('pizza') or ''))
+                merged = merged or i != ours
+            elif i < len(self):
+                if i not in drinks:
+                    drink_id = self.drinks.intern(_utf8(person['drink']))
+                    if drink_id != self.drink_ids[i]:
+                        self.drink_ids[i] = drink_id
+                        merged = True
+                if i not in pizzas:
+                    pizza_id = self.pizzas.intern(
+                        _utf8(person.get('pizza') or ''))
+                    if pizza_id != self.pizza_ids[i]:
+                        self.pizza_ids[i] = pizza_id
+                        merged = True
+            else:
+                # A gap: everyone's on their way, next time.
+                continue
+
+            ours_unsent = (i in self.attending) != (i in self.saved_attending)
+            if person['attending']:
+                self.saved_attending.add(i)
+                if not ours_unsent and i not in self.attending:
+                    self.attending.add(i)
+                    merged = True
+            else:
+                self.saved_attending.discard(i)
+                if not ours_unsent and i in self.attending:
+                    self.attending.discard(i)
+                    merged = True
+
+        if merged:
+            self.merges += 1
+        return merged
+
+    def load(self):
+        # If the server can't be reached, start out empty: everyone turns up
+        # with the first poll() that gets through.
+        try:
+            self._take_in(self._call(self._changes, 0, None))
+        except (IOError, httplib.HTTPException, ServerError, ValueError), e:
+            print >>sys.stderr, "couldn't reach the server: %s" % e
+            return False
+
+        self.merges = 0
+        return True
+
+    def _unsend(self, records, added, removed):
+        # Puts back a write which didn't get through, under anything changed
+        # since, as though it had never been flushed.
+        self.pending[:0] = records
+        for i in added:
+            self.saved_attending.discard(i)
+        for i in removed:
+            self.saved_attending.add(i)
+
+    def poll(self):
+        """Takes in whatever the last poll() heard from the server, and asks
+        again. Doesn't wait; returns True if anything changed."""
+        # Writes fail before any answer to a later poll arrives, so these
+        # are back in place before anything the server says is taken in.
+        while True:
+            try:
+                self._unsend(*self.failed.get_nowait())
+            except Queue.Empty:
+                break
+
+        merged = False
+        while True:
+            try:
+                sent, changes = self.arrived.get_nowait()
+            except Queue.Empty:
+                break
+
+            self.polling = False
+            # If we've written anything since asking, this may be from
+            # before it; wait for the next one.
+            if changes is not None and sent == self.sent:
+                merged = self._take_in(changes) or merged
+
+        if not self.polling:
+            self.polling = True
+            self.requests.put((self._poll,
+                (self.version, self.epoch, self.sent), None))
+
+        return merged
+
+    def add_person(self, name, drink, vegetarian, pizza=''):
+        # Ask for an id straight away, rather than at the next flush, so that
+        # it's the one everyone else sees. If anyone else has joined since we
+        # last looked, they come first.
+        self.sent += 1
+        result = self._call(self.client.request, 'POST', '/people', {
+            'name': name, 'drink': drink, 'vegetarian': vegetarian,
+            'pizza': pizza })
+        self._take_in(self._call(self._changes, self.version, self.epoch),
+                      ours=result['id'])
+        return result['id']
+
+    def import_people(self, people):
+        n = len(self)
+        for person in people:
+            self.add_person(*person)
+        return len(self) - n
+
+    def _write(self, records, added, removed):
+        # Each request says what things should be, rather than what to do
+        # to them, so sending all of them again after a failure is harmless.
+        try:
+            for record in records:
+                if record[0] == journal.DRINK:
+                    _, person_id, drink = record
+                    self.client.request('PUT', '/people/%u' % person_id,
+                                        { 'drink': drink })
+                elif record[0] == journal.PIZZA:
+                    _, person_id, pizza = record
+                    self.client.request('PUT', '/people/%u' % person_id,
+                                        { 'pizza': pizza })
+
+            if added or removed:
+                self.client.request('POST', '/attending',
+                    { 'added': added, 'removed': removed })
+        except (IOError, httplib.HTTPException):
+            # The server refusing it is another matter: it'd only refuse
+            # it again.
+            self.failed.put((records, added, removed))
+            raise
+
+    def flush(self):
+        # Sent behind our backs.
+        records, self.pending = self.pending, []
+        added, removed = self.saved_attending.diff(self.attending)
+        self.saved_attending = self.attending.copy()
+
+        if records or added or removed:
+            self._send(self._write, records, added, removed)
+
+    save = flush
+
+    def close(self):
+        """Waits for everything to reach the server."""
+        self._call(self.client.close)
+
+# vim: sts=4 sw=4
@@ -0,0 +1,351 @@
+# encoding: utf-8
+#
+# The roster of people who might come to lunch, independent of any UI.
+# Copyright © 2010, Will Thompson <will@willthompson.co.uk>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+from array import array
+from contextlib import contextmanager
+
+import journal
+from journal import Journal
+from attendees import AttendeeSet
+from drinks import DrinkCatalogue
+from instrument import traced
+from rosters import config_dir
+
+def default_path():
+    return config_dir() + '/default'
+
+def bisect_name(order, name, names):
+    """Where name goes in order, a sequence of ids sorted by their names,
+    after anyone with the same name."""
+    lo, hi = 0, len(order)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if name < names[order[mid]]:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+class Roster(object):
+    # One column per field, indexed by person id. Ids are handed out
+    # sequentially and never reused, so a person's id is also their
+    # position in every column. Drinks are stored as ids in the drinks
+    # catalogue, since most people drink the same handful of things; so are
+    # usual pizzas, in a catalogue of their own whose id 0 is '', for people
+    # who don't have one.
+    __slots__ = ('names', 'drink_ids', 'vegetarians', 'drinks', 'pizza_ids',
+                 'pizzas', 'attending', 'file_order', 'journal', 'pending',
+                 'saved_attending', 'merges')
+
+    _COLUMNS = ('names', 'drink_ids', 'vegetarians', 'drinks', 'pizza_ids',
+                'pizzas', 'attending', 'file_order')
+
+    # If more than one in this many people arrived since the roster was
+    # last written out in name order, sort everyone rather than slotting
+    # the newcomers in one by one.
+    RESORT_RATIO = 16
+
+    def __init__(self, path=None):
+        self._reset()
+
+        # If we have somewhere to keep the roster: records not yet written
+        # out, and who was coming as of the last write.
+        self.journal = path and Journal(path) or None
+        self.pending = []
+        self.saved_attending = AttendeeSet()
+        # Goes up whenever changes someone else wrote are taken in, so that
+        # anything working from the roster can tell it should look again.
+        self.merges = 0
+
+    def _reset(self):
+        self.names = []
+        self.drink_ids = array('I')
+        self.vegetarians = array('B')
+        self.drinks = DrinkCatalogue()
+        self.pizza_ids = array('I')
+        self.pizzas = DrinkCatalogue()
+        self.pizzas.intern('')
+
+        self.attending = AttendeeSet()
+
+        # The first len(file_order) ids, in name order.
+        self.file_order = array('I')
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i):
+        return (self.names[i], self.drink(i), self.is_vegetarian(i),
+                self.pizza(i))
+
+    def __iter__(self):
+        for i in xrange(len(self.names)):
+            yield self[i]
+
+    def name(self, i):
+        return self.names[i]
+
+    def drink(self, i):
+        return self.drinks[self.drink_ids[i]]
+
+    def is_vegetarian(self, i):
+        return bool(self.vegetarians[i])
+
+    def pizza(self, i):
+        return self.pizzas[self.pizza_ids[i]]
+
+    def append(self, name, drink, vegetarian, pizza=''):
+        """Adds someone without recording the fact; returns their id."""
+        person_id = len(self.names)
+        self.names.append(name)
+        self.drink_ids.append(self.drinks.intern(drink))
+        self.vegetarians.append(vegetarian and 1 or 0)
+        self.pizza_ids.append(self.pizzas.intern(pizza))
+        return person_id
+
+    def adopt(self, names, drink_ids, vegetarians, drinks, attending, order,
+              pizza_ids=None, pizzas=None):
+        """Takes over columns read from a roster file, wholesale. Files
+        from before usual pizzas have none, so nobody has one."""
+        self.names = names
+        self.drink_ids = drink_ids
+        self.vegetarians = vegetarians
+        self.drinks.restore(drinks)
+        self.attending = attending
+        self.file_order = order
+
+        if pizza_ids is None:
+            pizza_ids = array('I', [0]) * len(names)
+            pizzas = ['']
+        self.pizza_ids = pizza_ids
+        self.pizzas.restore(pizzas)
+
+    def name_order(self):
+        """Returns everyone's ids, in name order."""
+        order = self.file_order
+        names = self.names
+        n = len(order)
+
+        if n == len(names):
+            return array('I', order)
+
+        if (len(names) - n) * self.RESORT_RATIO > n:
+            return array('I', sorted(xrange(len(names)),
+                                     key=names.__getitem__))
+
+        order = array('I', order)
+        for person_id in xrange(n, len(names)):
+            order.insert(bisect_name(order, names[person_id], names),
+                         person_id)
+        return order
+
+    def add_person(self, name, drink, vegetarian, pizza=''):
+        record = (journal.ADD, name, drink, vegetarian)
+        if pizza:
+            record += (pizza, )
+
+        if self.journal is None:
+            self.pending.append(record)
+            return self.append(name, drink, vegetarian, pizza)
+
+        # Newcomers are written out straight away, so that the id they get
+        # is the one any other process sees; if others have joined in the
+        # meantime, they come first.
+        with self.journal.locked():
+            self._catch_up()
+            person_id = self.append(name, drink, vegetarian, pizza)
+            self.journal.append([record])
+        return person_id
+
+    def set_drink(self, person_id, drink):
+        self.drink_ids[person_id] = self.drinks.intern(drink)
+        self.pending.append((journal.DRINK, person_id, drink))
+
+    def set_pizza(self, person_id, pizza):
+        self.pizza_ids[person_id] = self.pizzas.intern(pizza)
+        self.pending.append((journal.PIZZA, person_id, pizza))
+
+    def import_people(self, people):
+        """Adds everyone from an iterable of (name, drink, vegetarian[,
+        pizza]), writing the lot out once at the end rather than journalling
+        each of them. Returns how many were added."""
+        if self.journal is None:
+            return self._import(people)
+
+        # Nobody else can add anyone until we're done, so the ids are ours.
+        with self.journal.locked():
+            self._catch_up()
+            try:
+                return self._import(people)
+            finally:
+                # Even if the import fell over half-way, keep what we got.
+                self._save()
+
+    def _import(self, people):
+        n = len(self.names)
+        for person in people:
+            self.append(*person)
+        return len(self.names) - n
+
+    @contextmanager
+    def batch(self):
+        """Holds the lock across several changes, having caught up with
+        other processes, so that nobody else changes anything meanwhile, and
+        syncing to disk is done once for all of them."""
+        if self.journal is None:
+            yield
+        else:
+            with self.journal.locked():
+                self._catch_up()
+                yield
+
+    def set_attending(self, attending):
+        self.attending = attending.copy()
+
+    def dirty(self):
+        return bool(self.pending) or self.attending != self.saved_attending
+
+    @traced('roster.load')
+    def load(self):
+        try:
+            with self.journal.locked(shared=True):
+                found = self.journal.load(self)
+        except (TypeError, ValueError), e:
+            print "database corrupted! :'( (%s)" % e
+            print "kept a copy at %s" % self.journal.set_aside_corrupt()
+            self._reset()
+            self.journal.skip()
+            return False
+
+        if not found:
+            return False
+
+        self.saved_attending = self.attending.copy()
+
+        if self.journal.legacy:
+            # A pickle from before roster files: convert it, once, keeping
+            # the original for History.migrate().
+            self.journal.set_aside_legacy()
+            self.save()
+
+        return True
+
+    def catch_up(self):
+        """Takes in whatever other processes have written since we last
+        looked. Hold the lock."""
+        if self.journal is not None:
+            self._catch_up()
+
+    def _catch_up(self):
+        """Takes in whatever other processes have written since we last
+        looked, keeping our own changes on top. Hold the lock."""
+        records = self.journal.catch_up()
+        if records is None:
+            self._reload()
+        elif records:
+            self._merge(records)
+        else:
+            return
+
+        self.merges += 1
+
+    def _merge(self, records):
+        added, removed = self.saved_attending.diff(self.attending)
+
+        self.attending = self.saved_attending
+        for record in records:
+            self.journal.replay(record, self)
+        self.saved_attending = self.attending.copy()
+
+        self._redo(added, removed)
+
+    def _reload(self):
+        # Someone's compacted the journal, so there's nothing to replay:
+        # start again from what's on disk. Everyone we know about is in it,
+        # with the same ids, since newcomers are written out at once.
+        added, removed = self.saved_attending.diff(self.attending)
+
+        theirs = Roster()
+        self.journal.load(theirs)
+        for column in self._COLUMNS:
+            setattr(self, column, getattr(theirs, column))
+        self.saved_attending = self.attending.copy()
+
+        self._redo(added, removed)
+
+    def _redo(self, added, removed):
+        # What we've changed and not yet written goes back on top, so that
+        # when it's written, it wins.
+        self.attending.update(added)
+        self.attending.difference_update(removed)
+        for record in self.pending:
+            self.journal.replay(record, self)
+
+    @traced('roster.flush')
+    def flush(self):
+        with self.journal.locked():
+            self._catch_up()
+            self.journal.append(self.unwritten())
+
+            if self.journal.needs_compaction():
+                self._save()
+
+    def unwritten(self):
+        """Returns the records not yet written out, which from now on count
+        as written. Hold the lock, having caught up."""
+        # However many times attendance changed since the last write, only
+        # the net difference hits the disk.
+        records, self.pending = self.pending, []
+
+        added, removed = self.saved_attending.diff(self.attending)
+        if added or removed:
+            records.append((journal.ATTEND, added, removed))
+        self.saved_attending = self.attending.copy()
+
+        return records
+
+    def frozen(self):
+        """Returns a copy of the roster as it is now, with nowhere to be
+        kept, to write out while this one carries on changing."""
+        if isinstance(self.names, list):
+            names = self.names[:]
+        else:
+            names = self.names.copy()
+
+        copy = Roster()
+        # Slicing copies an array in one go; array(array) goes one by one.
+        copy.adopt(names, self.drink_ids[:], self.vegetarians[:],
+                   list(self.drinks), self.attending.copy(),
+                   self.file_order[:], self.pizza_ids[:], list(self.pizzas))
+        return copy
+
+    @traced('roster.save')
+    def save(self):
+        with self.journal.locked():
+            self._catch_up()
+            self._save()
+
+    def _save(self):
+        self.pending = []
+        order = self.name_order()
+        self.journal.compact(self, order)
+        self.file_order = order
+        self.saved_attending = self.attending.copy()
+
+# vim: sts=4 sw=4
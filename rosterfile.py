@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# The on-disk roster format: versioned, checksummed, and mmap-able.
+# Copyright © 2010, Will Thompson <will@willthompson.co.uk>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# A roster file is a header, a table of sections, and the sections
+# themselves, each starting on a four-byte boundary. All integers are
+# little-endian.
+#
+#   header:   'BBRS', u16 version, u16 flags (0), u32 people, u32 sections,
+#             u32 CRC-32 of the header before it and the section table
+#   section:  4-byte tag, u32 offset, u32 length, u32 CRC-32 of the data
+#
+# The sections are the Roster's columns as fixed-width tables, indexed by
+# person id, plus string pools:
+#
+#   NOFF  u32 × (people + 1): where each name starts in NAME, and the end
+#   NAME  the names, back to back
+#   DRNK  u32 × people: drink ids
+#   VEGE  u8 × people: 1 if vegetarian
+#   ORDR  u32 × people: person ids in name order, so nobody has to sort
+#   ATTN  who's coming, as AttendeeSet.tostring()
+#   DOFF  u32 × (drinks + 1), DNAM: drink names, as for NOFF and NAME
+#   PIZZ  u32 × people: usual pizza ids, 0 for none
+#   POFF  u32 × (pizzas + 1), PNAM: pizza names, as for DOFF and DNAM
+#
+#   GENR  u32: the generation, one more than the snapshot it replaced
+#
+# NOFF, NAME, DRNK, VEGE, ORDR, ATTN, DOFF and DNAM must be there. Files
+# written before usual pizzas lack the pizza sections, and read as though
+# nobody has one; files without GENR are generation 0. Readers ignore
+# sections they don't know. Version 1 files have no header CRC, and are
+# otherwise the same.
+#
+# Opening a roster maps the file, checks and copies the small tables, and
+# leaves the names where they are: each is sliced out of the map when
+# someone asks for it, so only the pages holding names anyone looks at
+# are read. NAME is the one section not checksummed on open, since that
+# would mean reading all of it; verify() checks everything.
+
+import sys
+import mmap
+import zlib
+import struct
+from array import array
+
+from attendees import AttendeeSet
+
+MAGIC = 'BBRS'
+VERSION = 2
+
+_HEADER = struct.Struct('<4sHHII')
+_HEADER_CRC = struct.Struct('<I')
+_SECTION = struct.Struct('<4sIII')
+
+_REQUIRED = ('NOFF', 'NAME', 'DRNK', 'VEGE', 'ORDR', 'ATTN', 'DOFF', 'DNAM')
+
+_U32 = 'I'
+assert array(_U32).itemsize == 4
+
+class CorruptRosterError(ValueError):
+    pass
+
+def is_roster_file(f):
+    """Peeks at f to see whether it's one of ours."""
+    start = f.tell()
+    magic = f.read(len(MAGIC))
+    f.seek(start)
+    return magic == MAGIC
+
+def _le(a):
+    if sys.byteorder != 'little':
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a.tostring()
+
+def _from_le(typecode, data):
+    a = array(typecode)
+    a.fromstring(data)
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return a
+
+def _crc(data):
+    return zlib.crc32(data) & 0xffffffff
+
+def _pool(strings):
+    offsets = array(_U32, [0])
+    end = 0
+    for s in strings:
+        end += len(s)
+        offsets.append(end)
+    return _le(offsets), ''.join(strings)
+
+def write(f, roster, order, generation=0):
+    """Writes roster to f; order is its person ids, in name order."""
+    n = len(roster)
+    if len(order) != n:
+        raise ValueError("order has %u people, roster has %u" %
+            (len(order), n))
+
+    name_offsets, names = _pool([roster.names[i] for i in xrange(n)])
+    drink_offsets, drink_names = _pool(list(roster.drinks))
+    drink_ids = array(_U32, roster.drink_ids)
+    pizza_offsets, pizza_names = _pool(list(roster.pizzas))
+
+    sections = [
+        ('NOFF', name_offsets),
+        ('NAME', names),
+        ('DRNK', _le(drink_ids)),
+        ('VEGE', roster.vegetarians.tostring()),
+        ('ORDR', _le(array(_U32, order))),
+        ('ATTN', roster.attending.tostring()),
+        ('DOFF', drink_offsets),
+        ('DNAM', drink_names),
+        ('PIZZ', _le(array(_U32, roster.pizza_ids))),
+        ('POFF', pizza_offsets),
+        ('PNAM', pizza_names),
+        ('GENR', _le(array(_U32, [generation]))),
+    ]
+
+    start = _HEADER.size + _HEADER_CRC.size
+    offset = start + _SECTION.size * len(sections)
+    table = []
+    for tag, data in sections:
+        offset += -offset % 4
+        table.append(_SECTION.pack(tag, offset, len(data), _crc(data)))
+        offset += len(data)
+
+    header = _HEADER.pack(MAGIC, VERSION, 0, n, len(sections))
+    table = ''.join(table)
+    f.write(header)
+    f.write(_HEADER_CRC.pack(_crc(header + table)))
+    f.write(table)
+
+    written = start + len(table)
+    for tag, data in sections:
+        padding = -written % 4
+        f.write('\0' * padding)
+        f.write(data)
+        written += padding + len(data)
+
+class MappedStrings(object):
+    # A list-alike of strings living in a string pool in a mapped file, which
+    # can also grow: appended strings live in an ordinary list.
+    __slots__ = ('map', 'base', 'offsets', 'extra')
+
+    def __init__(self, map, base, offsets):
+        self.map = map
+        self.base = base
+        self.offsets = offsets
+        self.extra = []
+
+    def __len__(self):
+        return len(self.offsets) - 1 + len(self.extra)
+
+    def __getitem__(self, i):
+        mapped = len(self.offsets) - 1
+        if i < 0:
+            i += len(self)
+
+        if 0 <= i < mapped:
+            base = self.base
+            return self.map[base + self.offsets[i]:base + self.offsets[i + 1]]
+
+        return self.extra[i - mapped]
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def append(self, s):
+        self.extra.append(s)
+
+    def copy(self):
+        # The mapped part never changes, so it can be shared.
+        other = MappedStrings(self.map, self.base, self.offsets)
+        other.extra = self.extra[:]
+        return other
+
+class RosterFile(object):
+    def __init__(self, f):
+        try:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (mmap.error, ValueError), e:
+            # An empty file can't be mapped.
+            raise CorruptRosterError("can't map roster: %s" % e)
+
+        try:
+            magic, version, flags, self.people, n_sections = \
+                _HEADER.unpack_from(self.map, 0)
+        except struct.error:
+            raise CorruptRosterError("truncated header")
+
+        if magic != MAGIC:
+            raise CorruptRosterError("not a roster file")
+        if version > VERSION:
+            raise CorruptRosterError("roster format %u is too new" % version)
+
+        start = _HEADER.size
+        if version >= 2:
+            start += _HEADER_CRC.size
+        end = start + n_sections * _SECTION.size
+        if end > len(self.map):
+            raise CorruptRosterError("truncated section table")
+
+        if version >= 2:
+            crc, = _HEADER_CRC.unpack_from(self.map, _HEADER.size)
+            if _crc(self.map[:_HEADER.size] + self.map[start:end]) != crc:
+                raise CorruptRosterError("bad checksum for header")
+
+        self.sections = {}
+        for k in xrange(n_sections):
+            tag, offset, length, crc = _SECTION.unpack_from(self.map,
+                start + k * _SECTION.size)
+            if offset + length > len(self.map):
+                raise CorruptRosterError("section %s runs off the end" % tag)
+            self.sections[tag] = (offset, length, crc)
+
+        for tag in _REQUIRED:
+            if tag not in self.sections:
+                raise CorruptRosterError("no %s section" % tag)
+
+    def section(self, tag, verify=True):
+        try:
+            offset, length, crc = self.sections[tag]
+        except KeyError:
+            raise CorruptRosterError("no %s section" % tag)
+
+        data = self.map[offset:offset + length]
+        if verify and _crc(data) != crc:
+            raise CorruptRosterError("bad checksum for %s" % tag)
+        return data
+
+    def table(self, tag, typecode, length):
+        a = _from_le(typecode, self.section(tag))
+        if len(a) != length:
+            raise CorruptRosterError("%s has %u entries, not %u" %
+                (tag, len(a), length))
+        return a
+
+    def verify(self):
+        for tag in self.sections:
+            self.section(tag)
+        _columns(self)
+
+    def generation(self):
+        if 'GENR' not in self.sections:
+            return 0
+        return self.table('GENR', _U32, 1)[0]
+
+def _offsets(rf, tag, pool_tag):
+    offsets = _from_le(_U32, rf.section(tag))
+    _, pool_length, _ = rf.sections.get(pool_tag, (0, 0, 0))
+    if not offsets or offsets[-1] > pool_length:
+        raise CorruptRosterError("%s doesn't fit %s" % (tag, pool_tag))
+    return offsets
+
+def _strings(rf, tag, pool_tag):
+    offsets = _offsets(rf, tag, pool_tag)
+    pool = rf.section(pool_tag)
+    return [pool[offsets[k]:offsets[k + 1]] for k in xrange(len(offsets) - 1)]
+
+def _ids(rf, tag, n, strings):
+    ids = rf.table(tag, _U32, n)
+    if n and max(ids) >= len(strings):
+        raise CorruptRosterError("%s id out of range" % tag)
+    return ids
+
+def generation(f):
+    """Returns the generation of the roster file f, without reading the
+    rest of it."""
+    return RosterFile(f).generation()
+
+def _columns(rf):
+    # Everything read() needs, checked against each other.
+    n = rf.people
+
+    name_offsets = _offsets(rf, 'NOFF', 'NAME')
+    if len(name_offsets) != n + 1:
+        raise CorruptRosterError("NOFF has the wrong number of entries")
+
+    drinks = _strings(rf, 'DOFF', 'DNAM')
+    drink_ids = _ids(rf, 'DRNK', n, drinks)
+
+    pizzas = pizza_ids = None
+    if 'PIZZ' in rf.sections:
+        pizzas = _strings(rf, 'POFF', 'PNAM')
+        pizza_ids = _ids(rf, 'PIZZ', n, pizzas)
+
+    vegetarians = rf.table('VEGE', 'B', n)
+    order = rf.table('ORDR', _U32, n)
+    if n and max(order) >= n:
+        raise CorruptRosterError("ORDR id out of range")
+    # One bit per id, so nobody past the end can be coming.
+    attn = rf.section('ATTN')
+    if attn[n // 8 + 1:].strip('\0') or \
+            (n // 8 < len(attn) and ord(attn[n // 8]) >> (n % 8)):
+        raise CorruptRosterError("ATTN id out of range")
+    attending = AttendeeSet.fromstring(attn)
+
+    offset, _, _ = rf.sections['NAME']
+    return (MappedStrings(rf.map, offset, name_offsets), drink_ids,
+            vegetarians, drinks, attending, order, pizza_ids, pizzas)
+
+def read(f, roster):
+    """Fills in an empty roster from f; returns its generation."""
+    rf = RosterFile(f)
+    roster.adopt(*_columns(rf))
+    return rf.generation()
+
+def verify(path):
+    """Checks every section of the roster file at path, including the
+    names, and that they fit together; raises CorruptRosterError if
+    anything's amiss."""
+    f = open(path, 'rb')
+    try:
+        RosterFile(f).verify()
+    finally:
+        f.close()
+
+def main(argv):
+    from roster import Roster, default_path
+
+    if len(argv) < 2 or argv[1] not in ('convert', 'check'):
+        print >>sys.stderr, "usage: %s convert|check [ROSTER]" % argv[0]
+        return 2
+
+    path = len(argv) > 2 and argv[2] or default_path()
+
+    if argv[1] == 'convert':
+        # Loading an old pickled roster writes it straight back out in
+        # this format.
+        roster = Roster(path)
+        if not roster.load():
+            print >>sys.stderr, "couldn't load %s" % path
+            return 1
+        roster.save()
+    else:
+        try:
+            verify(path)
+        except CorruptRosterError, e:
+            print >>sys.stderr, "%s: %s" % (path, e)
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
+
+# vim: sts=4 sw=4
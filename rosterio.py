@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Reading and writing rosters as CSV or JSON, one person at a time.
+# Copyright © 2010, Will Thompson <will@willthompson.co.uk>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+from __future__ import with_statement
+
+import re
+import sys
+import csv
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+# Everything here deals in (name, drink, vegetarian, pizza) tuples, and never
+# holds more than one of them (or one read-sized chunk of the file) at a
+# time. The pizza is optional, both here and in files.
+
+FIELDS = ('name', 'drink', 'vegetarian', 'pizza')
+
+_TRUE = ('1', 'y', 'yes', 't', 'true', 'veg', 'vegetarian')
+
+def _utf8(x):
+    if isinstance(x, unicode):
+        return x.encode('utf-8')
+    return str(x)
+
+def _person(record):
+    name = _utf8(record.get('name') or '').strip()
+    if not name:
+        raise ValueError("nameless person %r" % (record, ))
+
+    drink = _utf8(record.get('drink') or '').strip()
+
+    vegetarian = record.get('vegetarian')
+    if not isinstance(vegetarian, bool):
+        vegetarian = _utf8(vegetarian or '').strip().lower() in _TRUE
+
+    pizza = _utf8(record.get('pizza') or '').strip()
+
+    return (name, drink, vegetarian, pizza)
+
+def read_csv(f):
+    """Yields people from CSV with a name,drink,vegetarian[,pizza] header
+    row; if the header is missing, the columns are assumed to be in that
+    order."""
+    header = None
+
+    for row in csv.reader(f):
+        if not ''.join(row).strip():
+            continue
+
+        if header is None:
+            header = [column.strip().lower() for column in row]
+            if 'name' in header:
+                continue
+            header = FIELDS
+
+        yield _person(dict(zip(header, row)))
+
+# Between objects in a JSON array -- or in a file of one object per line,
+# which is also accepted -- there's nothing we care about.
+_JSON_PADDING = re.compile(r'[\s,\[\]]*')
+
+def read_json(f, chunk_size=1 << 16):
+    """Yields people from a JSON array of objects with name, drink,
+    vegetarian and (optionally) pizza keys, decoding one object at a
+    time."""
+    decoder = json.JSONDecoder()
+    buf = ''
+    i = 0
+    eof = False
+
+    while True:
+        i = _JSON_PADDING.match(buf, i).end()
+
+        if i < len(buf):
+            try:
+                record, i = decoder.raw_decode(buf, i)
+            except ValueError:
+                # Either the object straddles the end of what we've read so
+                # far, or it's actually broken.
+                if eof:
+                    raise
+            else:
+                if not isinstance(record, dict):
+                    raise ValueError("expected an object, got %r" % (record, ))
+                yield _person(record)
+                continue
+        elif eof:
+            return
+
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buf = buf[i:] + chunk
+        i = 0
+
+def write_csv(people, f):
+    writer = csv.writer(f)
+    writer.writerow(FIELDS)
+
+    for name, drink, vegetarian, pizza in people:
+        writer.writerow((name, drink, vegetarian and 'yes' or 'no', pizza))
+
+def write_json(people, f):
+    f.write('[')
+    separator = '\n'
+
+    for name, drink, vegetarian, pizza in people:
+        f.write(separator)
+        f.write(json.dumps({ 'name': name, 'drink': drink,
+                             'vegetarian': bool(vegetarian), 'pizza': pizza },
+                           sort_keys=True))
+        separator = ',\n'
+
+    f.write('\n]\n')
+
+def _is_json(path):
+    return path.lower().endswith(('.json', '.jsonl'))
+
+def read_people(f, path):
+    if _is_json(path):
+        return read_json(f)
+    return read_csv(f)
+
+def write_people(people, f, path):
+    if _is_json(path):
+        write_json(people, f)
+    else:
+        write_csv(people, f)
+
+def main(argv):
+    from roster import Roster, default_path
+
+    if len(argv) != 3 or argv[1] not in ('import', 'export'):
+        print >>sys.stderr, "usage: %s import|export ROSTER.{csv,json}" % argv[0]
+        return 2
+
+    _, command, path = argv
+    roster = Roster(default_path())
+    if not roster.load() and command == 'export':
+        print >>sys.stderr, "couldn't load %s" % roster.journal.path
+        return 1
+
+    if command == 'import':
+        with open(path, 'rb') as f:
+            n = roster.import_people(read_people(f, path))
+        print "imported %u people" % n
+    else:
+        with open(path, 'wb') as f:
+            write_people(roster, f, path)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
+
+# vim: sts=4 sw=4
@@ -0,0 +1,164 @@
+# encoding: utf-8
+#
+# Keeping track of several rosters, and which of them are open.
+# Copyright © 2010, Will Thompson <will@willthompson.co.uk>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+from __future__ import with_statement
+
+import os
+import re
+import errno
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from lru import LRUCache
+
+# The roster everyone had before there could be more than one, which keeps
+# its old file name.
+DEFAULT = 'default'
+
+# Here rather than in roster.py, so that the app can find out which roster
+# to show without importing everything needed to open one.
+def config_dir():
+    return os.environ['HOME'] + '/.config/bovine-buffet'
+
+def index_path():
+    return config_dir() + '/rosters.json'
+
+class RosterIndex(object):
+    # Which rosters there are, and which was open last, in a small file of
+    # its own: listing them shouldn't mean opening any of them.
+    def __init__(self, path=None):
+        self.path = path or index_path()
+        # name -> file name, relative to the index
+        self.files = { DEFAULT: DEFAULT }
+        self.current = DEFAULT
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                index = json.load(f)
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+        except ValueError, e:
+            print "roster index corrupted, starting afresh: %s" % e
+            return False
+
+        # json hands back unicode; everything else deals in UTF-8.
+        self.files = dict((name.encode('utf-8'), filename.encode('utf-8'))
+                          for name, filename in index['rosters'].iteritems())
+        self.current = index.get('current', DEFAULT).encode('utf-8')
+        if self.current not in self.files:
+            self.current = DEFAULT
+            self.files.setdefault(DEFAULT, DEFAULT)
+
+        return True
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        try:
+            os.makedirs(directory)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        tmp = self.path + '.new'
+        with open(tmp, 'w') as f:
+            json.dump({ 'rosters': self.files, 'current': self.current }, f,
+                      indent=2, sort_keys=True)
+        os.rename(tmp, self.path)
+
+    def names(self):
+        return sorted(self.files)
+
+    def __contains__(self, name):
+        return name in self.files
+
+    def path_for(self, name):
+        return os.path.join(os.path.dirname(self.path), self.files[name])
+
+    def history_path_for(self, name):
+        import history
+
+        if name == DEFAULT:
+            return history.default_path()
+        return self.path_for(name) + '.history'
+
+    def add(self, name):
+        """Makes a new, empty roster called name, unless there already is
+        one; either way, returns its path."""
+        if name not in self.files:
+            stem = 'roster-' + (re.sub('[^a-z0-9]+', '-', name.lower())
+                                .strip('-') or 'unnamed')
+            taken = set(self.files.itervalues())
+            filename = stem
+            n = 1
+            while filename in taken:
+                n += 1
+                filename = '%s-%u' % (stem, n)
+
+            self.files[name] = filename
+            self.save()
+
+        return self.path_for(name)
+
+    def set_current(self, name):
+        if name not in self.files:
+            raise KeyError(name)
+
+        if name != self.current:
+            self.current = name
+            self.save()
+
+class OpenRosters(object):
+    # How many rosters to keep loaded. Switching back to one of these is
+    # instant; anything older is written out and dropped, and loaded again
+    # if it's wanted.
+    CAPACITY = 4
+
+    def __init__(self, index, open_store, capacity=CAPACITY):
+        self.index = index
+        # Called with (name, path) to load a roster, returning a store with
+        # a flush() method.
+        self.open_store = open_store
+        self.stores = LRUCache(capacity, self._evicted)
+
+    def _evicted(self, name, store):
+        store.flush()
+
+    def __contains__(self, name):
+        return name in self.stores
+
+    def get(self, name):
+        store = self.stores.get(name)
+
+        if store is None:
+            store = self.open_store(name, self.index.path_for(name))
+            self.stores[name] = store
+
+        return store
+
+    def flush(self):
+        for name in list(self.stores):
+            self.stores.get(name).flush()
+
+# vim: sts=4 sw=4
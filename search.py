@@ -0,0 +1,84 @@
+# encoding: utf-8
+#
+# Finding people on the roster by (part of) their name or drink.
+# Copyright © 2010, Will Thompson <will@willthompson.co.uk>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+from array import array
+
+class SearchIndex(object):
+    # An n-gram index: every substring of up to GRAM characters of each
+    # person's name and drink maps to the ids of the people it appears in.
+    # A query no longer than GRAM is a single lookup; a longer one takes the
+    # rarest of its GRAM-grams and checks each of those people properly.
+    #
+    # Ids only ever grow, so the postings stay sorted by id for free, and
+    # anyone added to the roster since we last looked is indexed on the
+    # next search.
+    GRAM = 3
+
+    def __init__(self, roster):
+        self.roster = roster
+        self.texts = []
+        self.postings = {}
+
+    def _catch_up(self):
+        roster = self.roster
+        postings = self.postings
+
+        for i in xrange(len(self.texts), len(roster)):
+            # The separator never appears in a query, so no match can
+            # straddle the name and the drink.
+            text = '%s\0%s' % (roster.name(i).lower(), roster.drink(i).lower())
+            self.texts.append(text)
+
+            grams = set()
+            for n in xrange(1, self.GRAM + 1):
+                for j in xrange(len(text) - n + 1):
+                    grams.add(text[j:j + n])
+
+            for gram in grams:
+                posting = postings.get(gram)
+                if posting is None:
+                    posting = postings[gram] = array('I')
+                posting.append(i)
+
+    def search(self, query):
+        """Returns the ids of everyone whose name or drink contains query,
+        ignoring case, in id order."""
+        self._catch_up()
+
+        query = query.lower()
+        if not query:
+            return range(len(self.texts))
+
+        n = min(len(query), self.GRAM)
+        rarest = None
+
+        for j in xrange(len(query) - n + 1):
+            posting = self.postings.get(query[j:j + n])
+            if posting is None:
+                return []
+            if rarest is None or len(posting) < len(rarest):
+                rarest = posting
+
+        if len(query) <= self.GRAM:
+            return list(rarest)
+
+        texts = self.texts
+        return [i for i in rarest if query in texts[i]]
+
+# vim: sts=4 sw=4
@@ -0,0 +1,488 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Bovine Buffet without the phone: a roster served over HTTP.
+# Copyright © 2010, Will Thompson <will@willthompson.co.uk>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Usage: ./server.py [--host HOST] [--port PORT] [--roster NAME]
+#
+# Everything is JSON:
+#
+#   GET  /people[?since=ID]  everyone (from ID on), with whether they're in
+#   POST /people             {"name", "drink", "vegetarian", "pizza"}: a
+#                            newcomer; "pizza" is optional
+#   GET  /people/ID
+#   PUT  /people/ID          {"attending": true/false, "drink": "...",
+#                            "pizza": "..."}, any of them: I'm in, I'm out,
+#                            I'm having this
+#   GET  /attending          the ids of everyone who's in
+#   POST /attending          {"added": [ID...], "removed": [ID...]}
+#   GET  /summary            what to order, as the main window shows it
+#   GET  /changes?since=VERSION&epoch=EPOCH
+#                            {"version", "epoch", "people"}: everyone changed
+#                            or added since VERSION of this server, or
+#                            everyone if that's too long ago to say (or
+#                            EPOCH isn't the server's any more)
+#
+# One lock covers the roster; requests each get a thread, and hold the lock
+# only for as long as it takes to change or read the roster in memory.
+# Writing to disk happens behind their backs, at most once a second, in the
+# same journal the app uses: what needs writing is taken under the lock,
+# and written (and synced, and compacted) outside it. A second lock keeps
+# threads out of each other's way in the journal; only newcomers, who are
+# written out at once, need both.
+
+from __future__ import with_statement
+
+import os
+import re
+import sys
+import time
+import socket
+import binascii
+import threading
+import urlparse
+import BaseHTTPServer
+import SocketServer
+from array import array
+from optparse import OptionParser
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+try:
+    from urlparse import parse_qs
+except ImportError:
+    from cgi import parse_qs
+
+from roster import Roster
+from rosters import RosterIndex
+from summary import SummaryAggregator
+
+class BadRequest(Exception):
+    pass
+
+class NotFound(Exception):
+    pass
+
+def _utf8(s):
+    if isinstance(s, unicode):
+        return s.encode('utf-8')
+    return s
+
+class RosterService(object):
+    # Taps arriving within this long of each other are written out together,
+    # as PeopleStore does.
+    SAVE_DELAY = 1.0
+
+    # Who changed is logged for this many changes, give or take; clients
+    # further behind than that are sent everyone.
+    LOG_LIMIT = 4096
+
+    def __init__(self, roster):
+        self.roster = roster
+        self.lock = threading.Lock()
+        # Taken before self.lock, if both are needed.
+        self.disk = threading.Lock()
+        self.aggregator = SummaryAggregator(roster)
+        self.aggregator.update(roster.attending)
+
+        # Every change to someone, adding them included, is a new version;
+        # log holds who changed in each version after log_start. Versions
+        # only mean anything to clients of this run of the server, so it
+        # has a name for them to check.
+        self.epoch = binascii.hexlify(os.urandom(8))
+        self.version = 0
+        self.log_start = 0
+        self.log = array('I')
+
+        self.dirty = threading.Event()
+        self.stopping = False
+        self.flusher = threading.Thread(target=self._flush_behind)
+        self.flusher.setDaemon(True)
+        self.flusher.start()
+
+    def _flush_behind(self):
+        while not self.stopping:
+            self.dirty.wait()
+            time.sleep(self.SAVE_DELAY)
+            self.flush()
+
+    def flush(self):
+        journal = self.roster.journal
+
+        with self.disk:
+            with self.lock:
+                self.dirty.clear()
+                if not self.roster.dirty():
+                    return
+
+            with journal.locked():
+                snapshot = None
+                with self.lock:
+                    merges = self.roster.merges
+                    self.roster.catch_up()
+                    self._recount(merges)
+
+                    records = self.roster.unwritten()
+                    if journal.needs_compaction(len(records)):
+                        snapshot = self.roster.frozen()
+
+                journal.append(records)
+                if snapshot is not None:
+                    order = snapshot.name_order()
+                    journal.compact(snapshot, order)
+                    with self.lock:
+                        self.roster.file_order = order
+
+    def _recount(self, merges):
+        # Writing means first taking in whatever anyone else sharing the
+        # roster file wrote; if there was anything, count again.
+        if self.roster.merges != merges:
+            self.aggregator = SummaryAggregator(self.roster)
+            self.aggregator.update(self.roster.attending)
+
+            # We don't know who they changed: clients had better look at
+            # everyone.
+            self.version += 1
+            self.log_start = self.version
+            self.log = array('I')
+
+    def _touched(self, ids):
+        self.log.extend(ids)
+        self.version += len(ids)
+
+        if len(self.log) > self.LOG_LIMIT:
+            n = len(self.log) // 2
+            del self.log[:n]
+            self.log_start += n
+
+    def close(self):
+        self.stopping = True
+        self.dirty.set()
+        self.flusher.join()
+
+    def _changed(self):
+        self.dirty.set()
+
+    def _check(self, person_id):
+        if not 0 <= person_id < len(self.roster):
+            raise NotFound("nobody has id %u" % person_id)
+
+    def _person(self, person_id):
+        name, drink, vegetarian, pizza = self.roster[person_id]
+        return {
+            'id': person_id,
+            'name': name,
+            'drink': drink,
+            'vegetarian': vegetarian,
+            'pizza': pizza,
+            'attending': person_id in self.roster.attending,
+        }
+
+    def people(self, since=0):
+        with self.lock:
+            return [self._person(i) for i in xrange(since, len(self.roster))]
+
+    def person(self, person_id):
+        with self.lock:
+            self._check(person_id)
+            return self._person(person_id)
+
+    def add_person(self, name, drink, vegetarian, pizza=''):
+        with self.disk, self.lock:
+            merges = self.roster.merges
+            person_id = self.roster.add_person(name, drink, vegetarian, pizza)
+            self._recount(merges)
+            self._touched([person_id])
+            self._changed()
+            return person_id
+
+    def update_person(self, person_id, attending=None, drink=None,
+                      pizza=None):
+        with self.lock:
+            self._check(person_id)
+
+            if drink is not None:
+                # The totals only follow once the roster has taken it.
+                old_drink_id = self.roster.drink_ids[person_id]
+                self.roster.set_drink(person_id, drink)
+                self.aggregator.drink_changed(person_id, old_drink_id)
+
+            if pizza is not None:
+                self.roster.set_pizza(person_id, pizza)
+
+            if attending is not None:
+                self._attend(attending and [person_id] or [],
+                             not attending and [person_id] or [])
+
+            self._touched([person_id])
+            self._changed()
+            return self._person(person_id)
+
+    def attending(self):
+        with self.lock:
+            return list(self.roster.attending)
+
+    def update_attending(self, added, removed):
+        with self.lock:
+            for person_id in added + removed:
+                self._check(person_id)
+
+            self._attend(added, removed)
+            self._touched(added + removed)
+            self._changed()
+            return list(self.roster.attending)
+
+    def changes(self, since=0, epoch=None):
+        with self.lock:
+            if epoch == self.epoch and \
+                    self.log_start <= since <= self.version:
+                ids = sorted(set(self.log[since - self.log_start:]))
+            else:
+                ids = xrange(len(self.roster))
+
+            return {
+                'epoch': self.epoch,
+                'version': self.version,
+                'people': [self._person(i) for i in ids],
+            }
+
+    def _attend(self, added, removed):
+        attending = self.roster.attending
+        attending.update(added)
+        attending.difference_update(removed)
+        self.aggregator.apply(added, removed)
+
+    def summary(self):
+        with self.lock:
+            return {
+                'people': len(self.aggregator),
+                'vegetarians': self.aggregator.vegetarians,
+                'drinks': self.aggregator.drink_counts(),
+                'markup': self.aggregator.markup(),
+            }
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Keep connections open, so that a client making lots of requests
+    # doesn't pay for a new one each time.
+    protocol_version = 'HTTP/1.1'
+
+    ROUTES = [
+        ('GET', '/people', 'get_people'),
+        ('POST', '/people', 'post_people'),
+        ('GET', '/people/(\d+)', 'get_person'),
+        ('PUT', '/people/(\d+)', 'put_person'),
+        ('GET', '/attending', 'get_attending'),
+        ('POST', '/attending', 'post_attending'),
+        ('GET', '/summary', 'get_summary'),
+        ('GET', '/changes', 'get_changes'),
+    ]
+    ROUTES = [(method, re.compile(pattern + '$'), name)
+              for method, pattern, name in ROUTES]
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        # Headers and body are separate writes; without this, the body waits
+        # on the client's delayed ACK of the headers.
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format,
+                                                              *args)
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def dispatch(self, method):
+        url = urlparse.urlsplit(self.path)
+        self.query = parse_qs(url.query)
+
+        status = 200
+        try:
+            for route_method, pattern, name in self.ROUTES:
+                match = pattern.match(url.path)
+                if match is not None and route_method == method:
+                    args = [int(x) for x in match.groups()]
+                    body = getattr(self, name)(*args)
+                    break
+            else:
+                raise NotFound("no such thing as %s %s" % (method, url.path))
+        except BadRequest, e:
+            status, body = 400, { 'error': str(e) }
+        except NotFound, e:
+            status, body = 404, { 'error': str(e) }
+
+        if method == 'POST' and status == 200:
+            status = 201
+
+        data = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length))
+        except ValueError, e:
+            raise BadRequest("couldn't parse body: %s" % e)
+
+        if not isinstance(body, dict):
+            raise BadRequest("expected an object")
+        return body
+
+    def get_people(self):
+        try:
+            since = int(self.query.get('since', ['0'])[0])
+        except ValueError:
+            since = -1
+        if since < 0:
+            raise BadRequest("since should be an id")
+        return { 'people': self.server.service.people(since) }
+
+    def string(self, body, key, default=None):
+        value = body.get(key)
+        if value is None:
+            return default
+        if not isinstance(value, basestring):
+            raise BadRequest("%s should be a string" % key)
+        return _utf8(value)
+
+    def ids(self, body, key):
+        value = body.get(key, [])
+        # JSON's true and false turn up as bools, which are ints too.
+        if not isinstance(value, list) or [i for i in value
+                if not isinstance(i, (int, long)) or isinstance(i, bool)]:
+            raise BadRequest("%s should be a list of ids" % key)
+        return value
+
+    def post_people(self):
+        body = self.read_json()
+        name = self.string(body, 'name', '').strip()
+        if not name:
+            raise BadRequest("newcomers need a name")
+
+        person_id = self.server.service.add_person(name,
+            self.string(body, 'drink', ''), bool(body.get('vegetarian')),
+            self.string(body, 'pizza', '').strip())
+        return { 'id': person_id }
+
+    def get_person(self, person_id):
+        return self.server.service.person(person_id)
+
+    def put_person(self, person_id):
+        body = self.read_json()
+
+        attending = body.get('attending')
+        if attending is not None:
+            attending = bool(attending)
+
+        drink = self.string(body, 'drink')
+
+        pizza = self.string(body, 'pizza')
+        if pizza is not None:
+            pizza = pizza.strip()
+
+        return self.server.service.update_person(person_id,
+            attending=attending, drink=drink, pizza=pizza)
+
+    def get_attending(self):
+        return { 'ids': self.server.service.attending() }
+
+    def post_attending(self):
+        body = self.read_json()
+        return { 'ids': self.server.service.update_attending(
+            self.ids(body, 'added'), self.ids(body, 'removed')) }
+
+    def get_summary(self):
+        return self.server.service.summary()
+
+    def get_changes(self):
+        try:
+            since = int(self.query.get('since', ['0'])[0])
+        except ValueError:
+            since = -1
+        if since < 0:
+            raise BadRequest("since should be a version")
+        epoch = self.query.get('epoch', [None])[0]
+        return self.server.service.changes(since, epoch)
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    # Room for everyone to connect at once, rather than the default 5.
+    request_queue_size = 128
+
+    def __init__(self, address, service, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+        self.service = service
+        self.verbose = verbose
+
+def serve(roster_path, host='127.0.0.1', port=8080, verbose=False):
+    """Returns a Server for the roster at roster_path, not yet serving."""
+    roster = Roster(roster_path)
+    if not roster.load():
+        roster.save()
+
+    return Server((host, port), RosterService(roster), verbose)
+
+def main(argv):
+    parser = OptionParser()
+    parser.add_option('--host', default='127.0.0.1',
+        help='address to listen on [%default]')
+    parser.add_option('--port', type='int', default=8080,
+        help='port to listen on [%default]')
+    parser.add_option('--roster', metavar='NAME',
+        help='roster to serve [the one the app last had open]')
+    parser.add_option('--verbose', action='store_true',
+        help='log every request')
+    options, args = parser.parse_args(argv[1:])
+
+    index = RosterIndex()
+    index.load()
+    name = options.roster or index.current
+    if name not in index:
+        index.add(name)
+
+    server = serve(index.path_for(name), options.host, options.port,
+                   options.verbose)
+    print "serving %s on http://%s:%u/" % ((name, ) + server.server_address)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+    server.service.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
+
+# vim: sts=4 sw=4
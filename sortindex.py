@@ -0,0 +1,171 @@
+# encoding: utf-8
+#
+# Person ids, kept in order as people arrive.
+# Copyright © 2010, Will Thompson <will@willthompson.co.uk>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import bisect
+import itertools
+from array import array
+
+class SortedIndex(object):
+    # Ids sorted by key(id), ties in id order, as a list of blocks of up to
+    # 2 * BLOCK ids each. Finding where someone goes is a binary search over
+    # the blocks and then within one, and slotting them in only shifts the
+    # rest of their block; so is finding someone who's already there. Keys
+    # are worked out when needed rather than stored, so key(id) mustn't
+    # change while id is in the index.
+    #
+    # Reading positions in order, as a tree view does, stays in one block
+    # most of the time; otherwise it's a binary search over where each block
+    # starts, which is worked out again after anything's inserted.
+    BLOCK = 1024
+
+    def __init__(self, key, ordered=()):
+        """ordered should already be sorted by key."""
+        self.key = key
+        self.blocks = []
+        ordered = array('I', ordered)
+        for i in xrange(0, len(ordered), self.BLOCK):
+            self.blocks.append(ordered[i:i + self.BLOCK])
+        self.length = len(ordered)
+
+        self._starts = None
+        # The last block read from, and where it starts.
+        self._block = None
+        self._start = 0
+
+    @classmethod
+    def sorted(cls, key, ids):
+        return cls(key, sorted(ids, key=lambda i: (key(i), i)))
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self.blocks)
+
+    def _block_starts(self):
+        if self._starts is None:
+            starts = array('l')
+            n = 0
+            for block in self.blocks:
+                starts.append(n)
+                n += len(block)
+            self._starts = starts
+        return self._starts
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += self.length
+
+        block = self._block
+        if block is None or not \
+                0 <= position - self._start < len(block):
+            if not 0 <= position < self.length:
+                raise IndexError("position %u out of range" % position)
+
+            starts = self._block_starts()
+            b = bisect.bisect_right(starts, position) - 1
+            block = self._block = self.blocks[b]
+            self._start = starts[b]
+
+        return block[position - self._start]
+
+    def take(self, positions):
+        """Returns the ids at positions, which must be in order, more
+        quickly than looking them up one at a time."""
+        ids = array('I')
+        blocks = iter(self.blocks)
+        block = ()
+        start = end = 0
+
+        for position in positions:
+            while position >= end:
+                start = end
+                block = blocks.next()
+                end += len(block)
+            ids.append(block[position - start])
+
+        return ids
+
+    def _find(self, person_id):
+        """Returns (block number, position within it) where person_id is, or
+        would go."""
+        key = self.key
+        k = key(person_id)
+        blocks = self.blocks
+
+        # The first block whose last id goes after person_id; or, if there's
+        # none, the end of the last block.
+        lo, hi = 0, len(blocks) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            last = blocks[mid][-1]
+            other = key(last)
+            if other < k or (other == k and last < person_id):
+                lo = mid + 1
+            else:
+                hi = mid
+
+        block = blocks[lo]
+        left, right = 0, len(block)
+        while left < right:
+            mid = (left + right) // 2
+            other = key(block[mid])
+            if other < k or (other == k and block[mid] < person_id):
+                left = mid + 1
+            else:
+                right = mid
+        return lo, left
+
+    def _position(self, b, i):
+        if self._starts is None:
+            # Cheaper than working out where every block starts.
+            return sum([len(block) for block in self.blocks[:b]]) + i
+        return self._starts[b] + i
+
+    def insert(self, person_id):
+        """Adds person_id; returns their position."""
+        if not self.blocks:
+            self.blocks.append(array('I'))
+
+        b, i = self._find(person_id)
+        block = self.blocks[b]
+        block.insert(i, person_id)
+        self.length += 1
+
+        if len(block) > 2 * self.BLOCK:
+            self.blocks[b:b + 1] = [block[:self.BLOCK], block[self.BLOCK:]]
+            if i >= self.BLOCK:
+                b += 1
+                i -= self.BLOCK
+
+        self._starts = None
+        self._block = None
+        return self._position(b, i)
+
+    def index(self, person_id):
+        """Returns person_id's position; raises ValueError if they're not
+        here."""
+        if self.blocks:
+            b, i = self._find(person_id)
+            block = self.blocks[b]
+            if i < len(block) and block[i] == person_id:
+                return self._position(b, i)
+        raise ValueError("%u is not in the index" % person_id)
+
+# vim: sts=4 sw=4
@@ -0,0 +1,89 @@
+# encoding: utf-8
+#
+# Running totals of who's coming to lunch, and what they're drinking.
+# Copyright © 2010, Will Thompson <will@willthompson.co.uk>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+from array import array
+
+from attendees import AttendeeSet
+
+class SummaryAggregator(object):
+    # Rather than recounting everyone on each tap, we only look at the
+    # people who were added to or removed from the selection. Drinks are
+    # counted by id, in an array indexed by the roster's drink ids.
+    def __init__(self, roster):
+        self.roster = roster
+        self.selected = AttendeeSet()
+        self.vegetarians = 0
+        self.drinks = array('l')
+
+    def __len__(self):
+        return len(self.selected)
+
+    def update(self, selected):
+        # selected is an AttendeeSet, so diffing it against our own costs a
+        # word comparison per 32 or 64 people, plus the people who changed.
+        self.apply(*self.selected.diff(selected))
+
+    def apply(self, added, removed):
+        for i in added:
+            if i not in self.selected:
+                self.selected.add(i)
+                self._count(i, 1)
+
+        for i in removed:
+            if i in self.selected:
+                self.selected.discard(i)
+                self._count(i, -1)
+
+    def drink_changed(self, i, old_drink_id):
+        """Call after i's drink has changed from old_drink_id."""
+        if i in self.selected:
+            self.drinks[old_drink_id] -= 1
+            self._count_drink(self.roster.drink_ids[i], 1)
+
+    def _count(self, i, delta):
+        if self.roster.vegetarians[i]:
+            self.vegetarians += delta
+        self._count_drink(self.roster.drink_ids[i], delta)
+
+    def _count_drink(self, drink_id, delta):
+        if drink_id >= len(self.drinks):
+            self.drinks.extend([0] * (drink_id + 1 - len(self.drinks)))
+        self.drinks[drink_id] += delta
+
+    def drink_counts(self):
+        """Returns [(drink name, count)], most popular first."""
+        names = self.roster.drinks
+        counts = [(names[drink_id], n) for drink_id, n in enumerate(self.drinks)
+                  if n]
+        counts.sort(key=(lambda pair: pair[1]), reverse=True)
+        return counts
+
+    def markup(self):
+        lines = [
+            "<b>Food:</b>",
+            "    %u people" % len(self.selected),
+            "    %u vegetarians" % self.vegetarians,
+            "",
+            "<b>Drinks:</b>",
+        ]
+        lines.extend(["    %u %s" % (n, drink)
+                      for drink, n in self.drink_counts()])
+        return "\n".join(lines)
+
+# vim: sts=4 sw=4
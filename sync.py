@@ -0,0 +1,412 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Merging rosters which have been changed in more than one place.
+# Copyright © 2010, Will Thompson <will@willthompson.co.uk>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Usage: ./sync.py ROSTER ROSTER
+#
+# Each copy of a roster is a replica, with a random name and a Lamport
+# clock, kept beside it in ROSTER.sync. Every write is stamped (clock,
+# replica):
+#
+#   - a person is known everywhere by the stamp of whoever added them (their
+#     local ids are just positions, and differ between replicas);
+#   - their drink, their usual pizza, and whether they're coming, are each
+#     last-writer-wins registers, with the highest stamp winning.
+#
+# Since clocks only go up, a replica's vector (the highest clock it's seen
+# from each replica) says which writes it has; a delta for it is everyone
+# with a stamp it hasn't seen. Merging a delta takes whichever stamp is
+# higher, field by field, so replicas end up the same whichever order the
+# deltas arrive in, and however often.
+#
+# The roster itself isn't touched by any of this: changes are noticed, and
+# stamped, when it's next synced, by comparing it with how it was left.
+# People who were on a roster before it was first synced are matched by
+# name, so two copies of the same roster don't end up with everyone twice.
+
+from __future__ import with_statement
+
+import os
+import sys
+import errno
+import binascii
+from array import array
+
+import cPickle
+
+from attendees import AttendeeSet
+
+# The origin of someone who was there before the first sync.
+_BY_NAME = 'name:'
+
+class SyncState(object):
+    def __init__(self, path):
+        self.path = path + '.sync'
+        self.replica = binascii.hexlify(os.urandom(8))
+        self.clock = 0
+        self.vector = {}
+
+        # Interned replica names, so the columns below can hold indices.
+        self.replicas = []
+        self._replica_ids = {}
+
+        # Per local id: who added them and when, and the stamps on their
+        # drink, pizza and attendance, as replica index and clock.
+        self.origin_replica = array('I')
+        self.origin_clock = array('I')
+        self.drink_replica = array('I')
+        self.drink_clock = array('I')
+        self.pizza_replica = array('I')
+        self.pizza_clock = array('I')
+        self.attend_replica = array('I')
+        self.attend_clock = array('I')
+        # (origin replica name, origin clock) -> local id
+        self.ids = {}
+
+        # The roster as it was when we last looked, so that we can tell
+        # what's been changed since.
+        self.seen_drinks = array('I')
+        self.seen_pizzas = array('I')
+        self.seen_attending = AttendeeSet()
+
+    def _intern(self, replica):
+        i = self._replica_ids.get(replica)
+        if i is None:
+            i = self._replica_ids[replica] = len(self.replicas)
+            self.replicas.append(replica)
+        return i
+
+    def _tick(self):
+        self.clock += 1
+        self.vector[self.replica] = self.clock
+        return self.clock
+
+    _COLUMNS = ('origin_replica', 'origin_clock', 'drink_replica',
+                'drink_clock', 'attend_replica', 'attend_clock',
+                'seen_drinks', 'pizza_replica', 'pizza_clock', 'seen_pizzas')
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                state = cPickle.load(f)
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+
+        self.replica = state['replica']
+        self.clock = state['clock']
+        self.vector = state['vector']
+        for replica in state['replicas']:
+            self._intern(replica)
+
+        for column in self._COLUMNS:
+            a = array('I')
+            if column in state:
+                a.fromstring(state[column])
+            else:
+                # From before pizzas were synced: never stamped, and seen as
+                # nobody having one, so any they have are stamped next time.
+                a.extend([0] * len(self.origin_clock))
+            setattr(self, column, a)
+        self.seen_attending = AttendeeSet.fromstring(state['seen_attending'])
+
+        for i in xrange(len(self.origin_clock)):
+            self.ids[self._origin(i)] = i
+
+        return True
+
+    def save(self):
+        state = {
+            'replica': self.replica,
+            'clock': self.clock,
+            'vector': self.vector,
+            'replicas': self.replicas,
+            'seen_attending': self.seen_attending.tostring(),
+        }
+        for column in self._COLUMNS:
+            state[column] = getattr(self, column).tostring()
+
+        tmp = self.path + '.new'
+        with open(tmp, 'wb') as f:
+            cPickle.dump(state, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, self.path)
+
+    def _origin(self, i):
+        return (self.replicas[self.origin_replica[i]], self.origin_clock[i])
+
+    def _track(self, origin, drink_stamp, attend_stamp, drink_id,
+               pizza_stamp, pizza_id):
+        i = len(self.origin_clock)
+        self.ids[origin] = i
+        self.origin_replica.append(self._intern(origin[0]))
+        self.origin_clock.append(origin[1])
+        self.drink_replica.append(self._intern(drink_stamp[1]))
+        self.drink_clock.append(drink_stamp[0])
+        self.pizza_replica.append(self._intern(pizza_stamp[1]))
+        self.pizza_clock.append(pizza_stamp[0])
+        self.attend_replica.append(self._intern(attend_stamp[1]))
+        self.attend_clock.append(attend_stamp[0])
+        self.seen_drinks.append(drink_id)
+        self.seen_pizzas.append(pizza_id)
+
+    def stamp(self, roster):
+        """Stamps whatever's changed in roster since we last looked."""
+        n = len(self.origin_clock)
+
+        if n < len(roster):
+            first = self.clock == 0
+            clock = self._tick()
+
+            if first:
+                # Everyone here predates syncing: they're known by name.
+                counts = {}
+                for i in xrange(len(roster)):
+                    name = roster.names[i]
+                    k = counts[name] = counts.get(name, 0) + 1
+                    self._track((_BY_NAME + name, k), (clock, self.replica),
+                        (clock, self.replica), roster.drink_ids[i],
+                        (clock, self.replica), roster.pizza_ids[i])
+            else:
+                for i in xrange(n, len(roster)):
+                    self._track((self.replica, self._tick()),
+                        (clock, self.replica), (clock, self.replica),
+                        roster.drink_ids[i],
+                        (clock, self.replica), roster.pizza_ids[i])
+
+            # Newcomers' attendance is stamped along with them, whatever it
+            # is; remember it as-is so it isn't stamped twice.
+            newcomers = AttendeeSet(i for i in roster.attending if i >= n)
+            self.seen_attending.update(newcomers)
+
+        me = self._intern(self.replica)
+
+        if self.seen_drinks != roster.drink_ids:
+            clock = self._tick()
+            for i in xrange(n):
+                if self.seen_drinks[i] != roster.drink_ids[i]:
+                    self.seen_drinks[i] = roster.drink_ids[i]
+                    self.drink_replica[i] = me
+                    self.drink_clock[i] = clock
+
+        if self.seen_pizzas != roster.pizza_ids:
+            clock = self._tick()
+            for i in xrange(n):
+                if self.seen_pizzas[i] != roster.pizza_ids[i]:
+                    self.seen_pizzas[i] = roster.pizza_ids[i]
+                    self.pizza_replica[i] = me
+                    self.pizza_clock[i] = clock
+
+        added, removed = self.seen_attending.diff(roster.attending)
+        if added or removed:
+            clock = self._tick()
+            for i in added + removed:
+                self.attend_replica[i] = me
+                self.attend_clock[i] = clock
+            self.seen_attending = roster.attending.copy()
+
+    def delta(self, roster, since):
+        """Returns everything in roster that a replica whose vector is since
+        hasn't seen, as something json or pickle can carry."""
+        # The newest write it's seen from each replica, by index. Being
+        # there from the start isn't news (what they're having is), so
+        # nothing counts as an unseen write from them.
+        seen = [replica.startswith(_BY_NAME) and sys.maxint or
+                since.get(replica, 0) for replica in self.replicas]
+
+        origin_replica, origin_clock = self.origin_replica, self.origin_clock
+        drink_replica, drink_clock = self.drink_replica, self.drink_clock
+        pizza_replica, pizza_clock = self.pizza_replica, self.pizza_clock
+        attend_replica, attend_clock = self.attend_replica, self.attend_clock
+
+        people = []
+        for i in xrange(len(origin_clock)):
+            new = origin_clock[i] > seen[origin_replica[i]]
+            if not (new or drink_clock[i] > seen[drink_replica[i]] or
+                    pizza_clock[i] > seen[pizza_replica[i]] or
+                    attend_clock[i] > seen[attend_replica[i]]):
+                continue
+
+            replica, clock = self._origin(i)
+            people.append([replica, clock,
+                # Only newcomers need introducing.
+                (new or replica.startswith(_BY_NAME)) and
+                    [roster.name(i), roster.is_vegetarian(i),
+                     roster.pizza(i)] or None,
+                roster.drink(i),
+                [drink_clock[i], self.replicas[drink_replica[i]]],
+                i in roster.attending,
+                [attend_clock[i], self.replicas[attend_replica[i]]],
+                # Last, so that replicas from before pizzas can ignore it.
+                roster.pizza(i),
+                [pizza_clock[i], self.replicas[pizza_replica[i]]],
+            ])
+
+        return {
+            'replica': self.replica,
+            'vector': dict(self.vector),
+            'people': people,
+        }
+
+    def merge(self, roster, delta):
+        """Brings roster up to date with delta, from another replica's
+        delta(). Returns how many people changed. The changes are made with
+        the roster's usual methods, so flush() it afterwards."""
+        with roster.batch():
+            # Anyone who arrived while we weren't holding the lock needs
+            # stamping first, or their ids and ours won't line up.
+            self.stamp(roster)
+            return self._merge(roster, delta)
+
+    def _merge(self, roster, delta):
+        changed = 0
+        clock = self.clock
+
+        for person in delta['people']:
+            (replica, origin_clock, intro, drink, drink_stamp, attending,
+                attend_stamp) = person[:7]
+            origin = (_utf8(replica), origin_clock)
+            drink = _utf8(drink)
+            drink_stamp = (drink_stamp[0], _utf8(drink_stamp[1]))
+            attend_stamp = (attend_stamp[0], _utf8(attend_stamp[1]))
+            clock = max(clock, drink_stamp[0], attend_stamp[0])
+
+            # Replicas from before pizzas were synced don't say; their
+            # silence never beats anything.
+            if len(person) > 7:
+                pizza, pizza_stamp = _utf8(person[7]), person[8]
+                pizza_stamp = (pizza_stamp[0], _utf8(pizza_stamp[1]))
+                clock = max(clock, pizza_stamp[0])
+            else:
+                pizza, pizza_stamp = None, None
+
+            i = self.ids.get(origin)
+            if i is None:
+                if intro is None:
+                    # They think we've met, but we haven't; there's nothing
+                    # to go on.
+                    continue
+
+                name, vegetarian = intro[:2]
+                if pizza is None:
+                    pizza = len(intro) > 2 and _utf8(intro[2]) or ''
+                    pizza_stamp = (0, origin[0])
+                i = roster.add_person(_utf8(name), drink, vegetarian, pizza)
+                self._track(origin, drink_stamp, attend_stamp,
+                            roster.drink_ids[i], pizza_stamp,
+                            roster.pizza_ids[i])
+                if attending:
+                    roster.attending.add(i)
+                    self.seen_attending.add(i)
+                changed += 1
+                continue
+
+            updated = False
+
+            # The stamp moves on even if the value doesn't, or we'd keep
+            # telling people about the older write.
+            if drink_stamp > self._stamp(self.drink_clock, self.drink_replica,
+                                         i):
+                if roster.drinks.lookup(drink) != roster.drink_ids[i]:
+                    roster.set_drink(i, drink)
+                    self.seen_drinks[i] = roster.drink_ids[i]
+                    updated = True
+                self.drink_clock[i] = drink_stamp[0]
+                self.drink_replica[i] = self._intern(drink_stamp[1])
+
+            if pizza is not None and pizza_stamp > self._stamp(
+                    self.pizza_clock, self.pizza_replica, i):
+                if roster.pizzas.lookup(pizza) != roster.pizza_ids[i]:
+                    roster.set_pizza(i, pizza)
+                    self.seen_pizzas[i] = roster.pizza_ids[i]
+                    updated = True
+                self.pizza_clock[i] = pizza_stamp[0]
+                self.pizza_replica[i] = self._intern(pizza_stamp[1])
+
+            if attend_stamp > self._stamp(self.attend_clock,
+                                          self.attend_replica, i):
+                if attending != (i in roster.attending):
+                    if attending:
+                        roster.attending.add(i)
+                        self.seen_attending.add(i)
+                    else:
+                        roster.attending.discard(i)
+                        self.seen_attending.discard(i)
+                    updated = True
+                self.attend_clock[i] = attend_stamp[0]
+                self.attend_replica[i] = self._intern(attend_stamp[1])
+
+            changed += updated
+
+        self.clock = clock
+        for replica, seen in delta['vector'].iteritems():
+            replica = _utf8(replica)
+            if seen > self.vector.get(replica, 0):
+                self.vector[replica] = seen
+
+        return changed
+
+    def _stamp(self, clocks, replicas, i):
+        return (clocks[i], self.replicas[replicas[i]])
+
+def _utf8(s):
+    if isinstance(s, unicode):
+        return s.encode('utf-8')
+    return s
+
+def sync(a, a_state, b, b_state):
+    """Brings rosters a and b, with their SyncStates, up to date with each
+    other. Returns how many people changed in each."""
+    a_state.stamp(a)
+    b_state.stamp(b)
+
+    to_a = b_state.delta(b, a_state.vector)
+    to_b = a_state.delta(a, b_state.vector)
+
+    return a_state.merge(a, to_a), b_state.merge(b, to_b)
+
+def main(argv):
+    from roster import Roster
+
+    if len(argv) != 3:
+        print >>sys.stderr, "usage: %s ROSTER ROSTER" % argv[0]
+        return 2
+
+    rosters = []
+    for path in argv[1:]:
+        roster = Roster(path)
+        roster.load()
+        state = SyncState(path)
+        state.load()
+        rosters += [roster, state]
+
+    changed = sync(*rosters)
+
+    for path, n, (roster, state) in zip(argv[1:], changed,
+            (rosters[0:2], rosters[2:4])):
+        roster.flush()
+        state.save()
+        print "%s: %u changed" % (path, n)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
+
+# vim: sts=4 sw=4
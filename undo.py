@@ -0,0 +1,77 @@
+# encoding: utf-8
+#
+# Undoing and redoing changes to who's coming.
+# Copyright © 2010, Will Thompson <will@willthompson.co.uk>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# Attendance is kept as a Snapshot after every change, each sharing what it
+# can with the one before, so a tap costs a chunk of bitmap rather than a
+# copy of the lot. Undoing or redoing hands back just the people to add and
+# remove, found by diffing neighbouring snapshots. Once there are more than
+# LIMIT, the oldest are forgotten.
+
+class UndoHistory(object):
+    LIMIT = 100
+
+    def __init__(self, attending, limit=LIMIT):
+        self.limit = limit
+        self.reset(attending)
+
+    def reset(self, attending):
+        """Forgets everything, starting again from attending."""
+        self.snapshots = [attending.snapshot()]
+        self.current = 0
+
+    def record(self, attending):
+        """Call whenever attending has changed. Anything undone is gone for
+        good, unless attending is just as it was."""
+        here = self.snapshots[self.current]
+        snapshot = attending.snapshot(here)
+        if snapshot == here:
+            return
+
+        del self.snapshots[self.current + 1:]
+        self.snapshots.append(snapshot)
+        if len(self.snapshots) > self.limit:
+            del self.snapshots[:len(self.snapshots) - self.limit]
+        self.current = len(self.snapshots) - 1
+
+    def can_undo(self):
+        return self.current > 0
+
+    def can_redo(self):
+        return self.current + 1 < len(self.snapshots)
+
+    def _move(self, step):
+        here = self.snapshots[self.current]
+        self.current += step
+        return here.diff(self.snapshots[self.current])
+
+    def undo(self):
+        """Returns (added, removed) to get back to how things were before
+        the last change, or None if there's nothing to undo."""
+        if not self.can_undo():
+            return None
+        return self._move(-1)
+
+    def redo(self):
+        """Returns (added, removed) to put back the last change undone, or
+        None."""
+        if not self.can_redo():
+            return None
+        return self._move(1)
+
+# vim: sts=4 sw=4